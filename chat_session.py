@@ -0,0 +1,162 @@
+"""
+Сессия диалога — одна схема для веба и Telegram.
+
+ChatSession хранит поля в __slots__ (без словаря на каждый объект),
+поэтому на один экземпляр процесса помещается больше одновременных
+посетителей. Названия процедур и этапы интернируются: одинаковые строки
+(в том числе пришедшие от AI) хранятся в одном экземпляре на процесс.
+Доступ как к словарю (session['name'], session.get(...)) сохранен, чтобы
+обработчики не зависели от способа хранения; записать поле вне схемы нельзя.
+
+Размер сессий можно измерить через measure_sessions (GET /metrics/sessions).
+"""
+
+import sys
+from collections import deque
+from datetime import datetime
+
+from conversation_memory import ConversationMemory
+
+CHANNEL_WEB = 'web'
+CHANNEL_TELEGRAM = 'telegram'
+
+# Поля с повторяющимися значениями: одна копия строки на процесс
+INTERNED_FIELDS = frozenset({'channel', 'stage', 'last_procedure', 'history_procedure', 'procedure_type'})
+
+class ChatSession:
+    """Состояние диалога одного клиента (веб или Telegram)."""
+
+    __slots__ = (
+        'channel', 'created_at', 'name', 'phone', 'stage',
+        'text_parts', 'dropped_messages', 'message_count', 'memory',
+        'telegram_sent', 'incomplete_sent', 'contacts_provided',
+        'procedure_mentioned', 'last_procedure', 'history_procedure', 'history_procedures',
+        'procedure_type', 'ai_intent',
+        'client_ip', 'telegram_chat_id', 'telegram_user_id', 'is_business', 'business_connection_id',
+    )
+
+    FIELDS = frozenset(__slots__)
+
+    def __init__(self, channel: str, created_at: datetime = None, **fields):
+        self.channel = sys.intern(channel)
+        self.created_at = created_at or datetime.now()
+        self.name = None
+        self.phone = None
+        self.stage = 'consultation'
+        self.text_parts = []
+        self.dropped_messages = 0
+        self.message_count = 0
+        self.memory = ConversationMemory()
+        self.telegram_sent = False
+        self.incomplete_sent = False
+        self.contacts_provided = False
+        self.procedure_mentioned = False
+        self.last_procedure = None
+        self.history_procedure = None
+        self.history_procedures = []
+        self.procedure_type = None
+        self.ai_intent = False
+        self.client_ip = None
+        self.telegram_chat_id = None
+        self.telegram_user_id = None
+        self.is_business = False
+        self.business_connection_id = None
+        for key, value in fields.items():
+            self[key] = value
+
+    def __getitem__(self, key: str):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value):
+        if key not in self.FIELDS:
+            raise KeyError(f"поля {key} нет в схеме сессии")
+        if key in INTERNED_FIELDS and isinstance(value, str):
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS
+
+    def get(self, key: str, default=None):
+        """Как dict.get: поля вне схемы (например, из старых заявок) дают default."""
+        value = getattr(self, key, default) if key in self.FIELDS else default
+        return default if value is None else value
+
+    def setdefault(self, key: str, default):
+        value = self.get(key)
+        if value is None:
+            self[key] = default
+            return default
+        return value
+
+    def to_dict(self) -> dict:
+        """Поля сессии для хранилища."""
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ChatSession':
+        """Сессия из to_dict; неизвестные поля (от старых версий) пропускаются."""
+        fields = {key: value for key, value in data.items() if key in cls.FIELDS}
+        channel = fields.pop('channel', CHANNEL_WEB)
+        created_at = fields.pop('created_at', None)
+        session = cls(channel, created_at, **fields)
+        session.history_procedures = [sys.intern(name) for name in session.history_procedures]
+        return session
+
+def new_web_session(client_ip: str = None) -> ChatSession:
+    """Новая сессия чата на сайте."""
+    return ChatSession(CHANNEL_WEB, client_ip=client_ip)
+
+def new_telegram_session(chat_id: int, user_id: int, is_business: bool = False) -> ChatSession:
+    """Новая сессия Telegram (личка боту или бизнес-аккаунт)."""
+    return ChatSession(CHANNEL_TELEGRAM, telegram_chat_id=chat_id, telegram_user_id=user_id, is_business=is_business)
+
+def footprint(obj, seen: set = None) -> int:
+    """
+    Сколько байт занимает объект вместе со всем, на что ссылается.
+    Объекты из seen не считаются повторно (общие интернированные строки
+    при измерении многих сессий учитываются один раз).
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool, datetime)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(footprint(k, seen) + footprint(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        return size + sum(footprint(item, seen) for item in obj)
+
+    for attribute in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, attribute):
+            size += footprint(getattr(obj, attribute), seen)
+    if hasattr(obj, '__dict__'):
+        size += footprint(obj.__dict__, seen)
+    return size
+
+def measure_sessions(sessions: list, total: int) -> dict:
+    """
+    Средний и максимальный размер сессий в памяти и размер тех же данных в виде dict.
+    sessions — выборка (ключ, сессия) из хранилища, total — сколько сессий всего.
+    """
+    sample = [session for _, session in sessions if isinstance(session, ChatSession)]
+    if not sample:
+        return {'sessions': total, 'sampled': 0}
+
+    sizes = [footprint(session) for session in sample]
+    dict_sizes = [footprint(session.to_dict()) for session in sample]
+    shared = set()
+    shared_total = sum(footprint(session, shared) for session in sample)
+    return {
+        'sessions': total,
+        'sampled': len(sample),
+        'avg_bytes': round(sum(sizes) / len(sizes)),
+        'max_bytes': max(sizes),
+        'avg_bytes_with_shared_strings': round(shared_total / len(sample)),
+        'avg_bytes_as_dict': round(sum(dict_sizes) / len(dict_sizes)),
+    }
@@ -1,18 +1,96 @@
-import replicate
 import re
 import json
-import os
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+import llm_client
+from procedure_index import build_procedure_index, select_relevant_procedures, PRICE_CONTEXT_TOKEN_BUDGET
+from reply_cache import reply_cache
+from keywords import PROCEDURE_WORDS
+from text_normalizer import normalize_message
+from local_classifier import build_procedure_classifier, classify_procedure
+from price_engine import find_price_answer, is_price_question
+from prices_loader import load_catalog
+
+# Кэш скомпилированного SYSTEM_PROMPT и производных от прайса.
+# Прайс и его версию (хэш содержимого procedures.json) дает prices_loader;
+# здесь все пересобирается, только когда версия сменилась.
+_catalog_cache = {
+    'version': None,
+    'data': None,
+    'system_prompt': None,
+    'formatted_procedures': None,
+    'procedure_index': None,
+    'procedure_classifier': None,
+    'clinic_section': None,
+    'compiled_at': None,
+    'compile_ms': None,
+}
+_catalog_lock = threading.Lock()
+
+def _refresh_catalog_cache():
+    """Пересобирает кэш, если prices_loader отдал прайс новой версии."""
+    data, version = load_catalog()
+    if version == _catalog_cache['version']:
+        return _catalog_cache
+    
+    with _catalog_lock:
+        # Другой поток мог уже обновить кэш
+        if version == _catalog_cache['version']:
+            return _catalog_cache
+        
+        started = time.perf_counter()
+        procedures = data.get('procedures', []) if isinstance(data, dict) else []
+        formatted_procedures = [(procedure, format_procedure_for_prompt(procedure)) for procedure in procedures]
+        system_prompt = _compile_system_prompt(data, formatted_procedures)
+        procedure_index = build_procedure_index(procedures)
+        procedure_classifier = build_procedure_classifier(procedures)
+        clinic_section = _format_clinic_section(data)
+        compile_ms = (time.perf_counter() - started) * 1000
+        
+        _catalog_cache.update({
+            'version': version,
+            'data': data,
+            'system_prompt': system_prompt,
+            'formatted_procedures': formatted_procedures,
+            'procedure_index': procedure_index,
+            'procedure_classifier': procedure_classifier,
+            'clinic_section': clinic_section,
+            'compiled_at': datetime.now(),
+            'compile_ms': compile_ms,
+        })
+        print(f"📋 SYSTEM_PROMPT скомпилирован: версия прайса {version}, {len(system_prompt)} символов, {compile_ms:.1f} мс")
+        return _catalog_cache
 
 # Загружаем прайс из файла
 def load_procedures_prices():
-    """Загружает полный прайс из файла."""
-    try:
-        file_path = os.path.join(os.path.dirname(__file__), 'data', 'procedures.json')
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"❌ Ошибка загрузки прайса: {e}")
-        return {}
+    """Возвращает полный прайс (из кэша, файл перечитывается только при изменении)."""
+    return _refresh_catalog_cache()['data'] or {}
+
+def get_catalog_version() -> str:
+    """Возвращает текущую версию прайса (хэш содержимого procedures.json)."""
+    return _refresh_catalog_cache()['version']
+
+def get_system_prompt_info() -> dict:
+    """Возвращает сведения о скомпилированном SYSTEM_PROMPT для мониторинга."""
+    cache = _refresh_catalog_cache()
+    return {
+        'catalog_version': cache['version'],
+        'compiled_at': cache['compiled_at'].isoformat() if cache['compiled_at'] else None,
+        'compile_ms': round(cache['compile_ms'], 2) if cache['compile_ms'] is not None else None,
+        'prompt_chars': len(cache['system_prompt'] or ''),
+        'procedures_count': len(cache['formatted_procedures'] or []),
+        'price_context_token_budget': PRICE_CONTEXT_TOKEN_BUDGET,
+    }
+
+def detect_procedure_locally(message: str) -> tuple:
+    """
+    Определяет процедуру локальным классификатором (без AI).
+    Возвращает (процедура или None, уверенность 0..1).
+    """
+    return classify_procedure(_refresh_catalog_cache()['procedure_classifier'], message)
 
 def format_procedure_for_prompt(procedure):
     """Форматирует процедуру для включения в промпт с описаниями аппаратов."""
@@ -100,11 +178,44 @@ def format_procedure_for_prompt(procedure):
     
     return result
 
-def create_system_prompt():
-    """Создает SYSTEM_PROMPT с актуальным прайсом и описаниями аппаратов."""
-    procedures_data = load_procedures_prices()
+def create_system_prompt(message: str = None, last_procedure: str = None):
+    """
+    Возвращает SYSTEM_PROMPT с актуальным прайсом.
+    Без сообщения — полный прайс (кэшируется по версии прайса).
+    С сообщением — только процедуры, относящиеся к сообщению и к last_procedure,
+    в пределах PRICE_CONTEXT_TOKEN_BUDGET, плюс краткий список остальных процедур.
+    """
+    cache = _refresh_catalog_cache()
+    formatted_procedures = cache['formatted_procedures']
     
-    base_prompt = """
+    if message is None or not formatted_procedures:
+        return cache['system_prompt']
+    
+    positions = select_relevant_procedures(cache['procedure_index'], message, last_procedure)
+    
+    selected = []
+    used_tokens = 0
+    for position in positions:
+        procedure, proc_desc = formatted_procedures[position]
+        proc_tokens = llm_client.estimate_tokens(proc_desc)
+        # Самую релевантную процедуру берем всегда, остальные — пока хватает бюджета
+        if selected and used_tokens + proc_tokens > PRICE_CONTEXT_TOKEN_BUDGET:
+            continue
+        selected.append((procedure, proc_desc))
+        used_tokens += proc_tokens
+    
+    selected_ids = {id(procedure) for procedure, _ in selected}
+    other_procedures = [procedure for procedure, _ in formatted_procedures if id(procedure) not in selected_ids]
+    
+    price_section = ""
+    if selected:
+        price_section = _format_price_section(selected, "📋 ПРАЙС ПО ПРОЦЕДУРАМ ИЗ ВОПРОСА КЛИЕНТА")
+        print(f"📋 В промпт добавлено процедур: {len(selected)} (~{used_tokens} токенов)")
+    
+    return BASE_SYSTEM_PROMPT + price_section + _format_catalog_overview(other_procedures) + cache['clinic_section']
+
+# Базовая часть SYSTEM_PROMPT (без прайса)
+BASE_SYSTEM_PROMPT = """
 Ты — Александра, менеджер клиники эстетической медицины GLADIS в Сочи.
 
 ТВОЙ СТИЛЬ ОБЩЕНИЯ:
@@ -143,52 +254,27 @@ def create_system_prompt():
 ВАЖНО: Рассрочку и кредит НЕ предоставляем!
 """
 
-    # Формируем детальный прайс
-    price_section = "\n" + "="*60 + "\n"
-    price_section += "📋 ПОЛНЫЙ ПРАЙС И ОПИСАНИЯ ПРОЦЕДУР GLADIS\n"
-    price_section += "="*60 + "\n\n"
-    
-    if procedures_data and 'procedures' in procedures_data:
-        # Группируем процедуры по категориям для удобства
-        categories = {}
-        
-        for procedure in procedures_data['procedures']:
-            category = procedure.get('category', 'другое')
-            
-            if category not in categories:
-                categories[category] = []
-            
-            categories[category].append(format_procedure_for_prompt(procedure))
-        
-        # Категории для отображения
-        category_names = {
-            'эпиляция': '🔥 ЛАЗЕРНАЯ ЭПИЛЯЦИЯ',
-            'чистка': '✨ ЧИСТКА ЛИЦА И ПИЛИНГИ',
-            'лифтинг': '🌟 ЛИФТИНГ И ОМОЛОЖЕНИЕ',
-            'омоложение': '💫 АППАРАТНОЕ ОМОЛОЖЕНИЕ',
-            'инъекции': '💉 ИНЪЕКЦИОННАЯ КОСМЕТОЛОГИЯ',
-            'мезотерапия': '💉 МЕЗОТЕРАПИЯ',
-            'брови_ресницы': '👁 БРОВИ И РЕСНИЦЫ',
-            'макияж': '💄 ПЕРМАНЕНТНЫЙ МАКИЯЖ',
-            'удаление': '❌ УДАЛЕНИЕ ТАТУ И ТАТУАЖА',
-            'лечение': '🏥 ЛЕЧЕБНЫЕ ПРОЦЕДУРЫ',
-            'консультация': '👨‍⚕️ ПРИЕМ ВРАЧЕЙ',
-            'уход': '🌸 УХОДОВЫЕ ПРОЦЕДУРЫ',
-            'массаж': '💆 МАССАЖ',
-            'капельницы': '💧 АВТОРСКИЕ КАПЕЛЬНИЦЫ',
-            'солярий': '☀️ СОЛЯРИЙ МЕЗАЗИМ'
-        }
-        
-        for category_ru, procedures_list in categories.items():
-            category_display = category_names.get(category_ru, category_ru.upper())
-            price_section += f"\n{category_display}:\n"
-            price_section += "-" * 40 + "\n"
-            for proc_desc in procedures_list:
-                price_section += proc_desc + "\n"
-    
-    else:
-        # Запасной прайс если файл не загрузился
-        price_section += """
+# Категории для отображения
+CATEGORY_NAMES = {
+    'эпиляция': '🔥 ЛАЗЕРНАЯ ЭПИЛЯЦИЯ',
+    'чистка': '✨ ЧИСТКА ЛИЦА И ПИЛИНГИ',
+    'лифтинг': '🌟 ЛИФТИНГ И ОМОЛОЖЕНИЕ',
+    'омоложение': '💫 АППАРАТНОЕ ОМОЛОЖЕНИЕ',
+    'инъекции': '💉 ИНЪЕКЦИОННАЯ КОСМЕТОЛОГИЯ',
+    'мезотерапия': '💉 МЕЗОТЕРАПИЯ',
+    'брови_ресницы': '👁 БРОВИ И РЕСНИЦЫ',
+    'макияж': '💄 ПЕРМАНЕНТНЫЙ МАКИЯЖ',
+    'удаление': '❌ УДАЛЕНИЕ ТАТУ И ТАТУАЖА',
+    'лечение': '🏥 ЛЕЧЕБНЫЕ ПРОЦЕДУРЫ',
+    'консультация': '👨‍⚕️ ПРИЕМ ВРАЧЕЙ',
+    'уход': '🌸 УХОДОВЫЕ ПРОЦЕДУРЫ',
+    'массаж': '💆 МАССАЖ',
+    'капельницы': '💧 АВТОРСКИЕ КАПЕЛЬНИЦЫ',
+    'солярий': '☀️ СОЛЯРИЙ МЕЗАЗИМ'
+}
+
+# Запасной прайс если файл не загрузился
+FALLBACK_PRICE_SECTION = """
 Основные процедуры и цены:
 
 1. ЛАЗЕРНАЯ ЭПИЛЯЦИЯ:
@@ -204,29 +290,79 @@ def create_system_prompt():
    • Хорошо погуляли: 5500 руб
    • При оплате 3-х капельниц -10%
 """
+
+def _format_price_section(formatted_procedures: list, title: str) -> str:
+    """Собирает раздел прайса из списка (процедура, текст), группируя по категориям."""
+    price_section = "\n" + "="*60 + "\n"
+    price_section += f"{title}\n"
+    price_section += "="*60 + "\n\n"
+    
+    # Группируем процедуры по категориям для удобства
+    categories = {}
+    for procedure, proc_desc in formatted_procedures:
+        category = procedure.get('category', 'другое')
+        categories.setdefault(category, []).append(proc_desc)
     
-    # Информация о клинике
+    for category_ru, procedures_list in categories.items():
+        category_display = CATEGORY_NAMES.get(category_ru, category_ru.upper())
+        price_section += f"\n{category_display}:\n"
+        price_section += "-" * 40 + "\n"
+        for proc_desc in procedures_list:
+            price_section += proc_desc + "\n"
+    
+    return price_section
+
+def _format_clinic_section(procedures_data) -> str:
+    """Раздел с информацией о клинике."""
+    clinic_section = ""
     if procedures_data and 'clinic_info' in procedures_data:
         clinic = procedures_data['clinic_info']
-        price_section += "\n" + "="*60 + "\n"
-        price_section += "🏥 ИНФОРМАЦИЯ О КЛИНИКЕ:\n"
-        price_section += "="*60 + "\n"
-        price_section += f"📍 Адрес в Сочи: {clinic.get('address_sochi', 'ул. Воровского, 22')}\n"
-        price_section += f"📍 Адрес в Адлере: {clinic.get('address_adler', 'ул. Кирова 26а')}\n"
-        price_section += f"📞 Телефон: {clinic.get('phone', '8-928-458-32-88')}\n"
-        price_section += f"⏰ Часы работы: {clinic.get('hours', 'Ежедневно 10:00–20:00')}\n"
-        price_section += f"💳 {clinic.get('no_installment', 'Рассрочка и кредитование предоставляются')}\n"
+        clinic_section += "\n" + "="*60 + "\n"
+        clinic_section += "🏥 ИНФОРМАЦИЯ О КЛИНИКЕ:\n"
+        clinic_section += "="*60 + "\n"
+        clinic_section += f"📍 Адрес в Сочи: {clinic.get('address_sochi', 'ул. Воровского, 22')}\n"
+        clinic_section += f"📍 Адрес в Адлере: {clinic.get('address_adler', 'ул. Кирова 26а')}\n"
+        clinic_section += f"📞 Телефон: {clinic.get('phone', '8-928-458-32-88')}\n"
+        clinic_section += f"⏰ Часы работы: {clinic.get('hours', 'Ежедневно 10:00–20:00')}\n"
+        clinic_section += f"💳 {clinic.get('no_installment', 'Рассрочка и кредитование предоставляются')}\n"
     
-    full_prompt = base_prompt + price_section
+    return clinic_section
+
+def _format_catalog_overview(procedures: list) -> str:
+    """Краткий список процедур без цен — чтобы AI знал обо всех услугах клиники."""
+    if not procedures:
+        return ""
     
-    return full_prompt
+    categories = {}
+    for procedure in procedures:
+        categories.setdefault(procedure.get('category', 'другое'), []).append(procedure.get('name', ''))
+    
+    overview = "\n" + "="*60 + "\n"
+    overview += "📚 ДРУГИЕ ПРОЦЕДУРЫ КЛИНИКИ (все доступны; цены не приведены — уточни у клиента процедуру или пригласи на консультацию)\n"
+    overview += "="*60 + "\n"
+    for category_ru, names in categories.items():
+        category_display = CATEGORY_NAMES.get(category_ru, category_ru.upper())
+        overview += f"{category_display}: {', '.join(names)}\n"
+    
+    return overview
+
+def _compile_system_prompt(procedures_data, formatted_procedures: list) -> str:
+    """Собирает полный SYSTEM_PROMPT с прайсом и описаниями аппаратов."""
+    if formatted_procedures:
+        price_section = _format_price_section(formatted_procedures, "📋 ПОЛНЫЙ ПРАЙС И ОПИСАНИЯ ПРОЦЕДУР GLADIS")
+    else:
+        price_section = "\n" + "="*60 + "\n"
+        price_section += "📋 ПОЛНЫЙ ПРАЙС И ОПИСАНИЯ ПРОЦЕДУР GLADIS\n"
+        price_section += "="*60 + "\n\n"
+        price_section += FALLBACK_PRICE_SECTION
+    
+    return BASE_SYSTEM_PROMPT + price_section + _format_clinic_section(procedures_data)
 
 def handle_pigmentation_question(message: str) -> tuple[bool, str]:
     """Проверяет, спрашивают ли о пигментных пятнах и возвращает ответ."""
-    message_lower = message.lower()
-    keywords = ["пигмент", "пятн", "веснушк", "пигментац", "темные пятна", "пигменти", "веснушки"]
+    message = normalize_message(message)
     
-    if any(keyword in message_lower for keyword in keywords):
+    if message.keywords.has('pigmentation'):
         procedures_data = load_procedures_prices()
         
         # Ищем фотоомоложение
@@ -270,28 +406,18 @@ def handle_pigmentation_question(message: str) -> tuple[bool, str]:
 
 def handle_apparatus_question_improved(message: str, last_procedure: str = None) -> tuple[bool, str]:
     """Улучшенная проверка: ТОЛЬКО явные вопросы про аппараты без контекста записи."""
-    message_lower = message.lower()
+    message = normalize_message(message)
+    matches = message.keywords
     
     # Если есть контекст процедуры и сообщение похоже на запись - пропускаем
-    if last_procedure and any(word in message_lower for word in ["завтра", "сегодня", "бикини", "подмышки"]):
+    if last_procedure and matches.has('booking_context'):
         return False, ""
     
     # ОЧЕНЬ явные вопросы про аппараты
-    explicit_apparatus_questions = [
-        "что такое инновейшен", "что такое innovation", 
-        "что такое quanta", "что такое кванта",
-        "что такое lumecca", "что такое люмекка",
-        "расскажи про аппарат", "какой аппарат лучше",
-        "чем отличается инновейшен", "какой лазер лучше",
-        "что за аппарат", "какое оборудование",
-        "аппараты", "оборудование", "техника"
-    ]
-    
-    for question in explicit_apparatus_questions:
-        if question in message_lower:
-            # Вместо вызова несуществующей функции, возвращаем ответ напрямую
-            if "innovation" in message_lower or "инновейшен" in message_lower:
-                return True, """🔬 Innovation — это гибридный лазер (диодный + александритовый) российского производства. 
+    if matches.has('apparatus_question'):
+        # Вместо вызова несуществующей функции, возвращаем ответ напрямую
+        if matches.has('apparatus', 'innovation'):
+            return True, """🔬 Innovation — это гибридный лазер (диодный + александритовый) российского производства. 
                 
 Преимущества:
 • Подходит для всех фототипов кожи
@@ -304,9 +430,9 @@ def handle_apparatus_question_improved(message: str, last_procedure: str = None)
 • Ноги полностью: 4500 руб.
 
 Хотите записаться на консультацию?"""
-            
-            elif "quanta" in message_lower or "кванта" in message_lower:
-                return True, """🔬 Quanta System — александритовый лазер итальянского производства. 
+        
+        elif matches.has('apparatus', 'quanta'):
+            return True, """🔬 Quanta System — александритовый лазер итальянского производства. 
                 
 Преимущества:
 • Лучший результат на смуглой коже
@@ -319,9 +445,9 @@ def handle_apparatus_question_improved(message: str, last_procedure: str = None)
 • Ноги полностью: 5800 руб.
 
 Хотите записаться?"""
-            
-            elif "lumecca" in message_lower or "люмекка" in message_lower:
-                return True, """✨ Lumecca (США) — современный аппарат для интенсивного импульсного света (IPL).
+        
+        elif matches.has('apparatus', 'lumecca'):
+            return True, """✨ Lumecca (США) — современный аппарат для интенсивного импульсного света (IPL).
                 
 Лучший способ для:
 • Удаления пигментных пятен
@@ -334,9 +460,9 @@ def handle_apparatus_question_improved(message: str, last_procedure: str = None)
 • Курс 3 процедуры: 10000 руб.
 
 Хотите записаться?"""
-            
-            else:
-                return True, """В клинике GLADIS используется современное оборудование:
+        
+        else:
+            return True, """В клинике GLADIS используется современное оборудование:
 
 🔬 Лазерная эпиляция:
 • Innovation (гибридный, Россия)
@@ -356,86 +482,9 @@ def handle_apparatus_question_improved(message: str, last_procedure: str = None)
     
     return False, ""
 
-def detect_application_intent_with_ai(api_key: str, conversation_history: str, current_message: str) -> bool:
-    """
-    Использует AI для определения, хочет ли клиент записаться на процедуру.
-    Возвращает True если клиент хочет записаться.
-    """
-    try:
-        prompt = f"""Проанализируй диалог и определи, хочет ли клиент записаться на процедуру в клинике косметологии.
-
-ПРАВИЛА АНАЛИЗА:
-1. Клиент ХОЧЕТ записаться если:
-   - Явно говорит "хочу записаться", "запишите меня", "запишите на"
-   - Просит записать на конкретную дату/время
-   - Дает свое имя и телефон после обсуждения процедуры
-   - Проходит конкретную процедуру (эпиляция бикини, чистка лица и т.д.)
-   - Спрашивает о записи и предоставляет контакты
-
-2. Клиент НЕ хочет записаться если:
-   - Только спрашивает информацию
-   - Просто интересуется без контактов
-   - Обсуждает в общем без конкретных планов
-
-ИСТОРИЯ ДИАЛОГА:
-{conversation_history}
-
-ПОСЛЕДНЕЕ СООБЩЕНИЕ КЛИЕНТА:
-"{current_message}"
-
-ВОПРОС: Клиент хочет записаться на процедуру? 
-
-ОТВЕТ (ТОЛЬКО "ДА" или "НЕТ"):"""
-
-        client = replicate.Client(api_token=api_key)
-        
-        output = client.run(
-            "meta/meta-llama-3-70b-instruct",
-            input={
-                "prompt": prompt,
-                "max_tokens": 10,
-                "temperature": 0.1,
-                "top_p": 0.9
-            }
-        )
-        
-        # Обрабатываем ответ
-        result = ""
-        if hasattr(output, '__iter__') and not isinstance(output, str):
-            for chunk in output:
-                if isinstance(chunk, str):
-                    result += chunk
-                else:
-                    result += str(chunk)
-        elif isinstance(output, str):
-            result = output
-        else:
-            result = str(output)
-        
-        result = result.strip().lower()
-        print(f"🤖 AI анализ намерения: '{result}'")
-        
-        # Проверяем ответ
-        if "да" in result:
-            return True
-        elif "нет" in result:
-            return False
-        else:
-            # Если AI дал неоднозначный ответ, проверяем по ключевым словам
-            current_lower = current_message.lower()
-            action_words = ["запис", "хочу", "нужно", "можно", "готов", "давайте"]
-            return any(word in current_lower for word in action_words)
-            
-    except Exception as e:
-        print(f"❌ Ошибка AI при анализе намерения: {str(e)}")
-        # Fallback: если в сообщении есть слова о действии
-        current_lower = current_message.lower()
-        action_words = ["запис", "хочу", "нужно", "можно", "готов", "давайте"]
-        return any(word in current_lower for word in action_words)
-
 def is_simple_greeting(message: str) -> bool:
     """Проверяет, является ли сообщение простым приветствием."""
-    message_lower = message.lower()
+    folded = normalize_message(message).folded
     
     greetings = [
         "добрый день", "добрый вечер", "доброе утро",
@@ -446,8 +495,8 @@ def is_simple_greeting(message: str) -> bool:
     
     # Если сообщение состоит только из приветствия
     for greeting in greetings:
-        if greeting in message_lower:
-            clean_msg = message_lower.replace(greeting, "").strip()
+        if greeting in folded:
+            clean_msg = folded.replace(greeting, "").strip()
             if not clean_msg or len(clean_msg.replace(" ", "")) < 3:
                 return True
     
@@ -455,26 +504,23 @@ def is_simple_greeting(message: str) -> bool:
 
 def is_registration_request(message: str) -> bool:
     """Определяет, хочет ли клиент записаться (улучшенная версия)."""
-    message_lower = message.lower()
+    matches = normalize_message(message).keywords
     
     # Явные фразы
-    if "запис" in message_lower:
-        if any(word in message_lower for word in ["хочу", "можно", "нужно", "готов", "давайте"]):
+    if matches.has('registration', 'booking'):
+        if matches.has('registration', 'ready'):
             return True
-        if any(word in message_lower for word in ["завтра", "сегодня", "после"]):
+        if matches.has('registration', 'time'):
             return True
     
     # Указание времени + зоны процедуры
-    if any(word in message_lower for word in ["завтра", "сегодня", "после"]):
-        if any(word in message_lower for word in ["бикини", "подмышки", "ноги", "голени", "бедра"]):
+    if matches.has('registration', 'time'):
+        if matches.has('registration', 'zone'):
             return True
     
     # Конкретная процедура + время
-    procedure_keywords = ["эпиляция", "чистка", "ботокс", "пилинг", "лифтинг"]
-    time_keywords = ["завтра", "сегодня", "в ", "во ", "после"]
-    
-    if any(proc in message_lower for proc in procedure_keywords):
-        if any(time in message_lower for time in time_keywords):
+    if matches.has('registration', 'procedure'):
+        if matches.has('registration', 'when'):
             return True
     
     return False
@@ -483,7 +529,8 @@ def should_add_contacts_to_reply(user_message: str, bot_reply: str, is_first_mes
     """
     Определяет, нужно ли добавлять контакты к ответу.
     """
-    user_lower = user_message.lower()
+    user_message = normalize_message(user_message)
+    matches = user_message.keywords
     reply_lower = bot_reply.lower()
     
     # Всегда добавляем контакты если:
@@ -492,7 +539,7 @@ def should_add_contacts_to_reply(user_message: str, bot_reply: str, is_first_mes
         return True
     
     # 2. Клиент спрашивает контакты
-    if any(word in user_lower for word in ["телефон", "адрес", "контакт", "позвонить", "номер", "как связаться"]):
+    if matches.has('contact_request'):
         return True
     
     # 3. В ответе уже просят контакты (явно)
@@ -507,7 +554,7 @@ def should_add_contacts_to_reply(user_message: str, bot_reply: str, is_first_mes
     # 4. Это завершение консультации (длинный ответ) И клиент проявлял интерес
     if len(bot_reply) > 300 and ("руб" in reply_lower or "стоимость" in reply_lower):
         # Проверяем, было ли в диалоге упоминание о записи
-        if "запис" in user_lower:
+        if matches.has('registration', 'booking'):
             return True
     
     # Не добавляем контакты если:
@@ -523,89 +570,117 @@ def should_add_contacts_to_reply(user_message: str, bot_reply: str, is_first_mes
     
     return False
 
-def generate_bot_reply(api_key: str, message: str, is_first_in_session: bool = False, 
-                      has_name: bool = False, has_phone: bool = False,
-                      telegram_sent: bool = False, last_procedure: str = None) -> str:
-    """Генерация ответа бота через Replicate API с максимальным использованием AI."""
-    try:
-        print(f"\n🤖 Генерация ответа AI")
-        print(f"   Сообщение: '{message}'")
-        print(f"   Первое в сессии: {is_first_in_session}")
-        print(f"   Есть имя: {has_name}, Есть телефон: {has_phone}")
-        print(f"   Telegram отправлен: {telegram_sent}")
-        print(f"   Контекст процедуры: {last_procedure or 'Нет контекста'}")
-        
-        message_lower = message.lower()
-        
-        # 1. ОЧЕНЬ простые случаи обрабатываем сразу (оптимизация)
-        if is_simple_greeting(message_lower):
-            if is_first_in_session:
-                return "Здравствуйте! Клиника GLADIS, меня зовут Александра. Чем могу вам помочь?"
-            else:
-                return "Чем могу вам помочь?"
-        
-        # 2. Вопросы про пигментацию (очень специфично)
-        is_pigmentation, pigmentation_response = handle_pigmentation_question(message)
-        if is_pigmentation:
-            print("🎯 Вопрос про пигментацию - использую подготовленный ответ")
-            return pigmentation_response
-        
-        # 3. Проверяем, явный ли это запрос на запись
-        basic_registration_check = is_registration_request(message)
-        
-        # 4. Вопросы про аппараты - ТОЛЬКО если это точно не запрос и явный вопрос
-        if not basic_registration_check:
-            is_apparatus, apparatus_response = handle_apparatus_question_improved(message, last_procedure)
-            if is_apparatus:
-                print("⚙️ Явный вопрос про аппарат - использую подготовленный ответ")
-                return apparatus_response
-        
-        # 5. ВСЁ ОСТАЛЬНОЕ отдаем AI с полным контекстом
-        system_prompt = create_system_prompt()
-        
-        # Формируем БОГАТЫЙ контекст для AI
-        context_lines = []
-        
-        # Информация о сессии
-        context_lines.append(f"📊 СТАТУС СЕССИИ:")
-        context_lines.append(f"   • {'Начало диалога - представься' if is_first_in_session else 'Диалог уже идет - не представляйся'}")
-        context_lines.append(f"   • {'✅ Есть имя клиента' if has_name else '❌ Имя не указано'}")
-        context_lines.append(f"   • {'✅ Есть телефон клиента' if has_phone else '❌ Телефон не указан'}")
-        
-        if telegram_sent:
-            context_lines.append(f"   • ✅ ЗАЯВКА УЖЕ ОТПРАВЛЕНА МЕНЕДЖЕРУ")
-            context_lines.append(f"   • Клиент продолжает диалог после отправки заявки - отвечай на вопросы как обычно, не предлагай записаться повторно")
+def find_ready_reply(message: str, is_first_in_session: bool = False,
+                     has_name: bool = False, has_phone: bool = False,
+                     telegram_sent: bool = False, last_procedure: str = None) -> str:
+    """
+    Готовый ответ без AI (приветствие, пигментация, аппараты, цена из прайса).
+    Возвращает ответ или None, если нужен AI.
+    """
+    print(f"\n🤖 Генерация ответа AI")
+    print(f"   Сообщение: '{message}'")
+    print(f"   Первое в сессии: {is_first_in_session}")
+    print(f"   Есть имя: {has_name}, Есть телефон: {has_phone}")
+    print(f"   Telegram отправлен: {telegram_sent}")
+    print(f"   Контекст процедуры: {last_procedure or 'Нет контекста'}")
+    
+    message = normalize_message(message)
+    
+    # 1. ОЧЕНЬ простые случаи обрабатываем сразу (оптимизация)
+    if is_simple_greeting(message):
+        if is_first_in_session:
+            return "Здравствуйте! Клиника GLADIS, меня зовут Александра. Чем могу вам помочь?"
         else:
-            context_lines.append(f"   • 📝 Заявка еще не отправлена")
-        
-        # Контекст процедуры
-        if last_procedure:
-            context_lines.append(f"\n📋 ИСТОРИЯ ПРОЦЕДУРЫ:")
-            context_lines.append(f"   • Ранее обсуждалась/интересовались: {last_procedure}")
-            context_lines.append(f"   • Если клиент хочет записаться без уточнений - предполагаем эту процедуру")
-        
-        # Анализ текущего сообщения
-        context_lines.append(f"\n🎯 АНАЛИЗ ТЕКУЩЕГО СООБЩЕНИЯ:")
-        context_lines.append(f"   • Сообщение: \"{message}\"")
-        
-        # Определяем тип сообщения (для AI)
-        msg_type = []
-        if basic_registration_check:
-            msg_type.append("запрос на запись")
-        if "цена" in message_lower or "стоимость" in message_lower or "сколько" in message_lower:
-            msg_type.append("вопрос о цене")
-        if any(word in message_lower for word in ["бикини", "подмышки", "ноги", "лицо", "шея"]):
-            msg_type.append("указана конкретная зона")
-        if "завтра" in message_lower or "сегодня" in message_lower:
-            msg_type.append("указано время")
-        
-        if msg_type:
-            context_lines.append(f"   • Тип: {', '.join(msg_type)}")
-        
-        context_section = "\n".join(context_lines)
-        
-        # ОСНОВНОЙ ПРОМПТ ДЛЯ AI
-        full_prompt = f"""{system_prompt}
+            return "Чем могу вам помочь?"
+    
+    # 2. Вопросы про пигментацию (очень специфично)
+    is_pigmentation, pigmentation_response = handle_pigmentation_question(message)
+    if is_pigmentation:
+        print("🎯 Вопрос про пигментацию - использую подготовленный ответ")
+        return pigmentation_response
+    
+    # 3. Проверяем, явный ли это запрос на запись
+    basic_registration_check = is_registration_request(message)
+    
+    # 4. Вопросы про аппараты - ТОЛЬКО если это точно не запрос и явный вопрос
+    if not basic_registration_check:
+        is_apparatus, apparatus_response = handle_apparatus_question_improved(message, last_procedure)
+        if is_apparatus:
+            print("⚙️ Явный вопрос про аппарат - использую подготовленный ответ")
+            return apparatus_response
+    
+    # 5. Вопросы о цене - ответ прямо из прайса, если он однозначен
+    if not basic_registration_check:
+        price_answer, handoff_reason = find_price_answer(message, last_procedure)
+        if price_answer:
+            if is_first_in_session:
+                price_answer = "Здравствуйте! " + price_answer
+            return price_answer
+        if is_price_question(message):
+            print(f"💬 Вопрос о цене передан AI: {handoff_reason}")
+    
+    # 6. ВСЁ ОСТАЛЬНОЕ отдаем AI
+    return None
+
+def build_reply_prompt(message: str, is_first_in_session: bool = False,
+                       has_name: bool = False, has_phone: bool = False,
+                       telegram_sent: bool = False, last_procedure: str = None,
+                       history: str = None) -> str:
+    """Собирает промпт для AI (прайс — только по процедурам из вопроса)."""
+    message = normalize_message(message)
+    matches = message.keywords
+    basic_registration_check = is_registration_request(message)
+    
+    system_prompt = create_system_prompt(message, last_procedure)
+    
+    # Формируем БОГАТЫЙ контекст для AI
+    context_lines = []
+    
+    # Информация о сессии
+    context_lines.append(f"📊 СТАТУС СЕССИИ:")
+    context_lines.append(f"   • {'Начало диалога - представься' if is_first_in_session else 'Диалог уже идет - не представляйся'}")
+    context_lines.append(f"   • {'✅ Есть имя клиента' if has_name else '❌ Имя не указано'}")
+    context_lines.append(f"   • {'✅ Есть телефон клиента' if has_phone else '❌ Телефон не указан'}")
+    
+    if telegram_sent:
+        context_lines.append(f"   • ✅ ЗАЯВКА УЖЕ ОТПРАВЛЕНА МЕНЕДЖЕРУ")
+        context_lines.append(f"   • Клиент продолжает диалог после отправки заявки - отвечай на вопросы как обычно, не предлагай записаться повторно")
+    else:
+        context_lines.append(f"   • 📝 Заявка еще не отправлена")
+    
+    # Контекст процедуры
+    if last_procedure:
+        context_lines.append(f"\n📋 ИСТОРИЯ ПРОЦЕДУРЫ:")
+        context_lines.append(f"   • Ранее обсуждалась/интересовались: {last_procedure}")
+        context_lines.append(f"   • Если клиент хочет записаться без уточнений - предполагаем эту процедуру")
+    
+    # История диалога (размер ограничен бюджетом токенов conversation_memory)
+    if history:
+        context_lines.append(f"\n💬 ИСТОРИЯ ДИАЛОГА:")
+        context_lines.append(history)
+    
+    # Анализ текущего сообщения
+    context_lines.append(f"\n🎯 АНАЛИЗ ТЕКУЩЕГО СООБЩЕНИЯ:")
+    context_lines.append(f"   • Сообщение: \"{message}\"")
+    
+    # Определяем тип сообщения (для AI)
+    msg_type = []
+    if basic_registration_check:
+        msg_type.append("запрос на запись")
+    if matches.has('message_type', 'price'):
+        msg_type.append("вопрос о цене")
+    if matches.has('message_type', 'zone'):
+        msg_type.append("указана конкретная зона")
+    if matches.has('message_type', 'time'):
+        msg_type.append("указано время")
+    
+    if msg_type:
+        context_lines.append(f"   • Тип: {', '.join(msg_type)}")
+    
+    context_section = "\n".join(context_lines)
+    
+    # ОСНОВНОЙ ПРОМПТ ДЛЯ AI
+    full_prompt = f"""{system_prompt}
 
 ================================================================================
 КОНТЕКСТ ДЛЯ AI (ЭТО ВИДИШЬ ТОЛЬКО ТЫ):
@@ -622,7 +697,7 @@ def generate_bot_reply(api_key: str, message: str, is_first_in_session: bool = F
 
 ШАГ A: ЕСЛИ КЛИЕНТ ХОЧЕТ ЗАПИСАТЬСЯ
 {"1. Клиент явно хочет записаться (есть слова 'записаться', 'завтра' и т.д.)" if basic_registration_check else ""}
-{"2. Используй контекст процедуры если клиент не уточнил: '{last_procedure}'" if last_procedure and not any(word in message_lower for word in ["эпиляция", "чистка", "ботокс"]) else ""}
+{"2. Используй контекст процедуры если клиент не уточнил: '{last_procedure}'" if last_procedure and not matches.has('message_type', 'procedure') else ""}
 3. ДЕЙСТВИЯ:
    • Подтверди процедуру/зону если указаны
    • Если процедура не ясна - УТОЧНИ ("На какую процедуру хотите записаться?")
@@ -650,93 +725,198 @@ def generate_bot_reply(api_key: str, message: str, is_first_in_session: bool = F
 2. Ответь согласно анализу выше
 3. Будь экспертом, но дружелюбной
 4. Используй смайлики если уместно
-5. {"Упомяни скидки/акции если спрашивают про цены" if "цена" in message_lower or "стоимость" in message_lower else ""}
+5. {"Упомяни скидки/акции если спрашивают про цены" if matches.has('message_type', 'discount') else ""}
 
 ОТВЕТ:"""
+    
+    return full_prompt
+
+def finalize_bot_reply(result: str, message: str, is_first_in_session: bool = False,
+                       telegram_sent: bool = False) -> str:
+    """Постобработка сырого ответа AI: чистка приветствий и запрос контактов."""
+    message = normalize_message(message)
+    result = result.strip()
+    print(f"   Ответ AI (сырой): '{result[:200]}...'")
+    
+    # Очищаем ответ если нужно
+    if not result or len(result) < 10:
+        result = "Извините, не удалось обработать запрос. Пожалуйста, позвоните нам по телефону 8-928-458-32-88 для консультации."
+    
+    # Убираем повторные приветствия если не первое сообщение
+    if not is_first_in_session:
+        result = re.sub(r'^Здравствуйте[!\.]?\s*', '', result)
+        result = re.sub(r'^Добрый день[!\.]?\s*', '', result)
+        result = re.sub(r'^Добрый вечер[!\.]?\s*', '', result)
+        result = re.sub(r'^Привет[!\.]?\s*', '', result)
+        result = re.sub(r'^Меня зовут Александра[!\.]?\s*', '', result)
+    
+    # Автокоррекция: если AI забыл попросить контакты при явной записи (только если заявка еще не отправлена)
+    if is_registration_request(message) and message.keywords.has('registration', 'booking') and not telegram_sent:
+        # Проверяем, попросил ли AI контакты
+        has_contacts_request = any(phrase in result.lower() for phrase in [
+            "имя и телефон", "ваше имя", "номер телефона", "контакт", "телефон"
+        ])
         
-        # Используем AI
-        client = replicate.Client(api_token=api_key)
+        if not has_contacts_request and "спасибо" not in result.lower():
+            # Добавляем запрос контактов
+            result += "\n\nДля записи укажите, пожалуйста, ваше имя и телефон для связи."
+    
+    return result
+
+def get_ai_error_fallback(message: str, telegram_sent: bool = False, last_procedure: str = None) -> str:
+    """Ответ на случай ошибки AI."""
+    matches = normalize_message(message).keywords
+    
+    if matches.has('error_fallback', 'contacts'):
+        return "Клиника GLADIS:\n📞 Телефон: 8-928-458-32-88\n📍 Адреса: Сочи, ул. Воровского, 22 и Адлер, ул. Кирова, д. 26а"
+    elif matches.has('error_fallback', 'pigmentation'):
+        return "Для удаления пигментных пятен лучший способ — фотоомоложение на аппарате Lumecca (США)! Цена от 4000 руб. за лицо. Хотите записаться?"
+    elif telegram_sent:
+        # Если заявка уже отправлена, но AI упал
+        return "Извините за техническую неполадку. Чем еще могу помочь? Если есть вопросы по процедурам, спрашивайте!"
+    elif matches.has('error_fallback', 'booking'):
+        if last_procedure:
+            return f"Для записи на {last_procedure} укажите ваше имя и телефон. Телефон клиники: 8-928-458-32-88"
+        else:
+            return "Для записи укажите ваше имя и телефон. Также, пожалуйста, уточните на какую процедуру хотите записаться. Телефон клиники: 8-928-458-32-88"
+    else:
+        return "Для консультации по процедурам позвоните по телефону 8-928-458-32-88"
+
+def _reply_cache_lookup(message: str, is_first_in_session: bool, has_name: bool, has_phone: bool,
+                        telegram_sent: bool, last_procedure: str = None, history: str = None) -> tuple:
+    """Ищет готовый ответ AI в кэше (до сборки промпта). Возвращает (ключ, версия прайса, ответ или None)."""
+    cache_key = reply_cache.make_key(message, is_first_in_session, has_name, has_phone, telegram_sent,
+                                     last_procedure, history)
+    catalog_version = get_catalog_version()
+    cached_reply = reply_cache.get(cache_key, catalog_version)
+    if cached_reply is not None:
+        print("💾 Ответ взят из кэша")
+    return cache_key, catalog_version, cached_reply
+
+def _reply_cache_store(cache_key: tuple, catalog_version: str, raw_result: str, reply: str):
+    """Кэширует ответ AI (пустые и обрезанные ответы не кэшируются)."""
+    if raw_result and len(raw_result.strip()) >= 10:
+        reply_cache.put(cache_key, reply, catalog_version)
+
+class _BotReplyTurn:
+    """
+    Общие шаги ответа бота вокруг вызова модели: готовый ответ или кэш,
+    промпт, постобработка, запись в кэш, fallback при ошибке.
+    Асинхронный и потоковый варианты отличаются только самим вызовом модели.
+    """
+
+    def __init__(self, message: str, is_first_in_session: bool, has_name: bool, has_phone: bool,
+                 telegram_sent: bool, last_procedure: str, history: str):
+        self.message = normalize_message(message)
+        self.is_first_in_session = is_first_in_session
+        self.has_name = has_name
+        self.has_phone = has_phone
+        self.telegram_sent = telegram_sent
+        self.last_procedure = last_procedure
+        self.history = history
+        self.prompt = None
+        self.cache_key = None
+        self.catalog_version = None
+
+    def start(self) -> str:
+        """Готовый или закэшированный ответ; если его нет — собирает self.prompt и возвращает None."""
+        ready_reply = find_ready_reply(
+            self.message, self.is_first_in_session, self.has_name, self.has_phone,
+            self.telegram_sent, self.last_procedure
+        )
+        if ready_reply is not None:
+            return ready_reply
         
-        output = client.run(
-            "meta/meta-llama-3-70b-instruct",
-            input={
-                "prompt": full_prompt,
-                "max_tokens": 1000,
-                "temperature": 0.7,
-                "top_p": 0.9
-            }
+        self.cache_key, self.catalog_version, cached_reply = _reply_cache_lookup(
+            self.message, self.is_first_in_session, self.has_name, self.has_phone,
+            self.telegram_sent, self.last_procedure, self.history
         )
+        if cached_reply is not None:
+            return cached_reply
         
-        # Обрабатываем ответ
-        result = ""
-        if hasattr(output, '__iter__') and not isinstance(output, str):
-            for chunk in output:
-                if isinstance(chunk, str):
-                    result += chunk
-                else:
-                    result += str(chunk)
-        elif isinstance(output, str):
-            result = output
+        self.prompt = build_reply_prompt(
+            self.message, self.is_first_in_session, self.has_name, self.has_phone,
+            self.telegram_sent, self.last_procedure, self.history
+        )
+        return None
+
+    def finish(self, result: str) -> str:
+        """Постобработка ответа модели и запись в кэш."""
+        reply = finalize_bot_reply(result, self.message, self.is_first_in_session, self.telegram_sent)
+        _reply_cache_store(self.cache_key, self.catalog_version, result, reply)
+        return reply
+
+    def fallback(self, error: Exception) -> str:
+        """Ответ без AI, если модель недоступна, упала или не уложилась в бюджет времени."""
+        if isinstance(error, llm_client.LLMUnavailableError):
+            print(f"⚡ {error}, отдаем fallback")
+        elif isinstance(error, asyncio.TimeoutError):
+            print("⚠️ Модель не уложилась в бюджет времени, отдаем fallback")
         else:
-            result = str(output)
-        
-        result = result.strip()
-        print(f"   Ответ AI (сырой): '{result[:200]}...'")
-        
-        # Очищаем ответ если нужно
-        if not result or len(result) < 10:
-            result = "Извините, не удалось обработать запрос. Пожалуйста, позвоните нам по телефону 8-928-458-32-88 для консультации."
-        
-        # Убираем повторные приветствия если не первое сообщение
-        if not is_first_in_session:
-            result = re.sub(r'^Здравствуйте[!\.]?\s*', '', result)
-            result = re.sub(r'^Добрый день[!\.]?\s*', '', result)
-            result = re.sub(r'^Добрый вечер[!\.]?\s*', '', result)
-            result = re.sub(r'^Привет[!\.]?\s*', '', result)
-            result = re.sub(r'^Меня зовут Александра[!\.]?\s*', '', result)
-        
-        # Автокоррекция: если AI забыл попросить контакты при явной записи (только если заявка еще не отправлена)
-        if basic_registration_check and "запис" in message_lower and not telegram_sent:
-            # Проверяем, попросил ли AI контакты
-            has_contacts_request = any(phrase in result.lower() for phrase in [
-                "имя и телефон", "ваше имя", "номер телефона", "контакт", "телефон"
-            ])
-            
-            if not has_contacts_request and "спасибо" not in result.lower():
-                # Добавляем запрос контактов
-                result += "\n\nДля записи укажите, пожалуйста, ваше имя и телефон для связи."
+            import traceback
+            print(f"❌ Ошибка AI: {str(error)}")
+            print(f"❌ Traceback: {traceback.format_exc()}")
+        return get_ai_error_fallback(self.message, self.telegram_sent, self.last_procedure)
+
+async def generate_bot_reply_async(api_key: str, message: str, is_first_in_session: bool = False,
+                                   has_name: bool = False, has_phone: bool = False,
+                                   telegram_sent: bool = False, last_procedure: str = None,
+                                   history: str = None) -> str:
+    """
+    Генерация ответа бота через Replicate API с максимальным использованием AI.
+    Если корутину отменить (например, по asyncio.wait_for), запрос к модели прерывается.
+    """
+    turn = _BotReplyTurn(message, is_first_in_session, has_name, has_phone, telegram_sent, last_procedure, history)
+    try:
+        reply = turn.start()
+        if reply is not None:
+            return reply
         
-        return result
-            
+        result = await llm_client.run_text_async(turn.prompt, max_tokens=1000, temperature=0.7, api_key=api_key, site='reply')
+        return turn.finish(result)
     except Exception as e:
-        print(f"❌ Ошибка AI: {str(e)}")
-        import traceback
-        print(f"❌ Traceback: {traceback.format_exc()}")
-        
-        # Fallback на случай ошибки AI
-        message_lower = message.lower()
-        
-        if "адрес" in message_lower or "телефон" in message_lower:
-            return "Клиника GLADIS:\n📞 Телефон: 8-928-458-32-88\n📍 Адреса: Сочи, ул. Воровского, 22 и Адлер, ул. Кирова, д. 26а"
-        elif "пигмент" in message_lower or "пятн" in message_lower:
-            return "Для удаления пигментных пятен лучший способ — фотоомоложение на аппарате Lumecca (США)! Цена от 4000 руб. за лицо. Хотите записаться?"
-        elif telegram_sent:
-            # Если заявка уже отправлена, но AI упал
-            return "Извините за техническую неполадку. Чем еще могу помочь? Если есть вопросы по процедурам, спрашивайте!"
-        elif "запис" in message_lower:
-            if last_procedure:
-                return f"Для записи на {last_procedure} укажите ваше имя и телефон. Телефон клиники: 8-928-458-32-88"
-            else:
-                return "Для записи укажите ваше имя и телефон. Также, пожалуйста, уточните на какую процедуру хотите записаться. Телефон клиники: 8-928-458-32-88"
-        else:
-            return "Для консультации по процедурам позвоните по телефону 8-928-458-32-88"
+        return turn.fallback(e)
 
-def extract_name_with_ai(api_key: str, message: str) -> str:
+async def stream_bot_reply(api_key: str, message: str, is_first_in_session: bool = False,
+                           has_name: bool = False, has_phone: bool = False,
+                           telegram_sent: bool = False, last_procedure: str = None,
+                           history: str = None, token_timeout: float = None):
     """
-    Использует AI для извлечения имени человека из сообщения.
+    Потоковая генерация ответа через Replicate.
+    Выдает события ('token', текст) по мере генерации и в конце ('done', итоговый ответ).
+    Каждый фрагмент (и первый тоже) ждем не дольше token_timeout
+    (по умолчанию LLM_REPLY_TIMEOUT), иначе генерация отменяется и
+    итоговый ответ — fallback.
     """
+    if token_timeout is None:
+        token_timeout = llm_client.LLM_REPLY_TIMEOUT
+    turn = _BotReplyTurn(message, is_first_in_session, has_name, has_phone, telegram_sent, last_procedure, history)
     try:
-        prompt = f"""Определи, есть ли в сообщении имя человека. Если есть - верни ТОЛЬКО имя. Если нет - верни "not_found".
+        reply = turn.start()
+        if reply is not None:
+            yield 'done', reply
+            return
+        
+        chunks = []
+        tokens = llm_client.stream_text_async(turn.prompt, max_tokens=1000, temperature=0.7, api_key=api_key, site='reply_stream')
+        try:
+            while True:
+                try:
+                    token = await asyncio.wait_for(tokens.__anext__(), timeout=token_timeout)
+                except StopAsyncIteration:
+                    break
+                chunks.append(token)
+                yield 'token', token
+        finally:
+            await tokens.aclose()
+        reply = turn.finish("".join(chunks))
+    except Exception as e:
+        reply = turn.fallback(e)
+    yield 'done', reply
+
+def _build_name_prompt(message: str) -> str:
+    """Промпт для извлечения имени из сообщения."""
+    return f"""Определи, есть ли в сообщении имя человека. Если есть - верни ТОЛЬКО имя. Если нет - верни "not_found".
 
 ВОТ ПРАВИЛА:
 1. Имя - это личное имя человека (Анна, Иван, Мария, Дмитрий и т.д.)
@@ -754,107 +934,166 @@ def extract_name_with_ai(api_key: str, message: str) -> str:
 
 Ответ (только имя или "not_found"):"""
 
-        client = replicate.Client(api_token=api_key)
-        
-        output = client.run(
-            "meta/meta-llama-3-70b-instruct",
-            input={
-                "prompt": prompt,
-                "max_tokens": 20,
-                "temperature": 0.1,
-                "top_p": 0.9
-            }
-        )
-        
-        # Обрабатываем ответ
-        result = ""
-        if hasattr(output, '__iter__') and not isinstance(output, str):
-            for chunk in output:
-                if isinstance(chunk, str):
-                    result += chunk
-                else:
-                    result += str(chunk)
-        elif isinstance(output, str):
-            result = output
-        else:
-            result = str(output)
-        
-        result = result.strip().lower()
-        print(f"🔍 AI анализ имени из '{message}': получил '{result}'")
-        
-        # Очищаем ответ
-        if result in ['not_found', 'none', 'null', 'нет', 'no name', '']:
-            return None
-        
-        # Удаляем кавычки и лишние символы
-        result = re.sub(r'["\'\.,!?]', '', result).strip()
-        
-        if not result:
-            return None
-        
-        # Фильтруем процедуры
-        procedure_keywords = [
-            'ботокс', 'ботулин', 'диспорт', 'релатокс', 'ботулакс',
-            'эпиляция', 'лазерная', 'биоревитализация', 'чистка',
-            'пилинг', 'лифтинг', 'смас', 'морфиус', 'перманентный',
-            'макияж', 'контурная', 'пластика', 'мезотерапия',
-            'коллаген', 'химический', 'ретиноловый', 'карбоновый'
-        ]
-        
-        if any(proc in result for proc in procedure_keywords):
-            print(f"⚠️ Отфильтровано: '{result}' похоже на процедуру")
-            return None
-        
-        # Проверяем что это похоже на имя
-        if not re.match(r'^[А-ЯЁа-яё\-]+$', result):
-            return None
-        
-        # Капитализируем первую букву
-        if '-' in result:
-            parts = result.split('-')
-            result = '-'.join([part.capitalize() for part in parts])
-        else:
-            result = result.capitalize()
-        
-        # Длина имени должна быть разумной
-        if len(result) < 2 or len(result) > 30:
-            return None
-        
-        return result if result else None
+def _parse_name_result(result: str, message: str) -> str:
+    """Разбирает ответ AI с именем; возвращает имя или None."""
+    result = result.strip().lower()
+    print(f"🔍 AI анализ имени из '{message}': получил '{result}'")
+    return _clean_ai_name(result)
+
+def _clean_ai_name(result: str) -> str:
+    """Проверяет и нормализует имя, которое вернул AI; возвращает имя или None."""
+    result = result.strip().lower()
+    
+    # Очищаем ответ
+    if result in ['not_found', 'none', 'null', 'нет', 'no name', '']:
+        return None
+    
+    # Удаляем кавычки и лишние символы
+    result = re.sub(r'["\'\.,!?]', '', result).strip()
+    
+    if not result:
+        return None
+    
+    # Фильтруем процедуры
+    if any(proc in result for proc in PROCEDURE_WORDS):
+        print(f"⚠️ Отфильтровано: '{result}' похоже на процедуру")
+        return None
+    
+    # Проверяем что это похоже на имя
+    if not re.match(r'^[А-ЯЁа-яё\-]+$', result):
+        return None
+    
+    # Капитализируем первую букву
+    if '-' in result:
+        parts = result.split('-')
+        result = '-'.join([part.capitalize() for part in parts])
+    else:
+        result = result.capitalize()
+    
+    # Длина имени должна быть разумной
+    if len(result) < 2 or len(result) > 30:
+        return None
+    
+    return result if result else None
+
+async def extract_name_with_ai_async(api_key: str, message: str) -> str:
+    """
+    Использует AI для извлечения имени человека из сообщения.
+    Если корутину отменить, запрос к модели прерывается.
+    """
+    try:
+        prompt = _build_name_prompt(message)
+        result = await llm_client.run_text_async(prompt, max_tokens=20, temperature=0.1, api_key=api_key, site='name')
+        return _parse_name_result(result, message)
             
     except Exception as e:
         print(f"❌ Ошибка AI при извлечении имени: {str(e)}")
         return None
 
+# Категории процедур, которые понимают обработчики диалога
+VALID_PROCEDURES = [
+    'лазерная эпиляция', 'чистка лица', 'ботулотоксин',
+    'лифтинг', 'биоревитализация', 'капельницы',
+    'фотоомоложение', 'мезотерапия', 'перманентный макияж',
+    'удаление тату', 'прокол ушей'
+]
+
+def _build_client_info_prompt(message: str) -> str:
+    """Промпт для извлечения имени, процедуры и намерения одним вызовом."""
+    procedures_list = "\n".join(f"- {procedure}" for procedure in VALID_PROCEDURES)
+    return f"""Проанализируй сообщение клиента клиники косметологии и верни ТОЛЬКО JSON без пояснений.
+
+Поля JSON:
+- "name": личное имя клиента из сообщения (Анна, Иван и т.д.) или null. Названия процедур и общие слова (привет, хочу, записаться) — НЕ имя.
+- "procedure": ОДНА категория процедуры из списка ниже или null, если не подходит ни одна.
+- "intent": true, если клиент хочет записаться (просит записать, называет дату/время, дает контакты для записи), иначе false.
+
+Категории процедур:
+{procedures_list}
+
+Примеры:
+Сообщение: "Меня зовут Анна, хочу на ботокс" → {{"name": "Анна", "procedure": "ботулотоксин", "intent": true}}
+Сообщение: "Сколько стоит эпиляция подмышек?" → {{"name": null, "procedure": "лазерная эпиляция", "intent": false}}
+Сообщение: "Иван, 89161234567" → {{"name": "Иван", "procedure": null, "intent": true}}
+
+Сообщение: "{message}"
+
+JSON:"""
+
+def _match_valid_procedure(value: str) -> str:
+    """Сопоставляет ответ AI со списком известных процедур; возвращает процедуру или None."""
+    if not value:
+        return None
+    
+    value_lower = str(value).strip().lower()
+    if value_lower in ['другое', 'null', 'none', '']:
+        return None
+    
+    for valid_proc in VALID_PROCEDURES:
+        if valid_proc == value_lower:
+            return valid_proc
+    
+    # Частичное совпадение (AI мог вернуть «эпиляция» вместо «лазерная эпиляция»)
+    for valid_proc in VALID_PROCEDURES:
+        if any(word in value_lower for word in valid_proc.split()):
+            return valid_proc
+    
+    return None
+
+def _parse_client_info_result(result: str, message: str) -> dict:
+    """Разбирает JSON-ответ AI и проверяет поля."""
+    print(f"🔍 AI анализ сообщения '{message[:50]}': получил '{result.strip()[:200]}'")
+    
+    info = {'name': None, 'procedure': None, 'intent': False}
+    
+    match = re.search(r'\{.*\}', result, re.DOTALL)
+    if not match:
+        return info
+    
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return info
+    
+    if not isinstance(data, dict):
+        return info
+    
+    if isinstance(data.get('name'), str):
+        info['name'] = _clean_ai_name(data['name'])
+    
+    info['procedure'] = _match_valid_procedure(data.get('procedure'))
+    
+    intent = data.get('intent')
+    if isinstance(intent, str):
+        intent = intent.strip().lower() in ['true', 'да', 'yes']
+    info['intent'] = bool(intent)
+    
+    return info
+
+async def extract_client_info_with_ai_async(api_key: str, message: str) -> dict:
+    """
+    Одним вызовом AI извлекает из сообщения имя, процедуру и намерение записаться.
+    Возвращает {'name': str | None, 'procedure': str | None, 'intent': bool};
+    процедура всегда из VALID_PROCEDURES.
+    """
+    try:
+        prompt = _build_client_info_prompt(message)
+        result = await llm_client.run_text_async(prompt, max_tokens=60, temperature=0.1, api_key=api_key, site='client_info')
+        return _parse_client_info_result(result, message)
+            
+    except Exception as e:
+        print(f"❌ Ошибка AI при анализе сообщения: {str(e)}")
+        return {'name': None, 'procedure': None, 'intent': False}
+
 def check_interesting_application(text: str):
     """
     Проверяем, является ли сообщение заявкой на процедуру.
     """
-    t = text.lower()
-    
-    # РАСШИРЕННЫЙ СПИСОК КЛЮЧЕВЫХ СЛОВ
-    procedure_keywords = [
-        "записаться", "запись", "записать", "хочу", "можно", "мне нужно",
-        "нужно", "готов", "давайте", "интересует", "интересуюсь", "процедур",
-        "эпиляция", "лазерная", "ботокс", "ботулин", "чистка",
-        "пилинг", "омоложение", "лифтинг", "smas", "морфиус",
-        "биоревитализация", "инъекция", "укол", "гиалуроновая",
-        "консультация", "врач", "косметолог", "прием",
-        "брови", "ресницы", "ламинирование", "наращивание",
-        "тату", "татуировка", "удаление", "перманент",
-        "массаж", "микротоки", "мезотерапия", "роликовый",
-        "коллаген", "химический", "ретиноловый", "карбоновый",
-        "стоит", "цена", "прайс", "стоимость", "сколько",
-        "бикини", "подмышки", "голени", "бедра", "лицо",
-        "шея", "спина", "живот", "руки", "ноги",
-        "капельниц", "детокс", "витамин", "омоложение",
-        "пигмент", "пятн", "веснушк", "аппарат", "лазер"
-    ]
-    
-    contact_keywords = ["имя", "зовут", "телефон", "телефоне", "номер", "позвонить", "мне зовут"]
+    matches = normalize_message(text).keywords
     
-    has_procedure = any(keyword in t for keyword in procedure_keywords)
-    has_contacts = any(keyword in t for keyword in contact_keywords)
+    # Ключевые слова — keywords.APPLICATION_KEYWORDS
+    has_procedure = matches.has('application', 'procedure')
+    has_contacts = matches.has('application', 'contacts')
     
     print(f"🔍 Проверка заявки: '{text[:100]}...'")
     print(f"   Процедурные слова: {has_procedure}")
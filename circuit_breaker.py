@@ -0,0 +1,163 @@
+"""
+Автоматический выключатель (circuit breaker) для вызовов LLM.
+
+Следит за долей ошибок и медленных вызовов в скользящем окне.
+Если их слишком много, выключатель размыкается: вызовы сразу получают
+отказ, и клиенту мгновенно отдается fallback-ответ вместо ожидания таймаута.
+Через LLM_BREAKER_OPEN_SECONDS выключатель переходит в полуоткрытое
+состояние и пропускает пробный вызов: успех замыкает цепь, ошибка
+снова размыкает.
+
+Настройки:
+- LLM_BREAKER_WINDOW_SECONDS — длина скользящего окна, сек (по умолчанию 60)
+- LLM_BREAKER_MIN_CALLS — минимум вызовов в окне для решения (5)
+- LLM_BREAKER_ERROR_RATE — доля ошибок и медленных вызовов для размыкания (0.5)
+- LLM_BREAKER_SLOW_CALL_SECONDS — вызов дольше этого считается медленным (8)
+- LLM_BREAKER_OPEN_SECONDS — сколько держать цепь разомкнутой (30)
+"""
+
+import os
+import time
+import threading
+from collections import deque
+
+LLM_BREAKER_WINDOW_SECONDS = float(os.getenv("LLM_BREAKER_WINDOW_SECONDS", "60"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_SLOW_CALL_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_CALL_SECONDS", "8"))
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """Выключатель со скользящим окном ошибок/задержек и пробными вызовами."""
+
+    def __init__(self, name: str,
+                 window_seconds: float = LLM_BREAKER_WINDOW_SECONDS,
+                 min_calls: int = LLM_BREAKER_MIN_CALLS,
+                 error_rate: float = LLM_BREAKER_ERROR_RATE,
+                 slow_call_seconds: float = LLM_BREAKER_SLOW_CALL_SECONDS,
+                 open_seconds: float = LLM_BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.probe_started_at = None
+        self.rejected = 0
+        self.times_opened = 0
+        self.last_failure = None
+        # (время, неудача ли, длительность)
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float):
+        """Убирает вызовы старше окна (вызывать под блокировкой)."""
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+    def allow_request(self) -> bool:
+        """Можно ли сейчас обращаться к провайдеру."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+
+            now = time.monotonic()
+            if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+                print(f"🟡 Выключатель {self.name}: полуоткрыт, пробуем пробный вызов")
+
+            # Пробный вызов, о котором так и не сообщили, не должен блокировать цепь навсегда
+            probe_lost = self.probe_in_flight and now - self.probe_started_at >= self.open_seconds
+            if self.state == HALF_OPEN and (not self.probe_in_flight or probe_lost):
+                self.probe_in_flight = True
+                self.probe_started_at = now
+                return True
+
+            self.rejected += 1
+            return False
+
+    def record_success(self, duration: float):
+        """Учитывает успешный вызов (слишком медленный считается неудачным)."""
+        if duration >= self.slow_call_seconds:
+            self.record_failure(duration, f"медленный вызов {duration:.1f} сек")
+            return
+
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self.probe_in_flight = False
+                self._calls.clear()
+                print(f"🟢 Выключатель {self.name}: провайдер восстановился, цепь замкнута")
+            now = time.monotonic()
+            self._calls.append((now, False, duration))
+            self._trim(now)
+
+    def record_failure(self, duration: float, reason: str = None):
+        """Учитывает ошибку, таймаут или медленный вызов."""
+        with self._lock:
+            now = time.monotonic()
+            self.last_failure = reason
+
+            if self.state == HALF_OPEN:
+                self._open(now, f"пробный вызов не прошел ({reason})")
+                return
+
+            self._calls.append((now, True, duration))
+            self._trim(now)
+
+            if self.state == CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(1 for _, failed, _ in self._calls if failed)
+                rate = failures / len(self._calls)
+                if rate >= self.error_rate:
+                    self._open(now, f"доля ошибок {rate:.0%} за {self.window_seconds:.0f} сек")
+
+    def record_cancelled(self, duration: float):
+        """
+        Учитывает вызов, отмененный самим приложением (бюджет времени,
+        проигравший хедж, клиент ушел). Провайдер тут не виноват, поэтому
+        неудачей считается только уже медленный вызов; пробный вызов
+        освобождается, чтобы следующий запрос мог проверить провайдера.
+        """
+        if duration >= self.slow_call_seconds:
+            self.record_failure(duration, f"медленный вызов {duration:.1f} сек")
+            return
+
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False
+
+    def _open(self, now: float, reason: str):
+        """Размыкает цепь (вызывать под блокировкой)."""
+        self.state = OPEN
+        self.opened_at = now
+        self.probe_in_flight = False
+        self.times_opened += 1
+        print(f"🔴 Выключатель {self.name} разомкнут: {reason}. Fallback на {self.open_seconds:.0f} сек")
+
+    def stats(self) -> dict:
+        """Состояние для /health."""
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            calls = len(self._calls)
+            failures = sum(1 for _, failed, _ in self._calls if failed)
+            durations = sorted(duration for _, _, duration in self._calls)
+            return {
+                'name': self.name,
+                'state': self.state,
+                'calls_in_window': calls,
+                'error_rate': round(failures / calls, 3) if calls else 0.0,
+                'median_latency_seconds': round(durations[len(durations) // 2], 2) if durations else None,
+                'open_for_seconds': round(max(0.0, self.open_seconds - (now - self.opened_at)), 1) if self.state == OPEN else 0,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+                'last_failure': self.last_failure,
+            }
@@ -0,0 +1,159 @@
+"""
+Память диалога для промпта ответа.
+
+Последние N реплик хранятся дословно, а более старые по мере вытеснения
+сворачиваются в короткую выжимку (первая фраза реплики). И реплики, и выжимка
+ограничены бюджетом токенов, поэтому размер промпта не растет, сколько бы
+ни длился диалог. Используется и веб-сессиями, и Telegram.
+
+Настройки:
+- CONVERSATION_MEMORY_TURNS — сколько последних реплик хранить дословно (по умолчанию 6)
+- CONVERSATION_MEMORY_TOKEN_BUDGET — бюджет токенов на всю историю в промпте (600)
+"""
+
+import os
+import re
+from collections import deque
+
+from llm_client import estimate_tokens
+
+CONVERSATION_MEMORY_TURNS = int(os.getenv("CONVERSATION_MEMORY_TURNS", "6"))
+CONVERSATION_MEMORY_TOKEN_BUDGET = int(os.getenv("CONVERSATION_MEMORY_TOKEN_BUDGET", "600"))
+
+# Доля бюджета, которую может занять выжимка старых реплик
+SUMMARY_BUDGET_SHARE = 0.35
+
+# Длина одной строки выжимки
+SUMMARY_LINE_CHARS = {'client': 120, 'bot': 80}
+
+ROLE_NAMES = {'client': 'Клиент', 'bot': 'Александра'}
+
+SUMMARY_HEADER = "Ранее в диалоге:"
+RECENT_HEADER = "Последние сообщения:"
+
+_SPACES_RE = re.compile(r'\s+')
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s')
+
+def _compact(text: str) -> str:
+    """Схлопывает переносы и пробелы."""
+    return _SPACES_RE.sub(' ', text or '').strip()
+
+def _shorten(text: str, limit: int) -> str:
+    """Обрезает текст по границе слова."""
+    if len(text) <= limit:
+        return text
+    cut = text[:limit].rsplit(' ', 1)[0]
+    return cut + '…'
+
+def _summarize_turn(role: str, text: str) -> str:
+    """Строка выжимки: первая фраза реплики."""
+    first_sentence = _SENTENCE_END_RE.split(text, 1)[0]
+    return f"{ROLE_NAMES[role]}: {_shorten(first_sentence, SUMMARY_LINE_CHARS[role])}"
+
+class ConversationMemory:
+    """Последние реплики дословно плюс постепенно дополняемая выжимка старых."""
+
+    __slots__ = ('max_turns', 'token_budget', 'summary_budget', 'turns', 'summary', 'summary_tokens', 'total_turns')
+
+    def __init__(self, max_turns: int = CONVERSATION_MEMORY_TURNS,
+                 token_budget: int = CONVERSATION_MEMORY_TOKEN_BUDGET):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_budget = int(token_budget * SUMMARY_BUDGET_SHARE)
+        self.turns = deque()
+        self.summary = deque()
+        self.summary_tokens = 0
+        self.total_turns = 0
+
+    def add(self, role: str, text: str):
+        """Добавляет реплику; вытесненные старые реплики уходят в выжимку."""
+        text = _compact(text)
+        if not text:
+            return
+
+        self.turns.append((role, text))
+        self.total_turns += 1
+
+        while len(self.turns) > self.max_turns:
+            self._fold(*self.turns.popleft())
+
+    def add_client(self, text: str):
+        self.add('client', text)
+
+    def add_bot(self, text: str):
+        self.add('bot', text)
+
+    def _fold(self, role: str, text: str):
+        """Сворачивает реплику в выжимку, удерживая ее в пределах бюджета."""
+        line = f"   • {_summarize_turn(role, text)}"
+        if self.summary and self.summary[-1] == line:
+            return
+
+        self.summary.append(line)
+        self.summary_tokens += estimate_tokens(line + "\n")
+
+        while self.summary and self.summary_tokens > self.summary_budget:
+            self.summary_tokens -= estimate_tokens(self.summary.popleft() + "\n")
+
+    def render(self) -> str:
+        """История для промпта в пределах бюджета токенов (пустая строка, если истории нет)."""
+        if not self.turns and not self.summary:
+            return ""
+
+        # Построчная оценка не меньше оценки всего текста, поэтому итог укладывается в бюджет
+        budget = self.token_budget - estimate_tokens(SUMMARY_HEADER + RECENT_HEADER + "\n\n")
+        budget -= self.summary_tokens
+
+        # Свежие реплики с конца: самую старую из не поместившихся обрезаем
+        recent = []
+        for role, text in reversed(self.turns):
+            line = f"   {ROLE_NAMES[role]}: {text}"
+            tokens = estimate_tokens(line + "\n")
+            if tokens > budget:
+                if budget >= 20:
+                    recent.append(_shorten(line, budget * 3 - 3))
+                break
+            recent.append(line)
+            budget -= tokens
+        recent.reverse()
+
+        parts = []
+        if self.summary:
+            parts.append(SUMMARY_HEADER)
+            parts.extend(self.summary)
+        if recent:
+            parts.append(RECENT_HEADER)
+            parts.extend(recent)
+        return "\n".join(parts)
+
+    def to_dict(self) -> dict:
+        """Состояние для хранилища сессий."""
+        return {
+            'max_turns': self.max_turns,
+            'token_budget': self.token_budget,
+            'turns': [list(turn) for turn in self.turns],
+            'summary': list(self.summary),
+            'total_turns': self.total_turns,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ConversationMemory':
+        """Восстанавливает память из to_dict."""
+        memory = cls(data.get('max_turns', CONVERSATION_MEMORY_TURNS),
+                     data.get('token_budget', CONVERSATION_MEMORY_TOKEN_BUDGET))
+        memory.turns.extend(tuple(turn) for turn in data.get('turns', []))
+        memory.summary.extend(data.get('summary', []))
+        memory.summary_tokens = sum(estimate_tokens(line + "\n") for line in memory.summary)
+        memory.total_turns = data.get('total_turns', len(memory.turns))
+        return memory
+
+    def stats(self) -> dict:
+        """Размеры памяти для отладки."""
+        rendered = self.render()
+        return {
+            'total_turns': self.total_turns,
+            'recent_turns': len(self.turns),
+            'summary_lines': len(self.summary),
+            'rendered_tokens': estimate_tokens(rendered) if rendered else 0,
+            'token_budget': self.token_budget,
+        }
@@ -5,6 +5,10 @@
 import re
 from typing import Dict, Any
 
+from phone_parser import extract_phone
+from name_recognizer import recognize_name
+from keywords import NOT_NAME_WORDS
+
 def analyze_client_needs_simple(message: str, session: Dict[str, Any]) -> str:
     """
     Простой анализ без AI.
@@ -78,30 +82,23 @@ def handle_contact_collection(message: str, session: Dict[str, Any]) -> str:
     print(f"🔍 Сбор контактов из сообщения: '{message}'")
     
     # Ищем телефон
-    phone_pattern = r'[\+7]?[-\s]?\(?\d{3}\)?[-\s]?\d{3}[-\s]?\d{2}[-\s]?\d{2,3}'
-    phone_matches = re.findall(phone_pattern, message)
-    
-    # Также ищем просто 11 цифр подряд
-    if not phone_matches:
-        phone_pattern2 = r'\b\d{10,11}\b'
-        phone_matches = re.findall(phone_pattern2, message)
-    
-    # Удаляем нецифровые символы из телефона
-    if phone_matches:
-        clean_phone = re.sub(r'\D', '', phone_matches[0])
-        if 10 <= len(clean_phone) <= 11:
-            session['phone'] = clean_phone
-            print(f"📞 Найден телефон: {session['phone']}")
-    
-    # Ищем имя
-    words = re.findall(r'[А-ЯЁа-яёA-Za-z]+', message)
-    
-    # Ищем русские слова с заглавной буквы (имена)
-    russian_words = [word for word in words if re.match(r'^[А-ЯЁ][а-яё]*$', word)]
-    
-    if russian_words and not session['name']:
-        # Берем первое слово с заглавной буквы как имя
-        session['name'] = russian_words[0]
+    phone, _ = extract_phone(message)
+    if phone:
+        session['phone'] = phone
+        print(f"📞 Найден телефон: {session['phone']}")
+    
+    # Ищем имя: сначала по словарю имен
+    name, _ = recognize_name(message)
+    
+    if not name:
+        # Незнакомое имя: первое русское слово с заглавной буквы
+        words = re.findall(r'[А-ЯЁа-яёA-Za-z]+', message)
+        russian_words = [word for word in words if re.match(r'^[А-ЯЁ][а-яё]*$', word)
+                         and word.lower() not in NOT_NAME_WORDS]
+        name = russian_words[0] if russian_words else None
+    
+    if name and not session['name']:
+        session['name'] = name
         print(f"👤 Найдено имя: {session['name']}")
     
     # Формируем ответ в зависимости от того, что уже есть
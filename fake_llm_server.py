@@ -0,0 +1,74 @@
+"""
+Заглушка LLM-провайдера: OpenAI-совместимый HTTP-сервер для нагрузочных
+прогонов без сети.
+
+Отвечает на POST /v1/completions (обычный и потоковый режим) с задержками,
+ошибками и ответами из FakeGenerator (настройки LLM_FAKE_* — в llm_backends.py).
+
+Запуск:
+    uvicorn fake_llm_server:app --port 8001
+и в окружении бота:
+    LLM_BACKEND=openai
+    LLM_OPENAI_BASE_URL=http://127.0.0.1:8001/v1
+"""
+
+import json
+import time
+import asyncio
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from llm_backends import FakeGenerator
+
+app = FastAPI(title="Fake LLM")
+generator = FakeGenerator()
+
+def _completion_id() -> str:
+    return f"cmpl-fake-{time.time_ns()}"
+
+@app.post("/v1/completions")
+async def completions(request: Request):
+    """Генерация текста по промпту в формате OpenAI /v1/completions."""
+    body = await request.json()
+    model = body.get("model", "fake")
+    plan = generator.plan(body.get("prompt", ""), body.get("max_tokens"))
+
+    await asyncio.sleep(plan['ttft'])
+    if plan['error']:
+        return JSONResponse(status_code=500, content={"error": {"message": plan['error'], "type": "server_error"}})
+
+    completion_id = _completion_id()
+
+    if body.get("stream"):
+        async def event_stream():
+            for token in plan['tokens']:
+                chunk = {"id": completion_id, "object": "text_completion", "model": model,
+                         "choices": [{"index": 0, "text": token, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(plan['interval'])
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    await asyncio.sleep(plan['interval'] * len(plan['tokens']))
+    return {
+        "id": completion_id,
+        "object": "text_completion",
+        "model": model,
+        "choices": [{"index": 0, "text": "".join(plan['tokens']), "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": len(body.get("prompt", "")) // 3,
+            "completion_tokens": len(plan['tokens']),
+            "total_tokens": len(body.get("prompt", "")) // 3 + len(plan['tokens']),
+        },
+    }
+
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": "fake", "object": "model"}]}
+
+@app.get("/stats")
+async def stats():
+    """Сколько вызовов обработано и с какими настройками."""
+    return generator.stats()
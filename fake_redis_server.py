@@ -0,0 +1,180 @@
+"""
+Заглушка сервера Redis для локальной проверки хранилища сессий.
+
+Понимает протокол RESP и команды, которыми пользуется session_store.py:
+PING, AUTH, SELECT, GET, SET (с EX и NX), DEL, MGET, SCAN (MATCH, COUNT),
+EXPIRE, DBSIZE, FLUSHDB и транзакции WATCH/UNWATCH/MULTI/EXEC/DISCARD.
+Данные живут в памяти процесса.
+
+Запуск:
+    python fake_redis_server.py --port 6380
+и в окружении бота:
+    SESSION_STORE=redis
+    SESSION_STORE_REDIS_URL=redis://127.0.0.1:6380/0
+"""
+
+import time
+import asyncio
+import argparse
+import fnmatch
+
+# ключ → (значение, момент истечения или None)
+_data = {}
+# ключ → номер изменения: по нему EXEC узнает, что отслеживаемый ключ меняли
+_versions = {}
+
+def _touch(key: bytes):
+    _versions[key] = _versions.get(key, 0) + 1
+
+def _alive(key: bytes):
+    entry = _data.get(key)
+    if entry is None:
+        return None
+    value, expires_at = entry
+    if expires_at is not None and expires_at <= time.monotonic():
+        del _data[key]
+        return None
+    return value
+
+def _bulk(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$" + str(len(value)).encode() + b"\r\n" + value + b"\r\n"
+
+def _array(encoded_items: list) -> bytes:
+    return b"*" + str(len(encoded_items)).encode() + b"\r\n" + b"".join(encoded_items)
+
+def _execute(args: list) -> bytes:
+    command = args[0].upper().decode()
+
+    if command == 'PING':
+        return b"+PONG\r\n"
+    if command in ('AUTH', 'SELECT'):
+        return b"+OK\r\n"
+    if command == 'GET':
+        return _bulk(_alive(args[1]))
+    if command == 'SET':
+        expires_at = None
+        options = [a.upper() for a in args[3:]]
+        if b'EX' in options:
+            expires_at = time.monotonic() + int(args[3 + options.index(b'EX') + 1])
+        if b'NX' in options and _alive(args[1]) is not None:
+            return b"$-1\r\n"
+        _data[args[1]] = (args[2], expires_at)
+        _touch(args[1])
+        return b"+OK\r\n"
+    if command == 'DEL':
+        removed = 0
+        for key in args[1:]:
+            if _alive(key) is not None:
+                del _data[key]
+                _touch(key)
+                removed += 1
+        return f":{removed}\r\n".encode()
+    if command == 'MGET':
+        return _array([_bulk(_alive(key)) for key in args[1:]])
+    if command == 'EXPIRE':
+        value = _alive(args[1])
+        if value is None:
+            return b":0\r\n"
+        _data[args[1]] = (value, time.monotonic() + int(args[2]))
+        _touch(args[1])
+        return b":1\r\n"
+    if command == 'SCAN':
+        # Курсор не нужен: отдаем все ключи за один проход
+        pattern = b'*'
+        options = [a.upper() for a in args[2:]]
+        if b'MATCH' in options:
+            pattern = args[2 + options.index(b'MATCH') + 1]
+        keys = [key for key in list(_data) if _alive(key) is not None
+                and fnmatch.fnmatchcase(key.decode('utf-8', 'replace'), pattern.decode('utf-8', 'replace'))]
+        return b"*2\r\n" + _bulk(b"0") + _array([_bulk(key) for key in keys])
+    if command == 'DBSIZE':
+        return f":{sum(1 for key in list(_data) if _alive(key) is not None)}\r\n".encode()
+    if command == 'FLUSHDB':
+        for key in _data:
+            _touch(key)
+        _data.clear()
+        return b"+OK\r\n"
+
+    return f"-ERR unknown command '{command}'\r\n".encode()
+
+async def _read_command(reader: asyncio.StreamReader) -> list:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline-команда (например, из telnet)
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        length = int((await reader.readline())[1:-2])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+def _execute_in_session(args: list, session: dict) -> bytes:
+    """Команда с учетом транзакции соединения (WATCH и очередь MULTI)."""
+    command = args[0].upper().decode()
+
+    if command == 'WATCH':
+        if session['queue'] is not None:
+            return b"-ERR WATCH inside MULTI is not allowed\r\n"
+        for key in args[1:]:
+            session['watched'][key] = _versions.get(key, 0)
+        return b"+OK\r\n"
+    if command == 'UNWATCH':
+        session['watched'].clear()
+        return b"+OK\r\n"
+    if command == 'MULTI':
+        if session['queue'] is not None:
+            return b"-ERR MULTI calls can not be nested\r\n"
+        session['queue'] = []
+        return b"+OK\r\n"
+    if command == 'DISCARD':
+        if session['queue'] is None:
+            return b"-ERR DISCARD without MULTI\r\n"
+        session['queue'] = None
+        session['watched'].clear()
+        return b"+OK\r\n"
+    if command == 'EXEC':
+        if session['queue'] is None:
+            return b"-ERR EXEC without MULTI\r\n"
+        queue, session['queue'] = session['queue'], None
+        watched = dict(session['watched'])
+        session['watched'].clear()
+        if any(_versions.get(key, 0) != version for key, version in watched.items()):
+            return b"*-1\r\n"
+        return _array([_execute(queued) for queued in queue])
+    if session['queue'] is not None:
+        session['queue'].append(args)
+        return b"+QUEUED\r\n"
+    return _execute(args)
+
+async def _handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    session = {'watched': {}, 'queue': None}
+    try:
+        while True:
+            args = await _read_command(reader)
+            if args is None:
+                break
+            if not args:
+                continue
+            writer.write(_execute_in_session(args, session))
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(host: str, port: int):
+    server = await asyncio.start_server(_handle_client, host, port)
+    print(f"🧪 Заглушка Redis слушает {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка Redis для проверки хранилища сессий")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    options = parser.parse_args()
+    asyncio.run(serve(options.host, options.port))
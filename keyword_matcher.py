@@ -0,0 +1,139 @@
+"""
+Поиск всех ключевых слов за один проход по сообщению (автомат Ахо — Корасик).
+
+Раньше каждое сообщение просматривалось заново для каждой таблицы ключевых
+слов (any(keyword in message_lower ...) в десятке мест). Теперь автомат
+строится один раз при импорте из реестра keywords.KEYWORD_GROUPS, а
+match_keywords(text) за один линейный проход находит все группы и метки:
+процедуры, намерения, зоны. Результат для одного и того же текста кэшируется,
+поэтому все обработчики одного сообщения пользуются одним проходом.
+
+Поиск — по подстрокам (как и раньше): ключевые слова — основы слов.
+Буква ё и в словах, и в тексте считается за е («ещё» = «еще»).
+
+Настройки:
+- KEYWORD_MATCH_CACHE_SIZE — сколько последних сообщений помнить (по умолчанию 512)
+"""
+
+import os
+from collections import deque
+from functools import lru_cache
+
+from keywords import KEYWORD_GROUPS
+
+KEYWORD_MATCH_CACHE_SIZE = int(os.getenv("KEYWORD_MATCH_CACHE_SIZE", "512"))
+
+class KeywordMatches:
+    """Найденные в тексте метки по группам."""
+
+    __slots__ = ('_labels', '_hits')
+
+    def __init__(self, labels: dict, hits: dict):
+        # labels: группа → метки в порядке таблицы; hits: группа → номера найденных меток
+        self._labels = labels
+        self._hits = hits
+
+    def has(self, group: str, label: str = None) -> bool:
+        """Есть ли в тексте слова группы (или конкретной метки группы)."""
+        hits = self._hits.get(group)
+        if not hits:
+            return False
+        if label is None:
+            return True
+        return self._labels[group].index(label) in hits
+
+    def labels(self, group: str) -> list:
+        """Найденные метки группы в порядке таблицы."""
+        return [self._labels[group][index] for index in sorted(self._hits.get(group, ()))]
+
+    def first(self, group: str):
+        """Первая по таблице найденная метка группы или None."""
+        hits = self._hits.get(group)
+        return self._labels[group][min(hits)] if hits else None
+
+    def groups(self) -> list:
+        """Группы, в которых что-то нашлось."""
+        return list(self._hits)
+
+class KeywordMatcher:
+    """Автомат Ахо — Корасик по всем ключевым словам реестра."""
+
+    def __init__(self, groups: dict):
+        # groups: {группа: {метка: [слова]} или [слова]}
+        self.labels = {}
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        self.keywords = 0
+
+        for group, table in groups.items():
+            if not isinstance(table, dict):
+                table = {group: table}
+            self.labels[group] = tuple(table)
+            for index, words in enumerate(table.values()):
+                for word in words:
+                    self._add(word.lower().replace('ё', 'е'), (group, index))
+                    self.keywords += 1
+
+        self._link()
+
+    def _add(self, word: str, hit: tuple):
+        node = 0
+        for char in word:
+            following = self._goto[node].get(char)
+            if following is None:
+                following = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._goto[node][char] = following
+            node = following
+        if hit not in self._output[node]:
+            self._output[node] += (hit,)
+
+    def _link(self):
+        """Суффиксные ссылки обходом в ширину; выходы узла дополняются выходами ссылки."""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                extra = tuple(hit for hit in self._output[self._fail[child]] if hit not in self._output[child])
+                self._output[child] += extra
+
+    def scan(self, text_lower: str) -> KeywordMatches:
+        """Один проход по тексту (уже в нижнем регистре и с ё→е)."""
+        goto, fail, output = self._goto, self._fail, self._output
+        root = goto[0]
+        found = set()
+        node = 0
+        for char in text_lower:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0) if node else root.get(char, 0)
+            if output[node]:
+                found.update(output[node])
+
+        hits = {}
+        for group, index in found:
+            hits.setdefault(group, set()).add(index)
+        return KeywordMatches(self.labels, hits)
+
+    def stats(self) -> dict:
+        return {'groups': len(self.labels), 'keywords': self.keywords, 'states': len(self._goto)}
+
+# Автомат строится один раз при импорте
+keyword_matcher = KeywordMatcher(KEYWORD_GROUPS)
+
+@lru_cache(maxsize=KEYWORD_MATCH_CACHE_SIZE)
+def _match_lower(text_lower: str) -> KeywordMatches:
+    return keyword_matcher.scan(text_lower)
+
+def match_keywords(text: str) -> KeywordMatches:
+    """Все группы и метки из реестра, найденные в тексте (регистр и ё/е не важны)."""
+    return _match_lower(text.lower().replace('ё', 'е'))
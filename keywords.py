@@ -0,0 +1,198 @@
+"""
+Общие словари ключевых слов для определения процедур и намерений.
+Используются обработчиками веба и Telegram, а также локальным классификатором.
+Имена — в data/first_names.txt (name_recognizer.py).
+
+Все таблицы, по которым ищутся подстроки в сообщениях, собраны в KEYWORD_GROUPS:
+из них keyword_matcher.py один раз строит автомат и находит все группы
+за один проход по тексту.
+"""
+
+# Процедура → ключевые слова (основы слов, ищутся как подстроки).
+# Одна таблица для веба и Telegram: по ней определяется процедура сообщения
+# и отмечаются процедуры в истории; на ней же учится локальный классификатор
+PROCEDURE_KEYWORDS = {
+    'лазерная эпиляция': ['эпиляция', 'лазер', 'удаление волос', 'бикини', 'подмышки', 'ноги', 'александрит', 'инновейшен', 'innovation', 'quanta'],
+    'чистка лица': ['чистка', 'пилинг', 'акне', 'поры', 'ультразвуковая', 'механическая', 'гидропилинг'],
+    'ботулотоксин': ['ботокс', 'ботулин', 'морщины', 'диспорт', 'гипергидроз'],
+    'лифтинг': ['лифтинг', 'подтяжка', 'смас', 'ультера', 'морфиус'],
+    'биоревитализация': ['биоревитализация', 'гиалуроновая', 'профхайло', 'hyaron'],
+    'капельницы': ['капельниц', 'инфузи', 'витамин', 'детокс', 'иммуносуппорт', 'лаеннек'],
+    'фотоомоложение': ['пигмент', 'пятн', 'веснушк', 'фотоомоложение', 'люмекка', 'lumecca'],
+    'мезотерапия': ['мезотерапия', 'инъекци', 'укол'],
+    'перманентный макияж': ['перманент', 'макияж', 'татуаж', 'брови', 'губы'],
+    'удаление тату': ['тату', 'татуировк', 'удаление тату'],
+    'прокол ушей': ['прокол', 'ухо', 'уши', 'пирсинг']
+}
+
+# Фразы только для локального классификатора (основы слов через пробел).
+# Совпавшая фраза закрывает свои слова: "убрать волосы" — эпиляция,
+# хотя "волос" отдельно — алиас мезотерапии (трихология)
+PROCEDURE_PHRASES = {
+    'лазерная эпиляция': ['удал волос', 'убрат волос', 'убер волос'],
+}
+
+# Позиции каталога (data/procedures.json) → процедура из PROCEDURE_KEYWORDS
+CATALOG_PROCEDURE_LABELS = {
+    'laser_epilation_innovation': 'лазерная эпиляция',
+    'laser_epilation_quanta': 'лазерная эпиляция',
+    'face_cleaning': 'чистка лица',
+    'botulinum': 'ботулотоксин',
+    'rf_lifting_classic': 'лифтинг',
+    'rf_lifting_morpheus': 'лифтинг',
+    'smas_lifting': 'лифтинг',
+    'biorevitalization': 'биоревитализация',
+    'iv_therapy': 'капельницы',
+    'photo_rejuvenation_lumecca': 'фотоомоложение',
+    'mesotherapy': 'мезотерапия',
+    'fractional_mesotherapy': 'мезотерапия',
+    'permanent_makeup': 'перманентный макияж',
+    'tattoo_removal': 'удаление тату',
+    'ear_piercing': 'прокол ушей'
+}
+
+# Слова-процедуры, которые нельзя принимать за имя
+PROCEDURE_WORDS = [
+    'ботокс', 'ботулин', 'диспорт', 'релатокс', 'ботулакс',
+    'эпиляция', 'лазер', 'лазерная', 'коллаген', 'биоревитализация',
+    'чистка', 'пилинг', 'лифтинг', 'смас', 'морфиус', 'александрит',
+    'перманент', 'макияж', 'контурная', 'пластика', 'инъекция', 'мезотерапия',
+    'химический', 'ретиноловый', 'карбоновый'
+]
+
+# Слова, которые часто пишут с заглавной буквы, но это не имя
+NOT_NAME_WORDS = ['привет', 'здравствуйте', 'добрый', 'пока', 'спасибо']
+
+# Слова, по которым считаем, что в веб-диалоге упоминалась процедура
+MENTIONED_PROCEDURE_KEYWORDS = ['эпиляция', 'лазер', 'ботокс', 'чистка', 'пилинг', 'бикини',
+                                'коллаген', 'биоревитализация', 'инъекция', 'укол', 'смас', 'морфиус',
+                                'прокол', 'ухо', 'уши']
+
+# Намерение записаться: вместе с контактами — повод отправить заявку
+BOOKING_INTENT_WORDS = [
+    'запис', 'хочу', 'нужно', 'можно', 'готов', 'давайте',
+    'интересует', 'завтра', 'сегодня', 'после'
+]
+TELEGRAM_BOOKING_INTENT_WORDS = BOOKING_INTENT_WORDS + [
+    'да', 'ок', 'хорошо', 'согласен', 'давай', 'запишите'
+]
+
+# Признаки просьбы записаться (chatbot_logic.is_registration_request)
+REGISTRATION_KEYWORDS = {
+    'booking': ['запис'],
+    'ready': ['хочу', 'можно', 'нужно', 'готов', 'давайте'],
+    'time': ['завтра', 'сегодня', 'после'],
+    'zone': ['бикини', 'подмышки', 'ноги', 'голени', 'бедра'],
+    'procedure': ['эпиляция', 'чистка', 'ботокс', 'пилинг', 'лифтинг'],
+    'when': ['завтра', 'сегодня', 'в ', 'во ', 'после']
+}
+
+# Темы ответа без AI (main.get_fallback_response)
+FALLBACK_TOPIC_KEYWORDS = {
+    'piercing': ['прокол'],
+    'ear': ['ухо', 'уши'],
+    'greeting': ['добрый', 'здравствуйте', 'привет'],
+    'tricholax': ['трихолакс'],
+    'booking': ['запис'],
+    'price': ['цена', 'стоимость', 'сколько стоит'],
+    'address': ['адрес', 'где находитесь', 'локация'],
+    'epilation': ['эпиляция', 'лазерная']
+}
+
+# Признаки заявки на процедуру (chatbot_logic.check_interesting_application)
+APPLICATION_KEYWORDS = {
+    'procedure': [
+        'записаться', 'запись', 'записать', 'хочу', 'можно', 'мне нужно',
+        'нужно', 'готов', 'давайте', 'интересует', 'интересуюсь', 'процедур',
+        'эпиляция', 'лазерная', 'ботокс', 'ботулин', 'чистка',
+        'пилинг', 'омоложение', 'лифтинг', 'smas', 'морфиус',
+        'биоревитализация', 'инъекция', 'укол', 'гиалуроновая',
+        'консультация', 'врач', 'косметолог', 'прием',
+        'брови', 'ресницы', 'ламинирование', 'наращивание',
+        'тату', 'татуировка', 'удаление', 'перманент',
+        'массаж', 'микротоки', 'мезотерапия', 'роликовый',
+        'коллаген', 'химический', 'ретиноловый', 'карбоновый',
+        'стоит', 'цена', 'прайс', 'стоимость', 'сколько',
+        'бикини', 'подмышки', 'голени', 'бедра', 'лицо',
+        'шея', 'спина', 'живот', 'руки', 'ноги',
+        'капельниц', 'детокс', 'витамин', 'омоложение',
+        'пигмент', 'пятн', 'веснушк', 'аппарат', 'лазер'
+    ],
+    'contacts': ['имя', 'зовут', 'телефон', 'телефоне', 'номер', 'позвонить', 'мне зовут']
+}
+
+# Вопрос про пигментацию — готовый ответ без AI (chatbot_logic.handle_pigmentation_question)
+PIGMENTATION_KEYWORDS = ['пигмент', 'пятн', 'веснушк']
+
+# Явные вопросы про аппараты (chatbot_logic.handle_apparatus_question_improved)
+APPARATUS_QUESTION_KEYWORDS = [
+    'что такое инновейшен', 'что такое innovation',
+    'что такое quanta', 'что такое кванта',
+    'что такое lumecca', 'что такое люмекка',
+    'расскажи про аппарат', 'какой аппарат лучше',
+    'чем отличается инновейшен', 'какой лазер лучше',
+    'что за аппарат', 'какое оборудование',
+    'аппараты', 'оборудование', 'техника'
+]
+APPARATUS_KEYWORDS = {
+    'innovation': ['innovation', 'инновейшен'],
+    'quanta': ['quanta', 'кванта'],
+    'lumecca': ['lumecca', 'люмекка']
+}
+
+# Сообщение похоже на запись, а не на вопрос про аппарат (если процедура уже известна)
+BOOKING_CONTEXT_WORDS = ['завтра', 'сегодня', 'бикини', 'подмышки']
+
+# Клиент спрашивает контакты клиники (chatbot_logic.should_add_contacts_to_reply)
+CONTACT_REQUEST_WORDS = ['телефон', 'адрес', 'контакт', 'позвонить', 'номер', 'как связаться']
+
+# Тип сообщения для промпта AI (chatbot_logic.build_reply_prompt)
+MESSAGE_TYPE_KEYWORDS = {
+    'price': ['цена', 'стоимость', 'сколько'],
+    'zone': ['бикини', 'подмышки', 'ноги', 'лицо', 'шея'],
+    'time': ['завтра', 'сегодня'],
+    'procedure': ['эпиляция', 'чистка', 'ботокс'],
+    'discount': ['цена', 'стоимость']
+}
+
+# Темы ответа при ошибке AI (chatbot_logic.get_ai_error_fallback)
+ERROR_FALLBACK_KEYWORDS = {
+    'contacts': ['адрес', 'телефон'],
+    'pigmentation': ['пигмент', 'пятн'],
+    'booking': ['запис']
+}
+
+# Клиент спрашивает цену (price_engine.is_price_question)
+PRICE_QUESTION_WORDS = [
+    'сколько стоит', 'сколько стоят', 'стоимость', 'цена', 'цены', 'цену', 'прайс',
+    'почем', 'по чем', 'сколько будет', 'сколько за', 'во сколько обойдется'
+]
+
+# Вопрос о цене, где нужна консультация, а не справка из прайса (price_engine.find_price_answer)
+PRICE_HANDOFF_WORDS = [
+    'разница', 'отлича', 'лучше', 'посовет', 'подойдет', 'подходит', 'скидк', 'акци',
+    'рассрочк', 'мужчин', 'курс', 'сеансов', 'процедур нужно', 'больно', 'противопоказ'
+]
+
+# Реестр для keyword_matcher: группа → {метка: ключевые слова} или список слов
+# (у списка одна метка — имя группы). Порядок меток важен: первой считается
+# метка, которая раньше в таблице (как при проверке таблицы сверху вниз).
+KEYWORD_GROUPS = {
+    'procedure': PROCEDURE_KEYWORDS,
+    'mentioned_procedure': MENTIONED_PROCEDURE_KEYWORDS,
+    'booking_intent': BOOKING_INTENT_WORDS,
+    'telegram_booking_intent': TELEGRAM_BOOKING_INTENT_WORDS,
+    'registration': REGISTRATION_KEYWORDS,
+    'fallback_topic': FALLBACK_TOPIC_KEYWORDS,
+    'application': APPLICATION_KEYWORDS,
+    'pigmentation': PIGMENTATION_KEYWORDS,
+    'apparatus_question': APPARATUS_QUESTION_KEYWORDS,
+    'apparatus': APPARATUS_KEYWORDS,
+    'booking_context': BOOKING_CONTEXT_WORDS,
+    'contact_request': CONTACT_REQUEST_WORDS,
+    'message_type': MESSAGE_TYPE_KEYWORDS,
+    'error_fallback': ERROR_FALLBACK_KEYWORDS,
+    'price_question': PRICE_QUESTION_WORDS,
+    # Метка — само слово: find_price_answer называет его в причине передачи AI
+    'price_handoff': {word: [word] for word in PRICE_HANDOFF_WORDS}
+}
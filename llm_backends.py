@@ -0,0 +1,427 @@
+"""
+Бэкенды LLM: кто именно генерирует текст.
+
+Весь код вызывает модель через llm_client, а llm_client — через бэкенд,
+выбранный переменной LLM_BACKEND:
+- replicate — Replicate API (по умолчанию, боевой режим)
+- openai — любой локальный OpenAI-совместимый сервер (/v1/completions):
+  vLLM, llama.cpp server или заглушка fake_llm_server.py
+- fake — заглушка прямо в процессе, без сети
+
+Заглушка имитирует провайдера: случайное время до первого токена
+(логнормальное распределение), скорость генерации, долю ошибок и заранее
+заданные ответы. С ней сервис можно нагружать и мерить офлайн.
+
+Настройки:
+- LLM_BACKEND — replicate, openai или fake (по умолчанию replicate)
+- LLM_POOL_SIZE — максимум соединений в пуле (по умолчанию 10)
+- LLM_KEEPALIVE_SECONDS — сколько держать простаивающее соединение (60)
+- LLM_CONNECT_TIMEOUT — таймаут установки соединения, сек (5)
+- LLM_READ_TIMEOUT — таймаут чтения ответа, сек (30)
+- LLM_OPENAI_BASE_URL — адрес OpenAI-совместимого сервера (http://127.0.0.1:8001/v1)
+- LLM_OPENAI_API_KEY — ключ для него, если нужен
+- LLM_OPENAI_MODEL — имя модели на сервере для вызовов без модели; модель, переданная
+  в вызов (основная и запасные из HEDGE_CONFIG), уходит на сервер как есть
+- LLM_FAKE_TTFT_MS — медиана времени до первого токена, мс (400)
+- LLM_FAKE_TTFT_SIGMA — разброс (сигма логнормального распределения, 0 — без разброса) (0.5)
+- LLM_FAKE_TOKENS_PER_SECOND — скорость генерации, токенов/сек (40)
+- LLM_FAKE_ERROR_RATE — доля вызовов, завершающихся ошибкой (0)
+- LLM_FAKE_OUTPUTS_FILE — JSON-список {"match": "...", "output": "..."}: ответ выбирается
+  по первой подстроке, найденной в промпте (иначе встроенные ответы). Файл другого
+  вида — ошибка при создании заглушки
+- LLM_FAKE_SEED — зерно генератора случайных чисел для воспроизводимых прогонов
+"""
+
+import os
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+
+import httpx
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "replicate").strip().lower()
+
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "10"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "30"))
+
+LLM_OPENAI_BASE_URL = os.getenv("LLM_OPENAI_BASE_URL", "http://127.0.0.1:8001/v1")
+LLM_OPENAI_API_KEY = os.getenv("LLM_OPENAI_API_KEY", "")
+LLM_OPENAI_MODEL = os.getenv("LLM_OPENAI_MODEL", "")
+
+LLM_FAKE_TTFT_MS = float(os.getenv("LLM_FAKE_TTFT_MS", "400"))
+LLM_FAKE_TTFT_SIGMA = float(os.getenv("LLM_FAKE_TTFT_SIGMA", "0.5"))
+LLM_FAKE_TOKENS_PER_SECOND = float(os.getenv("LLM_FAKE_TOKENS_PER_SECOND", "40"))
+LLM_FAKE_ERROR_RATE = float(os.getenv("LLM_FAKE_ERROR_RATE", "0"))
+LLM_FAKE_OUTPUTS_FILE = os.getenv("LLM_FAKE_OUTPUTS_FILE", "")
+LLM_FAKE_SEED = os.getenv("LLM_FAKE_SEED", "")
+
+# Встроенные ответы заглушки: по подстроке промпта (проверяются по порядку)
+FAKE_DEFAULT_OUTPUTS = [
+    {'match': 'ТОЛЬКО "ДА" или "НЕТ"', 'output': 'НЕТ'},
+    {'match': 'верни ТОЛЬКО имя', 'output': 'not_found'},
+    {'match': 'верни ТОЛЬКО JSON', 'output': '{"name": null, "procedure": null, "intent": false}'},
+    {'match': '', 'output': (
+        'Здравствуйте! Меня зовут Александра, я консультант клиники GLADIS. '
+        'Подскажу по процедурам и ценам: уточните, пожалуйста, какая процедура вас интересует '
+        'и на какую зону. Для записи оставьте ваше имя и телефон, менеджер свяжется с вами. '
+        'Телефон клиники: 8-928-458-32-88'
+    )},
+]
+
+_TOKEN_RE = re.compile(r'\S+\s*')
+
+class LLMError(Exception):
+    """Модель не вернула результат (ошибка или отмена генерации)."""
+
+def _build_limits() -> httpx.Limits:
+    """Лимиты пула соединений."""
+    return httpx.Limits(
+        max_connections=LLM_POOL_SIZE,
+        max_keepalive_connections=LLM_POOL_SIZE,
+        keepalive_expiry=LLM_KEEPALIVE_SECONDS
+    )
+
+def _build_timeout() -> httpx.Timeout:
+    """Таймауты HTTP-запросов к API."""
+    return httpx.Timeout(
+        LLM_READ_TIMEOUT,
+        connect=LLM_CONNECT_TIMEOUT,
+        pool=LLM_CONNECT_TIMEOUT
+    )
+
+def _output_to_text(output) -> str:
+    """Склеивает ответ модели (строка или итератор фрагментов) в строку."""
+    if hasattr(output, '__iter__') and not isinstance(output, str):
+        return "".join(chunk if isinstance(chunk, str) else str(chunk) for chunk in output)
+    if isinstance(output, str):
+        return output
+    return str(output)
+
+class LLMBackend(ABC):
+    """
+    Интерфейс бэкенда. Параметры генерации (params): prompt, max_tokens,
+    temperature, top_p. Метрики — словарь в формате Replicate
+    (time_to_first_token в секундах, output_token_count), можно пустой.
+    """
+
+    name = 'base'
+
+    def is_configured(self, api_key: str = None) -> bool:
+        """Можно ли обращаться к модели (например, задан ли токен)."""
+        return True
+
+    @abstractmethod
+    def run(self, model: str, params: dict, api_key: str = None) -> tuple:
+        """Синхронная генерация. Возвращает (текст, метрики)."""
+
+    @abstractmethod
+    def stream_async(self, model: str, params: dict, api_key: str = None):
+        """
+        Асинхронная генерация по фрагментам: async-генератор строк (async def с yield).
+        Если итератор закрыть или отменить до конца, генерация у провайдера прерывается.
+        """
+
+    @abstractmethod
+    async def run_async(self, model: str, params: dict, api_key: str = None) -> tuple:
+        """Асинхронная генерация; при отмене корутины генерация прерывается. Возвращает (текст, метрики)."""
+
+    def describe(self) -> dict:
+        """Описание для мониторинга."""
+        return {'backend': self.name}
+
+class ReplicateBackend(LLMBackend):
+    """Replicate API через общие клиенты с пулом keep-alive соединений."""
+
+    name = 'replicate'
+
+    def __init__(self):
+        # Клиенты по API-токену (обычно один на процесс).
+        # Синхронный и асинхронный клиенты раздельные: у них разные транспорты.
+        self._clients = {}
+        self._async_clients = {}
+        self._lock = threading.Lock()
+
+    def is_configured(self, api_key: str = None) -> bool:
+        api_key = api_key or os.getenv("REPLICATE_API_TOKEN")
+        return bool(api_key and len(api_key) > 20)
+
+    def get_client(self, api_key: str = None, is_async: bool = False):
+        """Возвращает общий клиент Replicate (создается один раз на токен)."""
+        import replicate
+
+        api_key = api_key or os.getenv("REPLICATE_API_TOKEN")
+        clients = self._async_clients if is_async else self._clients
+
+        client = clients.get(api_key)
+        if client is not None:
+            return client
+
+        with self._lock:
+            client = clients.get(api_key)
+            if client is None:
+                transport_class = httpx.AsyncHTTPTransport if is_async else httpx.HTTPTransport
+                client = replicate.Client(
+                    api_token=api_key,
+                    timeout=_build_timeout(),
+                    transport=transport_class(limits=_build_limits())
+                )
+                clients[api_key] = client
+                if not is_async:
+                    print(f"🔌 Создан общий LLM клиент (пул: {LLM_POOL_SIZE}, keep-alive: {LLM_KEEPALIVE_SECONDS:.0f} сек)")
+
+        return client
+
+    def run(self, model: str, params: dict, api_key: str = None) -> tuple:
+        output = self.get_client(api_key).run(model, input=params)
+        return _output_to_text(output), {}
+
+    async def stream_async(self, model: str, params: dict, api_key: str = None):
+        client = self.get_client(api_key, is_async=True)
+        prediction = await client.models.predictions.async_create(model=model, input=params, stream=True)
+        finished = False
+
+        try:
+            async for event in prediction.async_stream():
+                if event.event.value == 'error':
+                    raise LLMError(f"ошибка генерации: {event.data}")
+                # Текст есть только у событий output, у остальных str() пустой
+                yield str(event)
+            finished = True
+        finally:
+            if not finished:
+                # Клиент ушел или вышел бюджет времени: отмену отправляем в фоне
+                asyncio.get_running_loop().create_task(self._cancel_prediction(prediction))
+
+    async def run_async(self, model: str, params: dict, api_key: str = None) -> tuple:
+        client = self.get_client(api_key, is_async=True)
+        prediction = await client.models.predictions.async_create(model=model, input=params)
+
+        try:
+            await prediction.async_wait()
+        except asyncio.CancelledError:
+            # Отмену отправляем в фоне: текущая задача уже отменена
+            asyncio.get_running_loop().create_task(self._cancel_prediction(prediction))
+            raise
+
+        if prediction.status != "succeeded":
+            raise LLMError(f"генерация завершилась со статусом {prediction.status}: {prediction.error}")
+
+        return _output_to_text(prediction.output), getattr(prediction, 'metrics', None) or {}
+
+    @staticmethod
+    async def _cancel_prediction(prediction):
+        """Отменяет генерацию на стороне Replicate (ошибки игнорируются)."""
+        try:
+            await prediction.async_cancel()
+            print(f"🛑 Генерация {prediction.id} отменена")
+        except Exception as e:
+            print(f"⚠️ Не удалось отменить генерацию {prediction.id}: {e}")
+
+class OpenAICompatibleBackend(LLMBackend):
+    """Локальный OpenAI-совместимый сервер (эндпоинт /completions)."""
+
+    name = 'openai'
+
+    def __init__(self, base_url: str = LLM_OPENAI_BASE_URL, api_key: str = LLM_OPENAI_API_KEY,
+                 model: str = LLM_OPENAI_MODEL):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
+        self._client = httpx.Client(base_url=self.base_url, headers=headers,
+                                    timeout=_build_timeout(), limits=_build_limits())
+        self._async_client = httpx.AsyncClient(base_url=self.base_url, headers=headers,
+                                               timeout=_build_timeout(), limits=_build_limits())
+
+    def _body(self, model: str, params: dict, stream: bool = False) -> dict:
+        # Модель вызова (в том числе запасная при хеджировании) важнее модели по умолчанию
+        return {**params, 'model': model or self.model, 'stream': stream}
+
+    @staticmethod
+    def _parse(response: httpx.Response) -> tuple:
+        if response.status_code != 200:
+            raise LLMError(f"сервер модели ответил {response.status_code}: {response.text[:200]}")
+        data = response.json()
+        text = data['choices'][0].get('text', '')
+        usage = data.get('usage') or {}
+        metrics = {}
+        if usage.get('completion_tokens') is not None:
+            metrics['output_token_count'] = usage['completion_tokens']
+        return text, metrics
+
+    def run(self, model: str, params: dict, api_key: str = None) -> tuple:
+        return self._parse(self._client.post('/completions', json=self._body(model, params)))
+
+    async def stream_async(self, model: str, params: dict, api_key: str = None):
+        # При закрытии итератора httpx закрывает соединение, и сервер прекращает генерацию
+        async with self._async_client.stream('POST', '/completions',
+                                             json=self._body(model, params, stream=True)) as response:
+            if response.status_code != 200:
+                await response.aread()
+                raise LLMError(f"сервер модели ответил {response.status_code}: {response.text[:200]}")
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                payload = line[5:].strip()
+                if payload == '[DONE]':
+                    break
+                text = json.loads(payload)['choices'][0].get('text', '')
+                if text:
+                    yield text
+
+    async def run_async(self, model: str, params: dict, api_key: str = None) -> tuple:
+        # При отмене httpx закрывает соединение, и сервер прекращает генерацию
+        return self._parse(await self._async_client.post('/completions', json=self._body(model, params)))
+
+    def describe(self) -> dict:
+        return {'backend': self.name, 'base_url': self.base_url, 'model': self.model or None}
+
+class FakeGenerator:
+    """
+    Имитация провайдера: для каждого вызова разыгрывает время до первого
+    токена, интервал между токенами, ошибку и выбирает заготовленный ответ.
+    """
+
+    def __init__(self, ttft_ms: float = LLM_FAKE_TTFT_MS, ttft_sigma: float = LLM_FAKE_TTFT_SIGMA,
+                 tokens_per_second: float = LLM_FAKE_TOKENS_PER_SECOND,
+                 error_rate: float = LLM_FAKE_ERROR_RATE,
+                 outputs_file: str = LLM_FAKE_OUTPUTS_FILE, seed: str = LLM_FAKE_SEED):
+        self.ttft_ms = ttft_ms
+        self.ttft_sigma = ttft_sigma
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.outputs = self._load_outputs(outputs_file) + FAKE_DEFAULT_OUTPUTS
+        self._random = random.Random(seed or None)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    @staticmethod
+    def _load_outputs(path: str) -> list:
+        if not path:
+            return []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                outputs = json.load(f)
+        except Exception as e:
+            print(f"⚠️ Заглушка LLM: не удалось прочитать {path}: {e}")
+            return []
+        # Файл прочитан, но не того вида: молча подменять ответы встроенными нельзя
+        if not isinstance(outputs, list):
+            found = f"JSON-{type(outputs).__name__}"
+        else:
+            found = next((f"элемент {position}: {item!r:.60}" for position, item in enumerate(outputs)
+                          if not (isinstance(item, dict) and isinstance(item.get('output'), str))), None)
+        if found:
+            raise ValueError(
+                f"LLM_FAKE_OUTPUTS_FILE {path}: нужен JSON-список объектов "
+                f'{{"match": "...", "output": "..."}}, а в файле {found}'
+            )
+        print(f"🧪 Заглушка LLM: загружено {len(outputs)} заготовленных ответов из {path}")
+        return outputs
+
+    def plan(self, prompt: str, max_tokens: int = None) -> dict:
+        """Разыгрывает один вызов: ttft и interval в секундах, токены ответа, ошибка или None."""
+        with self._lock:
+            self.calls += 1
+            if self.ttft_sigma > 0:
+                ttft = self._random.lognormvariate(math.log(max(self.ttft_ms, 1.0)), self.ttft_sigma)
+            else:
+                ttft = self.ttft_ms
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+
+        output = next(item['output'] for item in self.outputs if item.get('match', '') in prompt)
+        tokens = _TOKEN_RE.findall(output) or [output]
+        if max_tokens:
+            tokens = tokens[:max_tokens]
+
+        return {
+            'ttft': ttft / 1000,
+            'interval': 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0,
+            'tokens': tokens,
+            'error': "имитация ошибки провайдера" if failed else None,
+        }
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'ttft_ms_median': self.ttft_ms,
+            'ttft_sigma': self.ttft_sigma,
+            'tokens_per_second': self.tokens_per_second,
+            'error_rate': self.error_rate,
+        }
+
+class FakeBackend(LLMBackend):
+    """Заглушка в процессе: задержки по FakeGenerator, без сети."""
+
+    name = 'fake'
+
+    def __init__(self, generator: FakeGenerator = None):
+        self.generator = generator or FakeGenerator()
+
+    def _plan(self, params: dict) -> dict:
+        return self.generator.plan(params.get('prompt', ''), params.get('max_tokens'))
+
+    @staticmethod
+    def _metrics(plan: dict) -> dict:
+        return {'time_to_first_token': plan['ttft'], 'output_token_count': len(plan['tokens'])}
+
+    def run(self, model: str, params: dict, api_key: str = None) -> tuple:
+        plan = self._plan(params)
+        time.sleep(plan['ttft'])
+        if plan['error']:
+            raise LLMError(plan['error'])
+        time.sleep(plan['interval'] * len(plan['tokens']))
+        return "".join(plan['tokens']), self._metrics(plan)
+
+    async def stream_async(self, model: str, params: dict, api_key: str = None):
+        plan = self._plan(params)
+        await asyncio.sleep(plan['ttft'])
+        if plan['error']:
+            raise LLMError(plan['error'])
+        for token in plan['tokens']:
+            yield token
+            await asyncio.sleep(plan['interval'])
+
+    async def run_async(self, model: str, params: dict, api_key: str = None) -> tuple:
+        plan = self._plan(params)
+        await asyncio.sleep(plan['ttft'])
+        if plan['error']:
+            raise LLMError(plan['error'])
+        await asyncio.sleep(plan['interval'] * len(plan['tokens']))
+        return "".join(plan['tokens']), self._metrics(plan)
+
+    def describe(self) -> dict:
+        return {'backend': self.name, **self.generator.stats()}
+
+_BACKENDS = {
+    'replicate': ReplicateBackend,
+    'openai': OpenAICompatibleBackend,
+    'fake': FakeBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend() -> LLMBackend:
+    """Бэкенд процесса по LLM_BACKEND (создается при первом обращении)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = _BACKENDS.get(LLM_BACKEND)
+                if backend_class is None:
+                    print(f"⚠️ Неизвестный LLM_BACKEND={LLM_BACKEND}, используем replicate")
+                    backend_class = ReplicateBackend
+                _backend = backend_class()
+                print(f"🧠 LLM бэкенд: {_backend.name}")
+    return _backend
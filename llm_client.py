@@ -0,0 +1,404 @@
+"""
+Общий клиент LLM для всего процесса.
+
+Генерацию выполняет бэкенд из llm_backends.py (Replicate, локальный
+OpenAI-совместимый сервер или заглушка — по LLM_BACKEND). Вместо нового
+клиента на каждый вызов (и нового TCP/TLS-рукопожатия) бэкенды держат
+общий пул keep-alive соединений (настройки пула — в llm_backends.py).
+Бюджеты времени задаются переменными окружения:
+- LLM_REPLY_TIMEOUT — бюджет на генерацию ответа клиенту, сек (8)
+- LLM_EXTRACT_TIMEOUT — бюджет на вспомогательные вызовы (имя, процедура), сек (5)
+
+Для async-кода есть run_text_async: при отмене (например, по asyncio.wait_for)
+HTTP-запрос прерывается, а генерация у провайдера отменяется,
+поэтому по таймауту не остается «зависших» потоков и запросов.
+
+Хеджирование (run_text_async с параметром site): если основная модель не ответила
+за N мс, тот же промпт отправляется в быструю модель, и берется первый
+корректный ответ. Настройки по месту вызова (site = reply, name, client_info):
+- LLM_HEDGE_<SITE>_DELAY_MS — через сколько мс запускать запасную модель (0 — без хеджирования)
+- LLM_HEDGE_<SITE>_MODELS — модели через запятую: основная, затем запасные. Основная —
+  только по умолчанию: модель, переданная в вызов, идет первой вместо нее
+- LLM_HEDGE_<SITE>_CANCEL_LOSER — отменять ли проигравшую генерацию (1/0)
+
+Все вызовы проходят через общий выключатель (circuit_breaker.py): когда
+провайдер деградирует, вызовы сразу получают LLMUnavailableError и
+вызывающий код отдает fallback без ожидания таймаута.
+
+Каждый вызов записывается в llm_metrics (место вызова, модель, размер
+промпта, токены, время до первого токена, задержка, исход).
+
+Одинаковые одновременные запросы (тот же промпт, параметры и место вызова)
+склеиваются: пока первый выполняется, остальные ждут его результат, а не
+запускают свою генерацию. Потоковая генерация (stream_text_async) не склеивается;
+закрытие или отмена ее итератора прерывает генерацию у провайдера.
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import threading
+
+import httpx
+
+from circuit_breaker import CircuitBreaker
+from llm_metrics import llm_metrics, CallTimer
+from llm_backends import LLM_BACKEND, LLMError, get_backend
+
+DEFAULT_MODEL = "meta/meta-llama-3-70b-instruct"
+
+LLM_REPLY_TIMEOUT = float(os.getenv("LLM_REPLY_TIMEOUT", "8"))
+LLM_EXTRACT_TIMEOUT = float(os.getenv("LLM_EXTRACT_TIMEOUT", "5"))
+
+HEDGE_MODEL = "meta/meta-llama-3-8b-instruct"
+
+# Хеджирование по месту вызова: задержка до запуска запасной модели,
+# список моделей и что делать с проигравшей генерацией
+_HEDGE_DEFAULTS = {
+    'reply': {'delay_ms': 3000, 'models': [DEFAULT_MODEL, HEDGE_MODEL], 'cancel_loser': True},
+    'name': {'delay_ms': 1500, 'models': [DEFAULT_MODEL, HEDGE_MODEL], 'cancel_loser': True},
+    'client_info': {'delay_ms': 1500, 'models': [DEFAULT_MODEL, HEDGE_MODEL], 'cancel_loser': True},
+}
+
+# Проигравшие генерации, которые досчитываются в фоне (cancel_loser = 0)
+_background_tasks = set()
+
+# Выполняющиеся запросы для склейки одинаковых: ключ → общий результат
+_inflight_async = {}
+_inflight_sync = {}
+_inflight_lock = threading.Lock()
+_flight_stats = {'leaders': 0, 'coalesced': 0}
+
+class LLMUnavailableError(LLMError):
+    """Выключатель разомкнут: провайдер считается недоступным, нужен fallback."""
+
+# Общий выключатель для всех вызовов модели (ответы, имя, намерение)
+llm_breaker = CircuitBreaker(LLM_BACKEND)
+
+def _check_breaker(site: str, model: str, prompt: str):
+    """Сразу отказывает, если выключатель разомкнут (отказ тоже попадает в метрики)."""
+    if not llm_breaker.allow_request():
+        llm_metrics.record(site, model, len(prompt), estimate_tokens(prompt), latency_ms=0.0, outcome='fallback')
+        raise LLMUnavailableError("LLM временно недоступен (выключатель разомкнут)")
+
+def _error_outcome(error: BaseException) -> str:
+    """Исход для метрик: таймаут провайдера или ошибка."""
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return 'timeout'
+    return 'error'
+
+def _record_call(site: str, model: str, prompt: str, timer: CallTimer, outcome: str,
+                 text: str = None, provider_metrics: dict = None, error: str = None):
+    """Записывает вызов в метрики; токены и TTFT берутся у бэкенда, если он их вернул."""
+    provider_metrics = provider_metrics or {}
+    
+    ttft_ms = timer.ttft_ms()
+    if ttft_ms is None and provider_metrics.get('time_to_first_token') is not None:
+        ttft_ms = provider_metrics['time_to_first_token'] * 1000
+    
+    output_tokens = provider_metrics.get('output_token_count')
+    if output_tokens is None and text is not None:
+        output_tokens = estimate_tokens(text)
+    
+    llm_metrics.record(
+        site, model, len(prompt), estimate_tokens(prompt),
+        output_tokens=output_tokens, ttft_ms=ttft_ms, latency_ms=timer.elapsed_ms(),
+        outcome=outcome, error=error
+    )
+
+def _load_hedge_config() -> dict:
+    """Собирает настройки хеджирования с учетом переменных окружения."""
+    config = {}
+    for site, defaults in _HEDGE_DEFAULTS.items():
+        prefix = f"LLM_HEDGE_{site.upper()}_"
+        models = os.getenv(prefix + "MODELS")
+        config[site] = {
+            'delay_ms': float(os.getenv(prefix + "DELAY_MS", defaults['delay_ms'])),
+            'models': [m.strip() for m in models.split(',') if m.strip()] if models else list(defaults['models']),
+            'cancel_loser': os.getenv(prefix + "CANCEL_LOSER", "1" if defaults['cancel_loser'] else "0") not in ("0", "false", "no"),
+        }
+    return config
+
+HEDGE_CONFIG = _load_hedge_config()
+
+def get_hedge_config() -> dict:
+    """Настройки хеджирования для мониторинга."""
+    return HEDGE_CONFIG
+
+def is_llm_configured(api_key: str = None) -> bool:
+    """Можно ли обращаться к модели (для Replicate — задан ли токен)."""
+    return get_backend().is_configured(api_key)
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов (около 3 символов на токен для русского текста)."""
+    return (len(text) + 2) // 3
+
+def _build_params(prompt: str, max_tokens: int, temperature: float, top_p: float) -> dict:
+    """Параметры генерации в формате бэкенда."""
+    return {
+        "prompt": prompt,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": top_p
+    }
+
+def _flight_key(prompt: str, max_tokens: int, temperature: float, top_p: float,
+                model: str, site: str) -> str:
+    """Ключ склейки: хэш промпта и параметров генерации."""
+    raw = f"{site}|{model}|{max_tokens}|{temperature}|{top_p}|{prompt}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def get_single_flight_stats() -> dict:
+    """Сколько запросов выполнено и сколько присоединилось к уже идущим."""
+    with _inflight_lock:
+        return {
+            **_flight_stats,
+            'in_flight': len(_inflight_async) + len(_inflight_sync),
+        }
+
+def run_text(prompt: str, max_tokens: int, temperature: float, top_p: float = 0.9,
+             model: str = DEFAULT_MODEL, api_key: str = None, site: str = None) -> str:
+    """
+    Выполняет промпт и возвращает полный текст ответа модели.
+    Если такой же запрос уже выполняется в другом потоке, ждет его результат.
+    """
+    key = _flight_key(prompt, max_tokens, temperature, top_p, model, site)
+    
+    with _inflight_lock:
+        flight = _inflight_sync.get(key)
+        is_leader = flight is None
+        if is_leader:
+            flight = {'done': threading.Event(), 'result': None, 'error': None}
+            _inflight_sync[key] = flight
+            _flight_stats['leaders'] += 1
+        else:
+            _flight_stats['coalesced'] += 1
+    
+    if not is_leader:
+        print(f"🔗 [{site}] Такой же запрос уже выполняется, ждем его результат")
+        flight['done'].wait()
+        if flight['error'] is not None:
+            raise flight['error']
+        return flight['result']
+    
+    try:
+        flight['result'] = _run_text_once(prompt, max_tokens, temperature, top_p, model, api_key, site)
+        return flight['result']
+    except Exception as e:
+        flight['error'] = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight_sync.pop(key, None)
+        flight['done'].set()
+
+def _run_text_once(prompt: str, max_tokens: int, temperature: float, top_p: float,
+                   model: str, api_key: str, site: str) -> str:
+    """Один синхронный вызов модели (выключатель и метрики)."""
+    _check_breaker(site, model, prompt)
+    timer = CallTimer()
+    try:
+        text, provider_metrics = get_backend().run(
+            model, _build_params(prompt, max_tokens, temperature, top_p), api_key
+        )
+    except Exception as e:
+        llm_breaker.record_failure(timer.elapsed_ms() / 1000, str(e))
+        _record_call(site, model, prompt, timer, _error_outcome(e), error=str(e))
+        raise
+    
+    llm_breaker.record_success(timer.elapsed_ms() / 1000)
+    _record_call(site, model, prompt, timer, 'ok', text=text, provider_metrics=provider_metrics)
+    return text
+
+async def stream_text_async(prompt: str, max_tokens: int, temperature: float, top_p: float = 0.9,
+                            model: str = DEFAULT_MODEL, api_key: str = None, site: str = None):
+    """
+    Выполняет промпт и выдает фрагменты ответа по мере генерации (async-итератор).
+    Если итератор закрыть или отменить (клиент ушел, вышел бюджет времени),
+    генерация у провайдера прерывается.
+    """
+    _check_breaker(site, model, prompt)
+    timer = CallTimer()
+    chunks = []
+    tokens = get_backend().stream_async(model, _build_params(prompt, max_tokens, temperature, top_p), api_key)
+    try:
+        async for token in tokens:
+            if token:
+                timer.mark_first_token()
+                chunks.append(token)
+                yield token
+    except (GeneratorExit, asyncio.CancelledError):
+        # Клиент ушел или вышел наш бюджет времени — провайдер тут не виноват
+        llm_breaker.record_cancelled(timer.elapsed_ms() / 1000)
+        _record_call(site, model, prompt, timer, 'cancelled', text="".join(chunks))
+        raise
+    except Exception as e:
+        llm_breaker.record_failure(timer.elapsed_ms() / 1000, str(e))
+        _record_call(site, model, prompt, timer, _error_outcome(e), text="".join(chunks), error=str(e))
+        raise
+    finally:
+        # Закрываем генерацию бэкенда сразу, а не при сборке мусора
+        await tokens.aclose()
+    
+    llm_breaker.record_success(timer.elapsed_ms() / 1000)
+    _record_call(site, model, prompt, timer, 'ok', text="".join(chunks))
+
+async def _run_prediction_async(prompt: str, max_tokens: int, temperature: float, top_p: float,
+                                model: str, api_key: str = None) -> tuple:
+    """
+    Одна генерация через бэкенд; при отмене генерация у провайдера тоже прерывается.
+    Возвращает (текст, метрики провайдера).
+    """
+    return await get_backend().run_async(model, _build_params(prompt, max_tokens, temperature, top_p), api_key)
+
+def _is_valid_output(text: str) -> bool:
+    """Ответ годится, если в нем есть хоть что-то кроме пробелов."""
+    return bool(text and text.strip())
+
+async def run_text_async(prompt: str, max_tokens: int, temperature: float, top_p: float = 0.9,
+                         model: str = DEFAULT_MODEL, api_key: str = None, site: str = None) -> str:
+    """
+    Асинхронно выполняет промпт и возвращает полный текст ответа.
+    При отмене корутины генерация у провайдера тоже отменяется.
+    
+    Если задан site с настройками хеджирования, через delay_ms без ответа
+    запускается запасная модель; возвращается первый корректный ответ.
+    При разомкнутом выключателе сразу выбрасывает LLMUnavailableError.
+    
+    Одинаковые одновременные запросы ждут одну общую генерацию; она
+    отменяется, только когда отменены все ожидающие.
+    """
+    key = (id(asyncio.get_running_loop()), _flight_key(prompt, max_tokens, temperature, top_p, model, site))
+    
+    flight = _inflight_async.get(key)
+    if flight is None:
+        task = asyncio.ensure_future(
+            _run_text_async_once(prompt, max_tokens, temperature, top_p, model, api_key, site)
+        )
+        flight = {'task': task, 'waiters': 0}
+        _inflight_async[key] = flight
+        
+        def forget(_task, key=key, flight=flight):
+            if _inflight_async.get(key) is flight:
+                del _inflight_async[key]
+        
+        task.add_done_callback(forget)
+        with _inflight_lock:
+            _flight_stats['leaders'] += 1
+    else:
+        with _inflight_lock:
+            _flight_stats['coalesced'] += 1
+        print(f"🔗 [{site}] Такой же запрос уже выполняется, ждем его результат")
+    
+    flight['waiters'] += 1
+    try:
+        return await asyncio.shield(flight['task'])
+    except asyncio.CancelledError:
+        flight['waiters'] -= 1
+        if flight['waiters'] == 0:
+            # Результат больше никому не нужен — отменяем генерацию
+            if _inflight_async.get(key) is flight:
+                del _inflight_async[key]
+            flight['task'].cancel()
+        raise
+
+async def _run_text_async_once(prompt: str, max_tokens: int, temperature: float, top_p: float,
+                               model: str, api_key: str, site: str) -> str:
+    """Один async-вызов модели (выключатель, хеджирование и метрики)."""
+    _check_breaker(site, model, prompt)
+    timer = CallTimer()
+    try:
+        text, used_model, provider_metrics = await _run_hedged_async(
+            prompt, max_tokens, temperature, top_p, model, api_key, site
+        )
+    except asyncio.CancelledError:
+        # Отмену инициировало приложение (бюджет времени, ушли все ожидающие)
+        llm_breaker.record_cancelled(timer.elapsed_ms() / 1000)
+        _record_call(site, model, prompt, timer, 'cancelled')
+        raise
+    except Exception as e:
+        llm_breaker.record_failure(timer.elapsed_ms() / 1000, str(e))
+        _record_call(site, model, prompt, timer, _error_outcome(e), error=str(e))
+        raise
+    
+    llm_breaker.record_success(timer.elapsed_ms() / 1000)
+    _record_call(site, used_model, prompt, timer, 'ok', text=text, provider_metrics=provider_metrics)
+    return text
+
+async def _run_hedged_async(prompt: str, max_tokens: int, temperature: float, top_p: float,
+                            model: str, api_key: str, site: str) -> tuple:
+    """
+    Генерация с хеджированием по настройкам места вызова.
+    Возвращает (текст, модель-победитель, метрики провайдера).
+    """
+    config = HEDGE_CONFIG.get(site)
+    # Первой идет модель вызова, запасные — из настроек места вызова
+    hedge_models = [m for m in (config['models'][1:] if config else []) if m != model]
+    if not config or config['delay_ms'] <= 0 or not hedge_models:
+        text, provider_metrics = await _run_prediction_async(prompt, max_tokens, temperature, top_p, model, api_key)
+        return text, model, provider_metrics
+    
+    models = [model, *hedge_models]
+    started = time.perf_counter()
+    tasks = {}
+    
+    def launch(next_model):
+        task = asyncio.ensure_future(
+            _run_prediction_async(prompt, max_tokens, temperature, top_p, next_model, api_key)
+        )
+        tasks[task] = next_model
+        return task
+    
+    pending = {launch(models.pop(0))}
+    last_error = None
+    
+    try:
+        while pending:
+            # Пока есть запасные модели, ждем не дольше задержки хеджирования
+            timeout = config['delay_ms'] / 1000 if models else None
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            
+            if not done:
+                hedge_model = models.pop(0)
+                print(f"🪁 [{site}] Нет ответа за {config['delay_ms']:.0f} мс, запускаю запасную модель {hedge_model}")
+                pending.add(launch(hedge_model))
+                continue
+            
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    print(f"⚠️ [{site}] Модель {tasks[task]} завершилась с ошибкой: {last_error}")
+                    continue
+                
+                result, provider_metrics = task.result()
+                if not _is_valid_output(result):
+                    last_error = LLMError(f"пустой ответ модели {tasks[task]}")
+                    continue
+                
+                if len(tasks) > 1:
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    print(f"🏁 [{site}] Ответ от {tasks[task]} за {elapsed_ms:.0f} мс")
+                _finish_losers(pending, config['cancel_loser'])
+                return result, tasks[task], provider_metrics
+            
+            # Основная модель упала сразу — не ждем задержку, запускаем запасную
+            if not pending and models:
+                pending.add(launch(models.pop(0)))
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+    
+    raise last_error or LLMError("ни одна модель не вернула ответ")
+
+def _finish_losers(pending: set, cancel_loser: bool):
+    """Отменяет проигравшие генерации или оставляет их досчитываться в фоне."""
+    for task in pending:
+        if cancel_loser:
+            task.cancel()
+        else:
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+            # Результат проигравшей генерации не нужен, но исключение надо забрать
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
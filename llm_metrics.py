@@ -0,0 +1,138 @@
+"""
+Метрики вызовов LLM.
+
+Каждый вызов модели записывается в кольцевой буфер: место вызова, модель,
+размер промпта (символы и оценка токенов), токены ответа, время до первого
+токена, полная задержка и исход (ok, timeout, error, fallback, cancelled —
+вызов отменило само приложение).
+По буферу считаются перцентили — так видно, как рост прайса
+(procedures.json) и промпта влияет на задержку.
+
+Настройки:
+- LLM_METRICS_BUFFER_SIZE — сколько последних вызовов хранить (по умолчанию 1000)
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from datetime import datetime
+
+LLM_METRICS_BUFFER_SIZE = int(os.getenv("LLM_METRICS_BUFFER_SIZE", "1000"))
+
+OUTCOMES = ('ok', 'timeout', 'error', 'fallback', 'cancelled')
+
+def _percentile(sorted_values: list, percent: float):
+    """Перцентиль по методу ближайшего ранга."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+class LLMMetrics:
+    """Кольцевой буфер вызовов LLM с агрегатами по месту вызова."""
+
+    def __init__(self, size: int = LLM_METRICS_BUFFER_SIZE):
+        self.size = size
+        self.total_calls = 0
+        self._records = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, site: str, model: str, prompt_chars: int, prompt_tokens: int,
+               output_tokens: int = None, ttft_ms: float = None, latency_ms: float = None,
+               outcome: str = 'ok', error: str = None):
+        """Записывает один вызов модели."""
+        entry = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'site': site or 'unknown',
+            'model': model,
+            'prompt_chars': prompt_chars,
+            'prompt_tokens': prompt_tokens,
+            'output_tokens': output_tokens,
+            'ttft_ms': round(ttft_ms, 1) if ttft_ms is not None else None,
+            'latency_ms': round(latency_ms, 1) if latency_ms is not None else None,
+            'outcome': outcome,
+        }
+        if error:
+            entry['error'] = error[:200]
+
+        with self._lock:
+            self._records.append(entry)
+            self.total_calls += 1
+
+    def recent(self, limit: int = 50, site: str = None) -> list:
+        """Последние вызовы (новые первыми)."""
+        with self._lock:
+            records = list(self._records)
+        if site:
+            records = [r for r in records if r['site'] == site]
+        return list(reversed(records[-limit:])) if limit > 0 else []
+
+    def summary(self) -> dict:
+        """Агрегаты по местам вызова: исходы, перцентили задержки и TTFT, размеры."""
+        with self._lock:
+            records = list(self._records)
+
+        by_site = {}
+        for record in records:
+            by_site.setdefault(record['site'], []).append(record)
+
+        sites = {}
+        for site, site_records in sorted(by_site.items()):
+            latencies = sorted(r['latency_ms'] for r in site_records
+                               if r['outcome'] == 'ok' and r['latency_ms'] is not None)
+            ttfts = sorted(r['ttft_ms'] for r in site_records if r['ttft_ms'] is not None)
+            prompt_tokens = [r['prompt_tokens'] for r in site_records]
+            output_tokens = [r['output_tokens'] for r in site_records if r['output_tokens'] is not None]
+            models = {}
+            for r in site_records:
+                if r['model']:
+                    models[r['model']] = models.get(r['model'], 0) + 1
+
+            sites[site] = {
+                'calls': len(site_records),
+                'outcomes': {outcome: sum(1 for r in site_records if r['outcome'] == outcome) for outcome in OUTCOMES},
+                'models': models,
+                'latency_ms': {
+                    'p50': _percentile(latencies, 50),
+                    'p90': _percentile(latencies, 90),
+                    'p99': _percentile(latencies, 99),
+                    'max': latencies[-1] if latencies else None,
+                },
+                'ttft_ms': {
+                    'p50': _percentile(ttfts, 50),
+                    'p90': _percentile(ttfts, 90),
+                },
+                'prompt_tokens_avg': round(sum(prompt_tokens) / len(prompt_tokens)) if prompt_tokens else None,
+                'prompt_tokens_max': max(prompt_tokens) if prompt_tokens else None,
+                'output_tokens_avg': round(sum(output_tokens) / len(output_tokens)) if output_tokens else None,
+            }
+
+        return {
+            'buffer_size': self.size,
+            'buffered_calls': len(records),
+            'total_calls': self.total_calls,
+            'sites': sites,
+        }
+
+class CallTimer:
+    """Засекает время одного вызова: старт, первый токен, окончание."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at = None
+
+    def mark_first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def ttft_ms(self):
+        if self.first_token_at is None:
+            return None
+        return (self.first_token_at - self.started) * 1000
+
+# Общие метрики процесса
+llm_metrics = LLMMetrics()
@@ -0,0 +1,170 @@
+"""
+Локальный классификатор процедур на символьных n-граммах.
+
+Работает без сети и без модели. Сначала ищутся целые совпадения: слово
+сообщения (или пара соседних слов) начинается с ключевого слова или алиаса,
+дальше — только окончание ("эпиляцию", "капельницу"). Такое совпадение
+дает сходство 1.0, а пара слов закрывает свои слова ("убрать волосы" —
+эпиляция, хотя "волос" — алиас мезотерапии). Только если целых совпадений
+нет, слова сравниваются с ключевыми по общим триграммам — опечатка
+("капелница") дает метку с пониженной уверенностью. Возвращает метку
+и уверенность 0..1; уверенность снижается, если вторая метка близка.
+AI вызывается, только если уверенность ниже порога. Имена распознает name_recognizer.py по словарю
+с тем же порогом.
+
+Настройки:
+- LOCAL_CLASSIFIER_THRESHOLD — порог уверенности, выше которого AI не нужен (по умолчанию 0.8)
+"""
+
+import os
+import re
+import math
+from itertools import product
+
+from keywords import PROCEDURE_KEYWORDS, PROCEDURE_PHRASES, CATALOG_PROCEDURE_LABELS
+
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.8"))
+
+NGRAM_SIZE = 3
+
+# Ниже этого сходства слово не считается упоминанием ключевого слова
+MIN_TERM_SCORE = 0.6
+
+# Целое совпадение: ключевое слово не короче MIN_PREFIX_LENGTH, после него
+# в слове сообщения окончание — не больше MAX_ENDING_LENGTH букв, с гласной или ь
+# ("уколы", "лазером", но не "порывы" для "поры")
+MIN_PREFIX_LENGTH = 4
+MAX_ENDING_LENGTH = 4
+ENDING_START = frozenset('аеиоуыэюяь')
+
+# Сходство по триграммам умножается на этот вес: опечатка никогда
+# не перевешивает целое совпадение и сама по себе редко проходит порог
+FUZZY_WEIGHT = 0.85
+
+_WORD_RE = re.compile(r'[a-zа-яё]+', re.IGNORECASE)
+
+def _ngrams(text: str) -> frozenset:
+    """Триграммы слова с маркером начала (конец не маркируем: ключевые слова — основы)."""
+    padded = '<' + text
+    if len(padded) <= NGRAM_SIZE:
+        return frozenset([padded])
+    return frozenset(padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1))
+
+def _words(text: str) -> list:
+    """Слова сообщения в нижнем регистре (ё → е)."""
+    return [word.lower().replace('ё', 'е') for word in _WORD_RE.findall(text)]
+
+def _prefixes(word: str) -> list:
+    """Само слово и его начала без окончания — от длинных к коротким."""
+    shortest = max(MIN_PREFIX_LENGTH, len(word) - MAX_ENDING_LENGTH)
+    return [word] + [word[:end] for end in range(len(word) - 1, shortest - 1, -1)
+                     if word[end] in ENDING_START]
+
+class NgramClassifier:
+    """Целое ключевое слово, иначе ближайшее по триграммам; метка — класс этого слова."""
+
+    def __init__(self, samples: dict):
+        # samples: {метка: [ключевые слова]}
+        self._labels = []
+        self._sizes = []
+        self._postings = {}
+        self._exact = {}
+
+        for label, terms in samples.items():
+            for term in terms:
+                term = ' '.join(_words(term))
+                if not term:
+                    continue
+                self._exact.setdefault(term, set()).add(label)
+                grams = _ngrams(term)
+                sample_id = len(self._labels)
+                self._labels.append(label)
+                self._sizes.append(len(grams))
+                for gram in grams:
+                    self._postings.setdefault(gram, []).append(sample_id)
+
+    def score_term(self, term: str) -> dict:
+        """Возвращает {метка: сходство} для одного слова или пары слов."""
+        grams = _ngrams(term)
+        overlap = {}
+        for gram in grams:
+            for sample_id in self._postings.get(gram, ()):
+                overlap[sample_id] = overlap.get(sample_id, 0) + 1
+
+        scores = {}
+        for sample_id, common in overlap.items():
+            size = self._sizes[sample_id]
+            # Окончание слова (до двух лишних триграмм) не штрафуем: ключевые слова — основы
+            slack = 2 if size >= 4 else 1
+            score = common / math.sqrt(size * min(len(grams), size + slack))
+            label = self._labels[sample_id]
+            if score > scores.get(label, 0.0):
+                scores[label] = score
+        return scores
+
+    def match_exact(self, words: list) -> set:
+        """Метки самого длинного ключевого слова, целиком совпавшего со словами (пустое множество — нет)."""
+        for parts in product(*(_prefixes(word) for word in words)):
+            labels = self._exact.get(' '.join(parts))
+            if labels:
+                return labels
+        return set()
+
+    def score_words(self, words: list) -> dict:
+        """
+        Сходство каждой метки по словам и парам соседних слов.
+        Целые совпадения (сначала пары) дают 1.0; триграммы — только если их нет.
+        """
+        scores = {}
+        covered = set()
+        for index in range(len(words) - 1):
+            labels = self.match_exact(words[index:index + 2])
+            if labels:
+                scores.update(dict.fromkeys(labels, 1.0))
+                covered.update((index, index + 1))
+        for index, word in enumerate(words):
+            if index not in covered:
+                scores.update(dict.fromkeys(self.match_exact([word]), 1.0))
+        if scores:
+            return scores
+
+        terms = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+        for term in terms:
+            for label, score in self.score_term(term).items():
+                score *= FUZZY_WEIGHT
+                if score > scores.get(label, 0.0):
+                    scores[label] = score
+        return scores
+
+def _decide(scores: dict) -> tuple:
+    """
+    Выбирает метку по сходствам. Уверенность снижается, если вторая метка близка.
+    Если ничего не совпало, возвращает (None, уверенность что метки нет).
+    """
+    ranked = sorted(scores.items(), key=lambda item: -item[1])
+    best_label, best = ranked[0] if ranked else (None, 0.0)
+
+    if best < MIN_TERM_SCORE:
+        # Почти совпавшее слово оставляет сомнение, случайные триграммы — нет
+        return None, round(1.0 - 0.5 * best, 3)
+
+    second = ranked[1][1] if len(ranked) > 1 else 0.0
+    if second < MIN_TERM_SCORE:
+        second = 0.0
+    confidence = max(0.0, best - 0.5 * second)
+    return best_label, round(min(confidence, 1.0), 3)
+
+def build_procedure_classifier(procedures: list) -> NgramClassifier:
+    """Обучает классификатор процедур на ключевых словах, фразах и алиасах каталога."""
+    samples = {label: list(terms) for label, terms in PROCEDURE_KEYWORDS.items()}
+    for label, phrases in PROCEDURE_PHRASES.items():
+        samples[label].extend(phrases)
+    for procedure in procedures:
+        label = CATALOG_PROCEDURE_LABELS.get(procedure.get('id'))
+        if label:
+            samples[label].extend(procedure.get('aliases', []))
+    return NgramClassifier(samples)
+
+def classify_procedure(classifier: NgramClassifier, message: str) -> tuple:
+    """Определяет процедуру в сообщении. Возвращает (процедура или None, уверенность)."""
+    return _decide(classifier.score_words(_words(message)))
@@ -3,16 +3,30 @@ import sys
 import asyncio
 from typing import Dict, Any
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from chatbot_logic import generate_bot_reply, extract_name_with_ai
-from telegram_utils import send_to_telegram, send_incomplete_to_telegram, send_complete_application_to_telegram
+from chatbot_logic import generate_bot_reply_async, stream_bot_reply, extract_name_with_ai_async, get_system_prompt_info, detect_procedure_locally
+from llm_client import LLM_REPLY_TIMEOUT, LLM_EXTRACT_TIMEOUT, llm_breaker, get_hedge_config, get_single_flight_stats, is_llm_configured
+from llm_backends import LLM_BACKEND, get_backend
+from llm_metrics import llm_metrics
+from reply_cache import reply_cache
+from keywords import PROCEDURE_WORDS, NOT_NAME_WORDS
+from text_normalizer import normalize_message
+from local_classifier import LOCAL_CLASSIFIER_THRESHOLD
+from name_recognizer import is_known_name
+from chat_session import new_web_session, measure_sessions
+from session_store import get_session_store, close_session_stores
+from session_scheduler import session_scheduler, INCOMPLETE_LEAD
+from session_history import append_message, render_transcript, session_revision, mark_incomplete_sent
+from telegram_utils import send_incomplete_to_telegram, send_complete_application_to_telegram
 from dotenv import load_dotenv
 import re
-from datetime import datetime, timedelta
+import json
+import secrets
+from datetime import datetime
 import requests
-import time
-from telegram_bot_handler import telegram_polling
+from telegram_bot_handler import telegram_polling, telegram_sessions
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -21,7 +35,8 @@ def validate_environment():
     """Проверяем обязательные переменные окружения."""
     print("🔍 Проверка переменных окружения...")
     
-    required_vars = ["REPLICATE_API_TOKEN"]
+    # Токен Replicate нужен только боевому бэкенду (локальный сервер и заглушка работают без него)
+    required_vars = ["REPLICATE_API_TOKEN"] if LLM_BACKEND == "replicate" else []
     missing = []
     
     for var_name in required_vars:
@@ -84,36 +99,42 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
 RENDER_EXTERNAL_URL = os.getenv("RENDER_EXTERNAL_URL", "")
 
-# Хранилище сессий пользователей
-user_sessions = {}
+# Хранилище сессий пользователей (ключ — токен сессии, выданный сервером).
+# Общее для воркеров, если SESSION_STORE = sqlite или redis
+user_sessions = get_session_store('web')
+
+# Токены веб-сессий: сервер выдает случайный токен, виджет хранит его в localStorage
+# и присылает с каждым сообщением. Сессия не зависит от IP (NAT, прокси Render).
+SESSION_TOKEN_BYTES = 24
+SESSION_TOKEN_PATTERN = re.compile(r'^[A-Za-z0-9_\-]{20,64}$')
 
 def get_fallback_response(message: str) -> str:
     """Простая логика ответа когда AI недоступен."""
-    message_lower = message.lower()
+    topics = normalize_message(message).keywords
     
     # Прокол ушей
-    if "прокол" in message_lower and ("ухо" in message_lower or "уши" in message_lower):
+    if topics.has('fallback_topic', 'piercing') and topics.has('fallback_topic', 'ear'):
         return "Прокол ушей выполняется специальным пистолетом. Стоимость:\n• Оба уха: 4000 руб.\n• Одно ухо: 2000 руб.\n\nСерёжки из медицинской стали включены в стоимость! Используем только стерильные одноразовые картриджи. Хотите записаться?"
     
-    if any(greet in message_lower for greet in ["добрый", "здравствуйте", "привет"]):
+    if topics.has('fallback_topic', 'greeting'):
         return "Здравствуйте! Клиника GLADIS, меня зовут Александра. Чем могу вам помочь?"
     
-    elif "трихолакс" in message_lower:
-        if "запис" in message_lower:
+    elif topics.has('fallback_topic', 'tricholax'):
+        if topics.has('fallback_topic', 'booking'):
             return "Трихолакс — это инъекционная процедура для укрепления и роста волос. Стоимость: 6000 руб.\n\nДля записи мне нужно ваше имя и телефон."
         else:
             return "Трихолакс — это инъекционная процедура для укрепления и роста волос. Стоимость: 6000 руб."
     
-    elif "запис" in message_lower:
+    elif topics.has('fallback_topic', 'booking'):
         return "Для записи мне нужно ваше имя и телефон. Укажите их, пожалуйста."
     
-    elif any(word in message_lower for word in ["цена", "стоимость", "сколько стоит"]):
+    elif topics.has('fallback_topic', 'price'):
         return "Стоимость зависит от выбранной процедуры. Могу подсказать цены на:\n• Лазерную эпиляцию\n• Чистку лица\n• Биоревитализацию\n• Ботулотоксин\n• Прокол ушей\n\nЧто именно вас интересует?"
     
-    elif any(word in message_lower for word in ["адрес", "где находитесь", "локация"]):
+    elif topics.has('fallback_topic', 'address'):
         return "📍 Наши адреса:\n• Сочи: ул. Воровского, 22\n• Адлер: ул. Кирова, д. 26а\n\n📞 Телефон: 8-928-458-32-88\n⏰ Ежедневно 10:00-20:00"
     
-    elif any(word in message_lower for word in ["эпиляция", "лазерная"]):
+    elif topics.has('fallback_topic', 'epilation'):
         return "Лазерная эпиляция удаляет волосы надолго. Цены зависят от зоны:\n• Подмышки: 1100-1400 руб\n• Бикини: 1900-3500 руб\n• Ноги полностью: 4500-5800 руб\n\nХотите записаться на консультацию?"
     
     else:
@@ -141,157 +162,250 @@ def is_contact_collection_request(bot_reply: str) -> bool:
     
     return False
 
-def cleanup_old_sessions():
-    """Очистка старых сессий."""
-    try:
-        now = datetime.now()
-        to_delete = []
-        
-        for session_id, session_data in list(user_sessions.items()):
-            session_age = now - session_data['created_at']
-            
-            if (session_age > timedelta(minutes=10) and 
-                not session_data.get('telegram_sent', False) and 
-                session_data.get('phone') and 
-                session_data.get('name')):
-                
-                print(f"⏰ ТАЙМАУТ 10 минут: отправляем неполную заявку")
-                
-                full_text = "\n".join(session_data.get('text_parts', []))
-                send_incomplete_to_telegram(
-                    full_text, 
-                    session_data.get('name'),
-                    session_data.get('phone'),
-                    session_data.get('procedure_type')
-                )
-                session_data['telegram_sent'] = True
-                session_data['incomplete_sent'] = True
-            
-            if session_age > timedelta(hours=2):
-                to_delete.append(session_id)
-        
-        for session_id in to_delete:
-            del user_sessions[session_id]
-    except Exception as e:
-        print(f"❌ Ошибка при очистке сессий: {e}")
+async def send_incomplete_lead(session_id: str):
+    """Срок неполной заявки (планировщик сессий): контакты есть, а заявка так и не ушла."""
+    session_data = user_sessions.get(session_id)
+    if (not session_data or session_data.get('telegram_sent', False) or
+            not (session_data.get('phone') and session_data.get('name'))):
+        return
+    # Сроки ставит планировщик каждого воркера: отправляет тот, кто первым захватил событие
+    if not user_sessions.claim(session_id, INCOMPLETE_LEAD):
+        return
+    
+    print(f"⏰ ТАЙМАУТ 10 минут: отправляем неполную заявку")
+    
+    full_text = render_transcript(session_data)
+    await asyncio.to_thread(
+        send_incomplete_to_telegram,
+        full_text, 
+        session_data.get('name'),
+        session_data.get('phone'),
+        session_data.get('procedure_type')
+    )
+    # Флаги ставим на свежей копии: обработчик сообщения мог сохранить сессию, пока шла отправка
+    user_sessions.update(session_id, mark_incomplete_sent)
+
+async def expire_session(session_id: str):
+    """Срок жизни сессии истек (планировщик сессий)."""
+    user_sessions.delete(session_id)
+
+session_scheduler.register('web', user_sessions, send_incomplete_lead, expire_session)
 
-def extract_contacts_from_message(message: str, session: Dict[str, Any]):
+async def extract_contacts_from_message(message: str, session: Dict[str, Any]):
     """Извлекает контакты из сообщения и обновляет сессию."""
-    message_lower = message.lower()
+    message = normalize_message(message)
     
     # ===== ПОИСК ТЕЛЕФОНА =====
-    phone_patterns = [
-        r'\b8[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}\b',
-        r'\b\+7[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}\b',
-        r'\b7[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}\b',
-    ]
+    phone, phone_position = message.phone
     
-    phone_matches = []
-    for pattern in phone_patterns:
-        matches = re.findall(pattern, message)
-        if matches:
-            phone_matches.extend(matches)
-            break
-    
-    if phone_matches and not session['phone']:
-        raw_phone = phone_matches[0]
-        clean_phone = re.sub(r'\D', '', raw_phone)
-        
-        if len(clean_phone) == 10:
-            clean_phone = '7' + clean_phone
-        elif len(clean_phone) == 11 and clean_phone.startswith('8'):
-            clean_phone = '7' + clean_phone[1:]
-        
-        if 10 <= len(clean_phone) <= 11:
-            session['phone'] = clean_phone
-            print(f"📞 Найден телефон: {raw_phone} → {session['phone']}")
+    if phone and not session['phone']:
+        session['phone'] = phone
+        print(f"📞 Найден телефон: {session['phone']}")
     
     # ===== ПОИСК ИМЕНИ =====
     temp_name = None
     
     russian_names = re.findall(r'\b[А-ЯЁ][а-яё]{1,20}\b', message)
     
-    common_russian_names = [
-        'анна', 'мария', 'елена', 'ольга', 'наталья', 'ирина', 'светлана',
-        'александра', 'татьяна', 'юлия', 'евгения', 'дарья', 'екатерина',
-        'виктория', 'иван', 'алексей', 'сергей', 'андрей', 'дмитрий', 'михаил',
-        'владимир', 'павел', 'максим', 'николай', 'евгений', 'артем', 'антон',
-        'вадим', 'рома', 'кирилл', 'игорь', 'вадим'
-    ]
-    
     for name in russian_names:
         name_lower = name.lower()
         
-        procedure_words = ['ботокс', 'эпиляция', 'лазер', 'коллаген', 
-                         'чистка', 'пилинг', 'смас', 'морфиус', 'александрит',
-                         'перманент', 'биоревитализация', 'инъекция', 'мезотерапия']
-        
-        is_procedure = any(proc in name_lower for proc in procedure_words)
-        is_common_name = name_lower in common_russian_names
-        is_near_phone = phone_matches and (abs(message.find(name) - message.find(phone_matches[0])) < 30)
+        is_procedure = any(proc in name_lower for proc in PROCEDURE_WORDS)
+        is_common_name = is_known_name(name_lower)
+        is_near_phone = phone is not None and abs(message.find(name) - phone_position) < 30
         
         if (is_common_name and not is_procedure) or (is_near_phone and not is_procedure):
             temp_name = name
             print(f"👤 Найдено возможное имя в сообщении: {temp_name}")
             break
     
-    if temp_name and temp_name.lower() not in ['привет', 'здравствуйте', 'добрый', 'пока', 'спасибо']:
+    if temp_name and temp_name.lower() not in NOT_NAME_WORDS:
         session['name'] = temp_name
         print(f"✅ Обновлено имя в сессии: {session['name']}")
     
-    if (not session['name'] or session['name'].lower() in ['привет', 'здравствуйте', 'добрый']) and REPLICATE_API_TOKEN and len(message.strip()) > 3:
+    needs_name = not session['name'] or session['name'].lower() in ['привет', 'здравствуйте', 'добрый']
+    
+    # Сначала словарь имен: AI нужен, только если имя неоднозначно
+    use_ai_for_name = False
+    if needs_name and len(message.strip()) > 3:
+        local_name, name_confidence = message.name
+        if name_confidence >= LOCAL_CLASSIFIER_THRESHOLD:
+            if local_name:
+                session['name'] = local_name
+                print(f"🧠 Имя найдено по словарю: {local_name} ({name_confidence:.2f})")
+        else:
+            use_ai_for_name = True
+    
+    if use_ai_for_name and is_llm_configured(REPLICATE_API_TOKEN):
         try:
             print(f"🔍 Использую AI для поиска имени в: '{message[:30]}...'")
-            found_name = extract_name_with_ai(REPLICATE_API_TOKEN, message)
+            found_name = await asyncio.wait_for(
+                extract_name_with_ai_async(REPLICATE_API_TOKEN, message),
+                timeout=LLM_EXTRACT_TIMEOUT
+            )
             
             if found_name and found_name.lower() not in ['привет', 'здравствуйте', 'добрый']:
                 session['name'] = found_name
                 print(f"✅ AI определил/исправил имя: {session['name']}")
+        except asyncio.TimeoutError:
+            print(f"⚠️ Таймаут AI при извлечении имени ({LLM_EXTRACT_TIMEOUT:.0f} сек)")
         except Exception as e:
             print(f"⚠️ Ошибка AI при извлечении имени: {e}")
     
     # ===== ОПРЕДЕЛЕНИЕ ПРОЦЕДУРЫ =====
-    procedure_keywords = {
-        'лазерная эпиляция': ['эпиляция', 'лазер', 'удаление волос', 'бикини', 'подмышки', 'ноги', 'александрит', 'инновейшен', 'innovation', 'quanta'],
-        'чистка лица': ['чистка', 'пилинг', 'акне', 'поры', 'ультразвуковая', 'механическая', 'гидропилинг'],
-        'ботулотоксин': ['ботокс', 'ботулин', 'морщины', 'диспорт', 'гипергидроз'],
-        'лифтинг': ['лифтинг', 'подтяжка', 'смас', 'ультера', 'морфиус'],
-        'биоревитализация': ['биоревитализация', 'гиалуроновая', 'профхайло', 'hyaron'],
-        'капельницы': ['капельниц', 'инфузи', 'витамин', 'детокс', 'иммуносуппорт'],
-        'фотоомоложение': ['пигмент', 'пятн', 'веснушк', 'фотоомоложение', 'люмекка', 'lumecca'],
-        'мезотерапия': ['мезотерапия', 'инъекци', 'укол'],
-        'перманентный макияж': ['перманент', 'макияж', 'татуаж', 'брови', 'губы'],
-        'удаление тату': ['тату', 'татуировк', 'удаление тату'],
-        'прокол ушей': ['прокол', 'ухо', 'уши', 'пирсинг']
-    }
-    
-    for procedure_type, keywords in procedure_keywords.items():
-        if any(keyword in message_lower for keyword in keywords):
+    procedure_type = message.keywords.first('procedure')
+    if procedure_type:
+        session['last_procedure'] = procedure_type
+        print(f"📋 Определена процедура: {procedure_type}")
+    else:
+        # Ключевые слова не нашлись — пробуем классификатор (падежи, опечатки)
+        procedure_type, confidence = detect_procedure_locally(message)
+        if procedure_type and confidence >= LOCAL_CLASSIFIER_THRESHOLD:
             session['last_procedure'] = procedure_type
-            print(f"📋 Определена процедура: {procedure_type}")
-            break
+            print(f"🧠 Локальный классификатор определил процедуру: {procedure_type} ({confidence:.2f})")
+
+def update_conversation_state(session: Dict[str, Any], message: str):
+    """Обновляет флаги диалога по новому сообщению (историю заново не просматриваем)."""
+    matches = normalize_message(message).keywords
+    
+    if not session['procedure_mentioned'] and matches.has('mentioned_procedure'):
+        session['procedure_mentioned'] = True
+        print(f"🔍 В диалоге упоминались процедуры")
+    
+    # Последнее сообщение с процедурой перекрывает более ранние
+    procedure = matches.first('procedure')
+    if procedure:
+        session['history_procedure'] = procedure
 
 def get_last_procedure_from_history(session: Dict[str, Any]) -> str:
     """Определяет последнюю процедуру из истории диалога."""
-    if session.get('last_procedure'):
-        return session['last_procedure']
-    
-    procedure_keywords = {
-        'лазерная эпиляция': ['эпиляция', 'лазер', 'бикини', 'подмышки'],
-        'чистка лица': ['чистка', 'пилинг', 'акне'],
-        'ботулотоксин': ['ботокс', 'ботулин', 'морщины'],
-        'биоревитализация': ['биоревитализация', 'гиалуроновая'],
-        'капельницы': ['капельниц', 'детокс', 'витамин'],
-        'прокол ушей': ['прокол', 'ухо', 'уши']
-    }
-    
-    for msg in reversed(session.get('text_parts', [])):
-        msg_lower = msg.lower()
-        for procedure_type, keywords in procedure_keywords.items():
-            if any(keyword in msg_lower for keyword in keywords):
-                return procedure_type
+    return session.get('last_procedure') or session.get('history_procedure')
+
+def resolve_session_id(raw_session_id: Any) -> str:
+    """
+    Возвращает токен сессии: присланный клиентом, если сервер его выдавал и сессия жива,
+    иначе новый. Придуманные клиентом токены не принимаются.
+    """
+    if (isinstance(raw_session_id, str) and SESSION_TOKEN_PATTERN.match(raw_session_id)
+            and raw_session_id in user_sessions):
+        return raw_session_id
+    return secrets.token_urlsafe(SESSION_TOKEN_BYTES)
+
+async def prepare_chat_turn(user_message: str, session_id: str, user_ip: str):
+    """
+    Обновляет сессию входящим сообщением, извлекает контакты и при необходимости
+    отправляет заявку в Telegram. Общая часть для /chat и /chat/stream.
+    Возвращает (session, revision, last_procedure, telegram_was_sent_now, history), где
+    revision — сессия на момент сохранения (для следующего save_turn), а history —
+    история диалога для промпта до текущего сообщения.
+    """
+    user_message = normalize_message(user_message)
+    session = user_sessions.get(session_id)
+    if session is None:
+        print(f"🆕 Новая сессия {session_id[:8]}… (IP: {user_ip})")
+        session = new_web_session(user_ip)
+    revision = session_revision(session)
+    
+    # В сессию — обычная строка, без результатов разбора
+    history = session['memory'].render()
+    session['memory'].add_client(str(user_message))
+    append_message(session, str(user_message))
+    session['message_count'] += 1
+    update_conversation_state(session, user_message)
+    
+    await extract_contacts_from_message(user_message, session)
+    
+    last_procedure = get_last_procedure_from_history(session)
+    
+    # ===== ОТПРАВКА В TELEGRAM =====
+    telegram_was_sent_now = False
+    
+    if session['name'] and session['phone'] and not session.get('telegram_sent', False):
+        print(f"🚨 ПРОВЕРКА ОТПРАВКИ В TELEGRAM:")
+        print(f"   👤 Имя: {session['name']}")
+        print(f"   📞 Телефон: {session['phone']}")
+        
+        explicit_intent = user_message.keywords.has('booking_intent')
+        
+        should_send = explicit_intent or session['procedure_mentioned']
+        
+        if should_send and user_sessions.lead_sent(session_id):
+            # Пока шел ход, заявку отправил другой воркер (или неполную — планировщик)
+            print(f"ℹ️  Заявка по сессии уже отправлена")
+            session['telegram_sent'] = True
+        elif should_send:
+            print(f"🚨 ОТПРАВЛЯЕМ ЗАЯВКУ В TELEGRAM!")
+            full_conversation = render_transcript(session)
+            
+            if last_procedure:
+                session['procedure_type'] = last_procedure
+            
+            try:
+                success = send_complete_application_to_telegram(session, full_conversation)
+                
+                if success:
+                    session['telegram_sent'] = True
+                    session['stage'] = 'completed'
+                    session['contacts_provided'] = True
+                    telegram_was_sent_now = True
+                    print(f"✅ Заявка отправлена в Telegram")
+                else:
+                    print(f"⚠️ Ошибка отправки в Telegram")
+            except Exception as e:
+                print(f"❌ Исключение при отправке в Telegram: {e}")
+        else:
+            print(f"ℹ️  Контакты есть, но нет явного намерения записаться")
+            session['contacts_provided'] = True
     
-    return None
+    session = user_sessions.save_turn(session_id, session, revision)
+    session_scheduler.track('web', session_id, session)
+    return session, session_revision(session), last_procedure, telegram_was_sent_now, history
+
+def get_application_sent_reply(session: Dict[str, Any]) -> str:
+    """Подтверждение клиенту, что заявка только что передана менеджеру."""
+    if session.get('name'):
+        return f"✅ Спасибо, {session['name']}! Ваша заявка передана менеджеру. С вами свяжутся для подтверждения записи.\n\n📞 Телефон клиники: 8-928-458-32-88"
+    return "✅ Спасибо! Ваша заявка передана менеджеру. С вами свяжутся для подтверждения записи.\n\n📞 Телефон клиники: 8-928-458-32-88"
+
+def log_session_state(session: Dict[str, Any], bot_reply: str):
+    """Печатает состояние сессии и ответ бота."""
+    print(f"📊 СОСТОЯНИЕ СЕССИИ:")
+    print(f"   👤 Имя: {'✅ ' + session['name'] if session['name'] else '❌ Нет'}")
+    print(f"   📞 Телефон: {'✅ ' + str(session['phone']) if session['phone'] else '❌ Нет'}")
+    print(f"   📨 Отправлено в Telegram: {'✅' if session.get('telegram_sent') else '❌'}")
+    print(f"   💉 Процедуры: {session.get('last_procedure', '❌ Не определены')}")
+    
+    print(f"🤖 Ответ бота: '{bot_reply[:100]}...'" if len(bot_reply) > 100 else f"🤖 Ответ бота: '{bot_reply}'")
+    print("="*40)
+
+async def generate_ai_reply(user_message: str, session: Dict[str, Any],
+                            last_procedure: str, is_first_in_session: bool, history: str = None) -> str:
+    """
+    Генерирует ответ AI в пределах LLM_REPLY_TIMEOUT.
+    По таймауту запрос к модели отменяется, а клиент получает fallback-ответ.
+    """
+    try:
+        bot_reply = await asyncio.wait_for(
+            generate_bot_reply_async(
+                REPLICATE_API_TOKEN,
+                user_message,
+                is_first_in_session,
+                bool(session['name']),
+                bool(session['phone']),
+                session.get('telegram_sent', False),
+                last_procedure,
+                history
+            ),
+            timeout=LLM_REPLY_TIMEOUT
+        )
+        print(f"✅ AI ответ сгенерирован за <{LLM_REPLY_TIMEOUT:.0f} сек")
+        return bot_reply
+    except asyncio.TimeoutError:
+        print(f"⚠️ Таймаут AI ({LLM_REPLY_TIMEOUT:.0f} сек), используем fallback")
+        return get_fallback_response(user_message)
+    except Exception as e:
+        print(f"❌ Ошибка при вызове AI: {str(e)}")
+        return get_fallback_response(user_message)
 
 @app.post("/chat")
 async def chat_endpoint(request: Request):
@@ -302,85 +416,15 @@ async def chat_endpoint(request: Request):
     
     try:
         data = await request.json()
-        user_message = data.get("message", "")
+        # Сообщение нормализуется один раз и дальше передается всем обработчикам
+        user_message = normalize_message(data.get("message", ""))
         user_ip = request.client.host
+        session_id = resolve_session_id(data.get("session_id"))
         
-        print(f"👤 IP: {user_ip}")
+        print(f"👤 IP: {user_ip}, сессия: {session_id[:8]}…")
         print(f"💬 Сообщение: '{user_message[:50]}...'" if len(user_message) > 50 else f"💬 Сообщение: '{user_message}'")
         
-        cleanup_old_sessions()
-        
-        if user_ip not in user_sessions:
-            user_sessions[user_ip] = {
-                'created_at': datetime.now(),
-                'name': None,
-                'phone': None,
-                'stage': 'consultation',
-                'text_parts': [],
-                'telegram_sent': False,
-                'incomplete_sent': False,
-                'message_count': 0,
-                'contacts_provided': False,
-                'procedure_mentioned': False,
-                'last_procedure': None
-            }
-        
-        session = user_sessions[user_ip]
-        session['text_parts'].append(user_message)
-        session['message_count'] += 1
-        
-        full_conversation = "\n".join(session['text_parts']).lower()
-        procedure_keywords = ['эпиляция', 'лазер', 'ботокс', 'чистка', 'пилинг', 'бикини', 
-                             'коллаген', 'биоревитализация', 'инъекция', 'укол', 'смас', 'морфиус', 
-                             'прокол', 'ухо', 'уши']
-        
-        if any(keyword in full_conversation for keyword in procedure_keywords):
-            session['procedure_mentioned'] = True
-            print(f"🔍 В диалоге упоминались процедуры")
-        
-        extract_contacts_from_message(user_message, session)
-        
-        last_procedure = get_last_procedure_from_history(session)
-        
-        # ===== ОТПРАВКА В TELEGRAM =====
-        telegram_was_sent_now = False
-        
-        if session['name'] and session['phone'] and not session.get('telegram_sent', False):
-            print(f"🚨 ПРОВЕРКА ОТПРАВКИ В TELEGRAM:")
-            print(f"   👤 Имя: {session['name']}")
-            print(f"   📞 Телефон: {session['phone']}")
-            
-            message_lower = user_message.lower()
-            explicit_intent = any(word in message_lower for word in [
-                'запис', 'хочу', 'нужно', 'можно', 'готов', 'давайте', 
-                'интересует', 'завтра', 'сегодня', 'после'
-            ])
-            
-            should_send = explicit_intent or session['procedure_mentioned']
-            
-            if should_send:
-                print(f"🚨 ОТПРАВЛЯЕМ ЗАЯВКУ В TELEGRAM!")
-                full_conversation = "\n".join(session['text_parts'])
-                
-                if last_procedure:
-                    session['procedure_type'] = last_procedure
-                
-                try:
-                    success = send_complete_application_to_telegram(session, full_conversation)
-                    
-                    if success:
-                        session['telegram_sent'] = True
-                        session['stage'] = 'completed'
-                        session['contacts_provided'] = True
-                        telegram_was_sent_now = True
-                        print(f"✅ Заявка отправлена в Telegram")
-                    else:
-                        print(f"⚠️ Ошибка отправки в Telegram")
-                except Exception as e:
-                    print(f"❌ Исключение при отправке в Telegram: {e}")
-            else:
-                print(f"ℹ️  Контакты есть, но нет явного намерения записаться")
-                session['contacts_provided'] = True
+        session, revision, last_procedure, telegram_was_sent_now, history = await prepare_chat_turn(user_message, session_id, user_ip)
         
         # ===== ГЕНЕРАЦИЯ ОТВЕТА БОТА =====
         bot_reply = ""
@@ -388,93 +432,37 @@ async def chat_endpoint(request: Request):
         
         # Если заявка ТОЛЬКО ЧТО отправлена - показываем подтверждение
         if telegram_was_sent_now:
-            if session.get('name'):
-                bot_reply = f"✅ Спасибо, {session['name']}! Ваша заявка передана менеджеру. С вами свяжутся для подтверждения записи.\n\n📞 Телефон клиники: 8-928-458-32-88"
-            else:
-                bot_reply = "✅ Спасибо! Ваша заявка передана менеджеру. С вами свяжутся для подтверждения записи.\n\n📞 Телефон клиники: 8-928-458-32-88"
+            bot_reply = get_application_sent_reply(session)
         
         # Если заявка уже была отправлена, НО клиент продолжает диалог - используем AI
         elif session.get('telegram_sent', False):
             print("🤖 Заявка уже отправлена, но продолжаем диалог...")
             
-            if REPLICATE_API_TOKEN and len(REPLICATE_API_TOKEN) > 20:
-                try:
-                    ai_task = asyncio.create_task(
-                        asyncio.to_thread(
-                            generate_bot_reply,
-                            REPLICATE_API_TOKEN,
-                            user_message,
-                            is_first_in_session,
-                            bool(session['name']),
-                            bool(session['phone']),
-                            True,  # telegram_sent = True (для контекста)
-                            last_procedure
-                        )
-                    )
-                    
-                    try:
-                        bot_reply = await asyncio.wait_for(ai_task, timeout=8.0)
-                        print(f"✅ AI ответ сгенерирован за <8 сек")
-                    except asyncio.TimeoutError:
-                        print(f"⚠️ Таймаут AI (8 сек), используем fallback")
-                        ai_task.cancel()
-                        bot_reply = get_fallback_response(user_message)
-                        
-                except Exception as e:
-                    print(f"❌ Ошибка при вызове AI: {str(e)}")
-                    bot_reply = get_fallback_response(user_message)
+            if is_llm_configured(REPLICATE_API_TOKEN):
+                bot_reply = await generate_ai_reply(user_message, session, last_procedure, is_first_in_session, history)
             else:
                 bot_reply = get_fallback_response(user_message)
         
         # Обычный режим (заявка еще не отправлена)
-        elif REPLICATE_API_TOKEN and len(REPLICATE_API_TOKEN) > 20:
+        elif is_llm_configured(REPLICATE_API_TOKEN):
             print("🤖 Использую AI для генерации ответа...")
             
-            try:
-                ai_task = asyncio.create_task(
-                    asyncio.to_thread(
-                        generate_bot_reply,
-                        REPLICATE_API_TOKEN,
-                        user_message,
-                        is_first_in_session,
-                        bool(session['name']),
-                        bool(session['phone']),
-                        False,  # telegram_sent = False
-                        last_procedure
-                    )
-                )
-                
-                try:
-                    bot_reply = await asyncio.wait_for(ai_task, timeout=8.0)
-                    print(f"✅ AI ответ сгенерирован за <8 сек")
-                except asyncio.TimeoutError:
-                    print(f"⚠️ Таймаут AI (8 сек), используем fallback")
-                    ai_task.cancel()
-                    bot_reply = get_fallback_response(user_message)
-                
-                if is_contact_collection_request(bot_reply):
-                    session['stage'] = 'contact_collection'
-                    print("📝 AI запросил контакты")
-                    
-            except Exception as e:
-                print(f"❌ Ошибка при вызове AI: {str(e)}")
-                bot_reply = get_fallback_response(user_message)
+            bot_reply = await generate_ai_reply(user_message, session, last_procedure, is_first_in_session, history)
+            
+            if is_contact_collection_request(bot_reply):
+                session['stage'] = 'contact_collection'
+                print("📝 AI запросил контакты")
         
         # Fallback если AI недоступен
         else:
             print("⚠️ AI недоступен, использую простую логику")
             bot_reply = get_fallback_response(user_message)
         
-        print(f"📊 СОСТОЯНИЕ СЕССИИ:")
-        print(f"   👤 Имя: {'✅ ' + session['name'] if session['name'] else '❌ Нет'}")
-        print(f"   📞 Телефон: {'✅ ' + str(session['phone']) if session['phone'] else '❌ Нет'}")
-        print(f"   📨 Отправлено в Telegram: {'✅' if session.get('telegram_sent') else '❌'}")
-        print(f"   💉 Процедуры: {session.get('last_procedure', '❌ Не определены')}")
-        
-        print(f"🤖 Ответ бота: '{bot_reply[:100]}...'" if len(bot_reply) > 100 else f"🤖 Ответ бота: '{bot_reply}'")
-        print("="*40)
+        session['memory'].add_bot(bot_reply)
+        session = user_sessions.save_turn(session_id, session, revision)
+        log_session_state(session, bot_reply)
         
-        return {"reply": bot_reply}
+        return {"reply": bot_reply, "session_id": session_id}
         
     except Exception as e:
         print(f"❌ КРИТИЧЕСКАЯ ОШИБКА В /chat: {e}")
@@ -483,6 +471,108 @@ async def chat_endpoint(request: Request):
         
         return {"reply": "Извините, произошла техническая ошибка. Пожалуйста, позвоните нам по телефону 8-928-458-32-88 для консультации."}
 
+def format_sse_event(event: str, payload: Dict[str, Any]) -> str:
+    """Форматирует событие server-sent events."""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: Request):
+    """
+    Потоковый вариант /chat (server-sent events).
+    События: token — очередной фрагмент ответа, done — итоговый ответ.
+    """
+    print(f"\n{'='*60}")
+    print(f"🔍 /chat/stream endpoint вызван")
+    print(f"{'='*60}")
+    
+    error_reply = "Извините, произошла техническая ошибка. Пожалуйста, позвоните нам по телефону 8-928-458-32-88 для консультации."
+    
+    try:
+        data = await request.json()
+        # Сообщение нормализуется один раз и дальше передается всем обработчикам
+        user_message = normalize_message(data.get("message", ""))
+        user_ip = request.client.host
+        session_id = resolve_session_id(data.get("session_id"))
+        
+        print(f"👤 IP: {user_ip}, сессия: {session_id[:8]}…")
+        print(f"💬 Сообщение: '{user_message[:50]}...'" if len(user_message) > 50 else f"💬 Сообщение: '{user_message}'")
+        
+        session, revision, last_procedure, telegram_was_sent_now, history = await prepare_chat_turn(user_message, session_id, user_ip)
+    except Exception as e:
+        print(f"❌ КРИТИЧЕСКАЯ ОШИБКА В /chat/stream: {e}")
+        import traceback
+        traceback.print_exc()
+        
+        return StreamingResponse(
+            iter([format_sse_event("done", {"reply": error_reply})]),
+            media_type="text/event-stream"
+        )
+    
+    is_first_in_session = (session['message_count'] == 1)
+    telegram_sent = session.get('telegram_sent', False)
+    
+    def finish_turn(bot_reply: str):
+        nonlocal session
+        if bot_reply:
+            session['memory'].add_bot(bot_reply)
+        session = user_sessions.save_turn(session_id, session, revision)
+        log_session_state(session, bot_reply)
+    
+    async def event_stream():
+        # Асинхронный генератор: поток не занимает воркер пула, а при обрыве
+        # соединения Starlette отменяет его, и генерация у провайдера прерывается
+        bot_reply = None
+        streamed = []
+        try:
+            if telegram_was_sent_now:
+                bot_reply = get_application_sent_reply(session)
+            elif not is_llm_configured(REPLICATE_API_TOKEN):
+                print("⚠️ AI недоступен, использую простую логику")
+                bot_reply = get_fallback_response(user_message)
+            else:
+                replies = stream_bot_reply(
+                    REPLICATE_API_TOKEN,
+                    user_message,
+                    is_first_in_session,
+                    bool(session['name']),
+                    bool(session['phone']),
+                    telegram_sent,
+                    last_procedure,
+                    history,
+                    token_timeout=LLM_REPLY_TIMEOUT
+                )
+                try:
+                    async for event, text in replies:
+                        if event == 'token':
+                            streamed.append(text)
+                            yield format_sse_event("token", {"text": text})
+                        else:
+                            final_reply = text
+                except Exception as e:
+                    print(f"❌ Ошибка при потоковой генерации: {str(e)}")
+                    final_reply = get_fallback_response(user_message)
+                finally:
+                    await replies.aclose()
+                
+                if not telegram_sent and is_contact_collection_request(final_reply):
+                    session['stage'] = 'contact_collection'
+                    print("📝 AI запросил контакты")
+                bot_reply = final_reply
+            
+            finish_turn(bot_reply)
+            yield format_sse_event("done", {"reply": bot_reply, "session_id": session_id})
+        finally:
+            if bot_reply is None:
+                # Поток оборвался до итогового ответа: сохраняем то, что клиент успел получить
+                print(f"🔌 Поток прерван, сохраняем ход сессии {session_id[:8]}…")
+                finish_turn("".join(streamed))
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.api_route("/health", methods=["GET", "HEAD"])
 async def health_check(request: Request):
     """Проверка здоровья сервиса."""
@@ -494,9 +584,44 @@ async def health_check(request: Request):
         "service": "gladis-chatbot-api",
         "timestamp": datetime.now().isoformat(),
         "sessions_count": len(user_sessions),
+        "session_store": user_sessions.backend,
+        "session_scheduler": session_scheduler.stats(),
+        "system_prompt": get_system_prompt_info(),
+        "reply_cache": reply_cache.stats(),
+        "llm_circuit_breaker": llm_breaker.stats(),
         "version": "2.2.0"
     }
 
+@app.get("/metrics/llm")
+async def llm_metrics_endpoint(limit: int = 50, site: str = None):
+    """Метрики вызовов LLM: перцентили по местам вызова и последние вызовы."""
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "summary": llm_metrics.summary(),
+        "recent": llm_metrics.recent(limit, site),
+        "system_prompt": get_system_prompt_info(),
+        "hedging": get_hedge_config(),
+        "single_flight": get_single_flight_stats(),
+        "circuit_breaker": llm_breaker.stats(),
+        "backend": get_backend().describe()
+    }
+
+@app.get("/metrics/sessions")
+async def session_metrics_endpoint(sample: int = 200):
+    """Сколько памяти занимают сессии (по выборке) и состояние хранилищ и сроков."""
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "web": {
+            "store": user_sessions.stats(),
+            "memory": measure_sessions(user_sessions.sample(sample), len(user_sessions))
+        },
+        "telegram": {
+            "store": telegram_sessions.stats(),
+            "memory": measure_sessions(telegram_sessions.sample(sample), len(telegram_sessions))
+        },
+        "scheduler": session_scheduler.stats()
+    }
+
 @app.get("/")
 async def root():
     """Корневой endpoint."""
@@ -547,9 +672,12 @@ async def startup_event():
     print("🏥 GLADIS Chatbot API запущен")
     print("="*60)
     
-    print(f"🤖 AI сервис: {'✅ Replicate' if REPLICATE_API_TOKEN else '❌ Не настроен'}")
+    print(f"🤖 AI сервис: {'✅ ' + LLM_BACKEND if is_llm_configured(REPLICATE_API_TOKEN) else '❌ Не настроен'}")
     print(f"📱 Telegram (отправка в группу): {'✅ Настроен' if TELEGRAM_BOT_TOKEN else '⚠️ Только логи'}")
     
+    # Сроки сессий: неполные заявки и удаление старых сессий (веб и Telegram)
+    session_scheduler.start()
+    
     # Запускаем Telegram polling для ответов на сообщения ← НОВОЕ
     if TELEGRAM_BOT_TOKEN:  # ← НОВОЕ
         print("📱 Запуск обработки входящих Telegram сообщений...")  # ← НОВОЕ
@@ -569,6 +697,8 @@ async def shutdown_event():
     """Завершение работы."""
     print("\n🛑 Завершение работы приложения...")
     # Просто логируем, не вызываем sys.exit()
+    # Снимок сессий на диск, чтобы после перезапуска диалоги продолжились
+    close_session_stores()
 
 if __name__ == "__main__":
     import uvicorn
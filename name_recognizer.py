@@ -0,0 +1,204 @@
+"""
+Распознавание имени клиента по словарю имен (без AI).
+
+Словарь data/first_names.txt — русские и распространенные нерусские имена
+с уменьшительными формами (Александра: Саша, Шура...). При импорте из него
+один раз строится frozenset всех форм, включая падежные («Анну», «Сергея»,
+«с Ильей»), и словарь форма → имя в именительном падеже.
+
+recognize_name(message) возвращает (имя или None, уверенность 0..1):
+- имя из словаря — высокая уверенность, выше после «меня зовут», «я», «это»
+- имя, совпадающее с обычным словом (Вера, Роман, Слава, «на тему», «жене»), —
+  только в позиции имени (после «зовут» или с заглавной буквы в середине фразы)
+- имя со строчной буквы посреди фразы и имя после «к», «у», «с» («к Ирине
+  Петровне» — скорее мастер, чем клиент) — низкая уверенность, решает AI
+- незнакомое слово там, где обычно стоит имя, — низкая уверенность, и тогда
+  решает AI; в остальных случаях «имени нет» с высокой уверенностью
+"""
+
+import os
+import re
+
+from keywords import PROCEDURE_WORDS, NOT_NAME_WORDS
+
+NAMES_FILE = os.path.join(os.path.dirname(__file__), 'data', 'first_names.txt')
+
+# Слова, после которых обычно идет имя (после первых трех — почти наверняка)
+NAME_INTRO_WORDS = frozenset({'зовут', 'имя', 'звать', 'я', 'это'})
+STRONG_INTRO_WORDS = frozenset({'зовут', 'имя', 'звать'})
+# После этих предлогов обычно имя сотрудника или родственника, а не клиента
+OTHER_PERSON_PREPOSITIONS = frozenset({'к', 'у', 'с'})
+
+# Имена, которые совпадают с обычными словами (и их формы)
+COMMON_WORD_NAMES = frozenset({
+    'вера', 'веры', 'вере', 'веру', 'верой', 'надежда', 'надежды', 'надежде', 'надежду',
+    'любовь', 'любви', 'слава', 'славы', 'славе', 'славу', 'славой', 'роза', 'розы', 'розе', 'розу',
+    'лилия', 'лилии', 'мила', 'роман', 'романа', 'роману', 'романом', 'романе', 'лев', 'льва',
+    'мира', 'марина', 'марины', 'дана', 'ада', 'тома', 'поля', 'поле', 'полю', 'сани', 'вали',
+    'коли', 'паша', 'марка', 'марку', 'ника', 'лада', 'злата', 'ян', 'аза', 'лиса', 'ася',
+    'ната', 'лана', 'капа', 'свят', 'клим', 'марта', 'майя', 'мая', 'нора', 'тоша', 'сева',
+    'геля', 'ага', 'гата', 'дара', 'кира', 'тина', 'яра', 'лия', 'вета', 'виола',
+    'колю', 'колей', 'полей', 'мае', 'маю', 'маи', 'але', 'томе', 'лисе', 'лису',
+    'тема', 'темы', 'теме', 'тему', 'темой', 'жена', 'жены', 'жене', 'жену', 'женой',
+    'жени', 'женю', 'женей', 'мире', 'миру', 'миром',
+})
+
+# Мужские имена с беглой гласной: основа косвенных падежей
+FLEETING_STEMS = {'павел': 'павл', 'лев': 'льв', 'пётр': 'петр', 'петр': 'петр'}
+
+# Женские имена на мягкий знак (склоняются как «любовь»)
+FEMININE_SOFT_NAMES = frozenset({'любовь', 'адель', 'нинель'})
+
+# Уверенность для разных случаев
+NOMINATIVE_SCORE = 0.9
+CASE_FORM_SCORE = 0.85
+AMBIGUOUS_SCORE = 0.4
+INTRO_BONUS = 0.08
+UNKNOWN_IN_NAME_POSITION = 0.5
+NO_NAME = 0.95
+
+_WORD_RE = re.compile(r'[A-Za-zА-Яа-яЁё]+')
+_HUSHING = 'гкхжшщч'
+
+def _normalize(word: str) -> str:
+    return word.lower().replace('ё', 'е')
+
+def case_forms(name: str) -> list:
+    """Падежные формы имени (без именительного)."""
+    name = _normalize(name)
+    if name in FEMININE_SOFT_NAMES:
+        stem = name[:-1]
+        # любовь → любви: беглая гласная
+        if name == 'любовь':
+            return ['любви', 'любовью']
+        return [stem + 'и', stem + 'ью']
+    if name.endswith('ия'):
+        stem = name[:-1]
+        return [stem + 'и', stem + 'ю', stem + 'ей', stem + 'ею']
+    if name.endswith('я'):
+        stem = name[:-1]
+        return [stem + 'и', stem + 'е', stem + 'ю', stem + 'ей', stem + 'ею']
+    if name.endswith('а'):
+        stem = name[:-1]
+        genitive = 'и' if stem[-1] in _HUSHING else 'ы'
+        soft = stem[-1] in 'жшщчц'
+        return [stem + genitive, stem + 'е', stem + 'у', stem + ('ей' if soft else 'ой'), stem + ('ею' if soft else 'ою')]
+    if name.endswith('ий'):
+        stem = name[:-1]
+        return [stem + 'я', stem + 'ю', stem + 'ем', stem + 'и']
+    if name.endswith('й'):
+        stem = name[:-1]
+        return [stem + 'я', stem + 'ю', stem + 'ем', stem + 'е']
+    if name.endswith('ь'):
+        stem = name[:-1]
+        return [stem + 'я', stem + 'ю', stem + 'ем', stem + 'е']
+    if name[-1] in 'бвгджзклмнпрстфхцчшщ':
+        stem = FLEETING_STEMS.get(name, name)
+        instrumental = 'ем' if name[-1] in 'жшщчц' else 'ом'
+        return [stem + 'а', stem + 'у', stem + instrumental, stem + 'е']
+    # Несклоняемые (Нелли, Софи, Мишель на гласную)
+    return []
+
+def load_names(path: str = NAMES_FILE) -> dict:
+    """Читает словарь имен: {имя в нижнем регистре без ё: (имя как в словаре, полное имя)}."""
+    names = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                full, _, short = line.partition(':')
+                full = full.strip()
+                for variant in [full] + [part.strip() for part in short.split(',')]:
+                    if variant:
+                        names.setdefault(_normalize(variant), (variant, full))
+    except FileNotFoundError:
+        print(f"⚠️ Словарь имен {path} не найден, имена определяет только AI")
+    return names
+
+class NameRecognizer:
+    """Словарь всех форм имен: форма → (имя в именительном падеже, полное имя)."""
+
+    def __init__(self, names: dict):
+        # Именительный падеж важнее совпавшей падежной формы («Александра»)
+        self.forms = dict(names)
+        for nominative, entry in names.items():
+            for form in case_forms(nominative):
+                self.forms.setdefault(form, entry)
+        self.known = frozenset(self.forms)
+        self.excluded = frozenset(_normalize(word) for word in list(PROCEDURE_WORDS) + list(NOT_NAME_WORDS))
+        self.names = len(names)
+
+    def is_name(self, word: str) -> bool:
+        """Есть ли слово (в любом падеже) в словаре имен."""
+        word = _normalize(word)
+        return word in self.known and word not in self.excluded and word not in COMMON_WORD_NAMES
+
+    def lookup(self, word: str):
+        """(имя в именительном падеже, полное имя) или None."""
+        word = _normalize(word)
+        if word in self.excluded:
+            return None
+        return self.forms.get(word)
+
+    def recognize(self, message: str) -> tuple:
+        """Ищет имя клиента в сообщении. Возвращает (имя или None, уверенность)."""
+        matches = list(_WORD_RE.finditer(message))
+        best_name, best_score = None, 0.0
+        doubtful = False
+
+        for position, match in enumerate(matches):
+            token = match.group()
+            word = _normalize(token)
+            if len(word) < 2:
+                continue
+
+            previous = _normalize(matches[position - 1].group()) if position > 0 else ''
+            after_intro = previous in NAME_INTRO_WORDS
+            before = message[:match.start()].rstrip()
+            mid_sentence_capital = token[0].isupper() and bool(before) and before[-1] not in '.!?'
+            in_name_position = after_intro or mid_sentence_capital
+            # Начало сообщения и подпись в конце — обычные места для имени
+            at_edge = position == 0 or position == len(matches) - 1
+
+            found = self.lookup(word)
+            if found is None:
+                if ((previous in STRONG_INTRO_WORDS or mid_sentence_capital)
+                        and word not in self.excluded and re.match(r'^[а-я]{2,}$', word)):
+                    # Незнакомое слово там, где обычно стоит имя — решать должен AI
+                    doubtful = True
+                continue
+
+            name, _ = found
+            score = NOMINATIVE_SCORE if word == _normalize(name) else CASE_FORM_SCORE
+            if previous in OTHER_PERSON_PREPOSITIONS:
+                score = AMBIGUOUS_SCORE
+            elif word in COMMON_WORD_NAMES and not in_name_position:
+                score = AMBIGUOUS_SCORE
+            elif token.islower() and not (after_intro or at_edge):
+                score = AMBIGUOUS_SCORE
+            if after_intro:
+                score = min(1.0, score + INTRO_BONUS)
+            if score > best_score:
+                best_name, best_score = name, score
+
+        if best_name and best_score > AMBIGUOUS_SCORE:
+            return best_name, round(best_score, 3)
+        if best_name:
+            return best_name, AMBIGUOUS_SCORE
+        return None, UNKNOWN_IN_NAME_POSITION if doubtful else NO_NAME
+
+    def stats(self) -> dict:
+        return {'names': self.names, 'forms': len(self.forms)}
+
+# Словарь загружается один раз при импорте
+name_recognizer = NameRecognizer(load_names())
+
+def recognize_name(message: str) -> tuple:
+    """(имя или None, уверенность 0..1); AI нужен, только если уверенность ниже порога."""
+    return name_recognizer.recognize(message)
+
+def is_known_name(word: str) -> bool:
+    """Слово — имя из словаря (в любом падеже) и не совпадает с обычным словом."""
+    return name_recognizer.is_name(word)
@@ -0,0 +1,163 @@
+"""
+Поиск российских телефонов в тексте и приведение их к E.164 (+7XXXXXXXXXX).
+
+Одни правила для веба, Telegram и многоэтапного диалога (раньше в каждом
+обработчике был свой список регулярок). Понимает:
+- префиксы +7, 7 и 8, а также мобильный номер без префикса (10 цифр с 9)
+- пробелы, дефисы, точки и скобки: "+7 (999) 123-45-67", "8.999.123.45.67"
+- номер, разбитый на слова или строки: "8 999 123 45 67", "8999\\n1234567"
+- несколько номеров подряд и номер рядом с другими числами ("в 15 8 999 ...")
+
+Не считаются телефоном: даты и время ("на 30.04.2025 12:00" — записи,
+а не номер) и иностранные номера ("+1 415 555 1234", "+49 30 1234 5678").
+
+Регулярка одна, скомпилирована при импорте; группы цифр найденного
+фрагмента перебираются слева направо, номер — подряд идущие группы,
+дающие 11 цифр с 7/8 в начале или 10 цифр с 9 (мобильный без префикса).
+
+Для архивов диалогов есть extract_phones_batch (можно в несколько процессов).
+Замер скорости:
+    python phone_parser.py --benchmark
+"""
+
+import re
+import time
+import argparse
+from multiprocessing import Pool
+
+# Цифры, между которыми не больше трех разделителей (пробел, перенос строки, -, ., скобки)
+_CANDIDATE_RE = re.compile(r'\+?\(?\d(?:[\s\-.()]{0,3}\d)*')
+_DIGIT_GROUP_RE = re.compile(r'\d+')
+# Даты (30.04.2025, 30/04/25) и время (12:00) вырезаются из текста до поиска
+_DATE_TIME_RE = re.compile(r'(?<!\d)\d{1,2}[./]\d{1,2}[./](?:\d{4}|\d{2})(?!\d)|(?<!\d)\d{1,2}:\d{2}(?!\d)')
+
+# Первая цифра номера без префикса: только мобильные
+NATIONAL_FIRST_DIGITS = frozenset('9')
+
+def normalize_phone(raw: str):
+    """Номер в E.164 (+7XXXXXXXXXX) или None, если это не российский номер."""
+    digits = ''.join(char for char in raw if char.isdigit())
+    plus = raw.lstrip().startswith('+')
+    if plus and not digits.startswith('7'):
+        return None
+    if len(digits) == 11 and digits[0] in '78':
+        return '+7' + digits[1:]
+    if len(digits) == 10 and digits[0] in NATIONAL_FIRST_DIGITS and not plus:
+        return '+7' + digits
+    return None
+
+def _phones_in_candidate(text: str, offset: int, plus: bool) -> list:
+    groups = [(m.group(), m.start() + offset, m.end() + offset) for m in _DIGIT_GROUP_RE.finditer(text)]
+    # Номер с "+" и другим кодом страны — иностранный, цифры после кода не разбираем
+    if plus and not groups[0][0].startswith('7'):
+        return []
+    phones = []
+    first = 0
+    while first < len(groups):
+        digits = ''
+        found = None
+        for last in range(first, len(groups)):
+            digits += groups[last][0]
+            if len(digits) > 11:
+                break
+            # "+" относится только к первой группе фрагмента
+            international = plus and first == 0
+            if len(digits) == 11 and digits[0] in '78' and not (international and digits[0] != '7'):
+                found = last
+                break
+            if len(digits) == 10 and digits[0] in NATIONAL_FIRST_DIGITS and not international:
+                # 10 цифр подходят, только если 11-й цифры дальше нет
+                if last + 1 == len(groups) or len(digits + groups[last + 1][0]) > 11:
+                    found = last
+                    break
+        if found is None:
+            first += 1
+            continue
+        start = groups[first][1] - (1 if plus and first == 0 else 0)
+        phones.append(('+7' + digits[-10:], start, groups[found][2]))
+        first = found + 1
+    return phones
+
+def find_phones(text: str) -> list:
+    """Все телефоны в тексте: список (номер в E.164, начало, конец) в порядке появления."""
+    if not text:
+        return []
+    # Даты и время заменяются пробелами той же длины: позиции номеров не сдвигаются
+    masked = _DATE_TIME_RE.sub(lambda m: ' ' * len(m.group()), text)
+    phones = []
+    for match in _CANDIDATE_RE.finditer(masked):
+        fragment = match.group()
+        # Короткие числа (цены, время, даты) пропускаем без разбора
+        if len(fragment) < 10:
+            continue
+        plus = fragment.startswith('+')
+        phones.extend(_phones_in_candidate(fragment, match.start(), plus))
+    return phones
+
+def extract_phone(text: str):
+    """Первый телефон в тексте: (номер в E.164, позиция в тексте) или (None, -1)."""
+    phones = find_phones(text)
+    if not phones:
+        return None, -1
+    phone, start, _ = phones[0]
+    return phone, start
+
+def _unique_phones(text: str) -> list:
+    return list(dict.fromkeys(phone for phone, _, _ in find_phones(text)))
+
+def extract_phones_batch(texts, processes: int = 1, chunksize: int = 500) -> list:
+    """
+    Телефоны для каждого текста (например, архива диалогов): список номеров
+    E.164 без повторов на каждый текст, в том же порядке, что и тексты.
+    При processes > 1 тексты разбираются в нескольких процессах.
+    """
+    texts = list(texts)
+    if processes > 1 and len(texts) > chunksize:
+        with Pool(processes) as pool:
+            return pool.map(_unique_phones, texts, chunksize)
+    return [_unique_phones(text) for text in texts]
+
+BENCHMARK_MESSAGES = [
+    "Здравствуйте, хочу записаться на лазерную эпиляцию",
+    "Меня зовут Анна, мой телефон +7 (918) 123-45-67",
+    "Анна 89181234567",
+    "запишите на завтра в 15:30, номер 8 918 123 45 67",
+    "Сколько стоит бикини? 1900-3500 руб, а акция до 31.12.2024?",
+    "Мой номер\n8918\n1234567, звоните после 18",
+    "Ольга, 9181234567",
+    "запишите на 30.04.2025 12:00",
+    "+1 415 555 1234",
+    "Спасибо, до свидания!",
+]
+
+def benchmark(repeat: int = 20000, processes: int = 1):
+    """Микробенчмарк: один телефон на сообщение и пакетный разбор."""
+    for message in BENCHMARK_MESSAGES:
+        print(f"   {message!r:70.70} → {[phone for phone, _, _ in find_phones(message)]}")
+
+    started = time.perf_counter()
+    for _ in range(repeat // len(BENCHMARK_MESSAGES)):
+        for message in BENCHMARK_MESSAGES:
+            find_phones(message)
+    single = time.perf_counter() - started
+    count = repeat // len(BENCHMARK_MESSAGES) * len(BENCHMARK_MESSAGES)
+    print(f"⏱️ find_phones: {single / count * 1e6:.2f} мкс на сообщение ({count} сообщений)")
+
+    transcripts = ["\n".join(BENCHMARK_MESSAGES)] * (repeat // 10)
+    started = time.perf_counter()
+    extract_phones_batch(transcripts, processes=processes)
+    batch = time.perf_counter() - started
+    print(f"⏱️ extract_phones_batch: {len(transcripts) / batch:.0f} диалогов/с "
+          f"({len(transcripts)} диалогов, процессов: {processes})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Поиск телефонов в тексте")
+    parser.add_argument("--benchmark", action="store_true", help="замерить скорость")
+    parser.add_argument("--repeat", type=int, default=20000)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("text", nargs="*", help="текст для разбора")
+    options = parser.parse_args()
+    if options.benchmark:
+        benchmark(options.repeat, options.processes)
+    else:
+        print(find_phones(" ".join(options.text)))
@@ -0,0 +1,256 @@
+"""
+Ответы на вопросы о цене прямо из прайса, без AI.
+
+"Сколько стоит эпиляция подмышек?" — это поиск по data/procedures.json:
+движок определяет процедуру (алиасы и название из каталога, либо процедура
+из контекста диалога) и зону/позицию прайса (prices, complexes, courses,
+peels, preparations и т.д.), и если ответ однозначен — отвечает сам
+через format_price_response. Если процедур несколько, зона не указана
+при длинном прайсе или вопрос требует консультации (сравнение, скидки,
+курс), вопрос уходит в AI.
+
+Слова сообщения и позиций сравниваются по основе целиком (без конечной
+гласной: "лица" = "лицо"), а не по общему началу: "ботокс" не совпадает
+с "ботулакс", "вас" — с "вакуумный". Если названа только процедура
+("сколько стоит пилинг"), показывается весь ее прайс или вопрос уходит
+в AI — но не случайная часть позиций. Если названа зона, которой нет в
+прайсе процедуры ("ботокс лба"), весь прайс не показывается: вопрос уходит
+в AI. Если слово, которым названа процедура, — позиция прайса другой
+процедуры ("губы": контурная пластика по алиасу и "губы" у перманентного
+макияжа), процедура неоднозначна и вопрос тоже уходит в AI.
+
+Сообщение нормализуется один раз (text_normalizer): признаки вопроса о цене
+и консультации берутся из message.keywords (группы price_question и
+price_handoff в keywords.py), слова — из message.folded.
+"""
+
+import time
+
+from keywords import CATALOG_PROCEDURE_LABELS
+from text_normalizer import normalize_message, fold_text
+from prices_loader import load_catalog, format_price_response
+from procedure_index import (
+    build_procedure_index, extract_terms, message_tokens, term_matches,
+    PRICE_ITEM_WEIGHT, STRONG_MATCH_SCORE,
+)
+
+# Без зоны отвечаем списком, только если прайс процедуры короткий
+MAX_LISTED_ITEMS = 8
+
+# Слова вопроса, которые не называют ни процедуру, ни зону
+MESSAGE_STOP_WORDS = [
+    'сколько', 'стоит', 'стоят', 'стоимость', 'цена', 'цены', 'цену', 'прайс', 'почем',
+    'будет', 'обойдется', 'какая', 'какие', 'какой', 'какую', 'вас', 'вам', 'нас', 'нам',
+    'для', 'мне', 'меня', 'нужно', 'хочу', 'можно', 'подскажите', 'скажите', 'пожалуйста',
+    'здравствуйте', 'добрый', 'день', 'еще', 'это', 'ваша', 'ваши', 'ваш', 'рублей', 'руб'
+]
+
+# Короче — основа слишком общая, чтобы по ней сравнивать
+MIN_STEM_LENGTH = 3
+_FINAL_VOWELS = 'аеиоуыэюяйь'
+
+PRICE_FIELDS = ('prices', 'complexes', 'courses', 'peels', 'advanced_cleaning',
+                'author_cleaning', 'preparations', 'procedures')
+
+# Комплексы и курсы показываем, только если отдельная зона не нашлась
+BUNDLE_FIELDS = ('complexes', 'courses')
+
+# Индекс строится заново, только когда у прайса сменилась версия (prices_loader)
+_engine_cache = {
+    'version': None,
+    'procedures': [],
+    'index': [],
+    'items': [],
+    'name_terms': [],
+}
+
+def _collect_price_items(procedure: dict) -> list:
+    """Позиции прайса процедуры: (название, цена, основы слов названия, поле прайса)."""
+    items = []
+    for field in PRICE_FIELDS:
+        value = procedure.get(field)
+        if not isinstance(value, dict):
+            continue
+        for name, price in value.items():
+            if isinstance(price, dict):
+                # Вложенные группы (мезотерапия): слова группы тоже относятся к позиции
+                for nested_name, nested_price in price.items():
+                    terms = frozenset(extract_terms(f"{nested_name} {name}"))
+                    items.append((f"{nested_name} ({name.lower()})", nested_price, terms, field))
+            else:
+                items.append((name, price, frozenset(extract_terms(name)), field))
+    return items
+
+def _get_engine() -> dict:
+    """Возвращает индекс процедур и позиций прайса, пересобирая его при смене файла."""
+    data, version = load_catalog()
+    if version != _engine_cache['version']:
+        procedures = data.get('procedures', [])
+        # Для выбора процедуры берем только алиасы, название, категорию и аппарат:
+        # зоны ("лицо", "шея") встречаются у многих процедур. Термины приводим
+        # к виду message.folded ("рф-лифтинг" → "рф лифтинг")
+        index = []
+        for terms in build_procedure_index(procedures):
+            folded_terms = {}
+            for term, weight in terms.items():
+                if weight > PRICE_ITEM_WEIGHT:
+                    term = fold_text(term)
+                    folded_terms[term] = max(weight, folded_terms.get(term, 0))
+            index.append(folded_terms)
+        _engine_cache.update({
+            'version': version,
+            'procedures': procedures,
+            'index': index,
+            'items': [_collect_price_items(procedure) for procedure in procedures],
+            'name_terms': [frozenset(extract_terms(f"{p.get('name', '')} {' '.join(p.get('aliases', []))}"))
+                           for p in procedures],
+        })
+    return _engine_cache
+
+def is_price_question(message: str) -> bool:
+    """Спрашивает ли клиент цену."""
+    return normalize_message(message).keywords.has('price_question')
+
+def _procedure_group(procedure: dict) -> str:
+    """Процедуры одной группы (два аппарата эпиляции, три вида лифтинга) можно показать вместе."""
+    return CATALOG_PROCEDURE_LABELS.get(procedure.get('id'), procedure.get('id'))
+
+def _detect_procedures(engine: dict, text: str) -> list:
+    """Позиции процедур, уверенно названных в тексте (по убыванию балла)."""
+    tokens = message_tokens(text)
+    scores = {}
+    for position, terms in enumerate(engine['index']):
+        score = sum(weight for term, weight in terms.items() if term_matches(term, tokens))
+        if score >= STRONG_MATCH_SCORE:
+            scores[position] = score
+
+    if not scores:
+        return []
+
+    best = max(scores.values())
+    # Оставляем только лидеров: "эпиляция" не должна тянуть за собой уход после нее
+    return sorted((position for position, score in scores.items() if score == best),
+                  key=lambda position: position)
+
+def _word_base(term: str) -> str:
+    """Основа без конечной гласной: "лица"/"лицо" → "лиц", "губы" → "губ"."""
+    return term[:-1] if term[-1] in _FINAL_VOWELS else term
+
+def _same_word(first: str, second: str) -> bool:
+    """Одно и то же слово: основы равны целиком и не короче MIN_STEM_LENGTH."""
+    if len(first) < MIN_STEM_LENGTH or len(second) < MIN_STEM_LENGTH:
+        return False
+    return _word_base(first) == _word_base(second)
+
+_MESSAGE_STOP_TERMS = frozenset(extract_terms(' '.join(MESSAGE_STOP_WORDS)))
+
+def _message_terms(text: str) -> set:
+    """Основы слов сообщения без служебных слов вопроса."""
+    return {term for term in extract_terms(text) if term not in _MESSAGE_STOP_TERMS}
+
+def _match_items(items: list, zone_terms: set, message_terms: set) -> list:
+    """
+    Позиции прайса, совпавшие с зоной из сообщения. Позиция должна содержать
+    хотя бы одно слово зоны; при равенстве выигрывает та, где совпало больше
+    слов сообщения ("мезотерапия лица" — группа "мезотерапия лица", а не
+    липолитик "лицо" из группы "тело").
+    """
+    best_overlap = 0
+    matched = []
+    for name, price, terms, field in items:
+        if not any(_same_word(term, word) for term in terms for word in zone_terms):
+            continue
+        overlap = sum(1 for term in terms if any(_same_word(term, word) for word in message_terms))
+        if overlap > best_overlap:
+            best_overlap = overlap
+            matched = [(name, price, field)]
+        elif overlap == best_overlap:
+            matched.append((name, price, field))
+
+    single = [(name, price) for name, price, field in matched if field not in BUNDLE_FIELDS]
+    return single or [(name, price) for name, price, _ in matched]
+
+def _naming_is_ambiguous(engine: dict, position: int, naming_terms: set, groups: set) -> bool:
+    """
+    Названа ли процедура словами, которые целиком совпадают с позицией прайса
+    процедуры из другой группы ("губы" — алиас контурной пластики и позиция
+    перманентного макияжа).
+    """
+    if not naming_terms:
+        return False
+    for other, items in enumerate(engine['items']):
+        if other == position or _procedure_group(engine['procedures'][other]) in groups:
+            continue
+        for _, _, terms, _ in items:
+            if all(any(_same_word(term, word) for term in terms) for word in naming_terms):
+                return True
+    return False
+
+def find_price_answer(message: str, last_procedure: str = None) -> tuple:
+    """
+    Пытается ответить на вопрос о цене из прайса.
+    Возвращает (ответ, None), если ответ однозначен, иначе (None, причина передачи AI).
+    """
+    started = time.perf_counter()
+    message = normalize_message(message)
+
+    if not message.keywords.has('price_question'):
+        return None, "не вопрос о цене"
+
+    handoff = message.keywords.first('price_handoff')
+    if handoff:
+        return None, f"нужна консультация ('{handoff}')"
+
+    engine = _get_engine()
+    positions = _detect_procedures(engine, message)
+    if not positions and last_procedure:
+        positions = _detect_procedures(engine, last_procedure.lower())
+    if not positions:
+        return None, "процедура не определена"
+
+    procedures = engine['procedures']
+    detected_groups = {_procedure_group(procedures[position]) for position in positions}
+    message_terms = _message_terms(message.folded)
+    matches = {}
+    zone_requested = False
+    for position in positions:
+        # Зона — слова сообщения кроме тех, которыми названа сама процедура:
+        # по одному названию процедуры ("пилинг") часть позиций не выбираем
+        naming_terms = {word for word in message_terms
+                        if any(_same_word(word, term) for term in engine['name_terms'][position])}
+        if _naming_is_ambiguous(engine, position, naming_terms, detected_groups):
+            return None, "подходит несколько процедур"
+        zone_terms = message_terms - naming_terms
+        zone_requested = zone_requested or bool(zone_terms)
+        matches[position] = _match_items(engine['items'][position], zone_terms, message_terms)
+    with_zone = {position: items for position, items in matches.items() if items}
+
+    if with_zone:
+        selected = with_zone
+    elif zone_requested:
+        # Зону назвали, но в прайсе ее нет: чужие зоны не показываем
+        return None, "зона не найдена в прайсе"
+    else:
+        # Зона не названа — показываем прайс целиком, только если он короткий
+        selected = {}
+        for position in positions:
+            items = [(name, price) for name, price, _, _ in engine['items'][position]]
+            if not items or len(items) > MAX_LISTED_ITEMS:
+                return None, "нужно уточнить зону или препарат"
+            selected[position] = items
+
+    groups = {_procedure_group(procedures[position]) for position in selected}
+    if len(groups) > 1:
+        return None, "подходит несколько процедур"
+    if sum(len(items) for items in selected.values()) > MAX_LISTED_ITEMS * 2:
+        return None, "слишком много позиций"
+
+    parts = [
+        format_price_response(procedures[position].get('name', ''), dict(items)).strip()
+        for position, items in selected.items()
+    ]
+    answer = "\n\n".join(parts) + "\n\nХотите записаться?"
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"💰 Ответ из прайса без AI ({', '.join(procedures[p].get('id', '') for p in selected)}) за {elapsed_ms:.2f} мс")
+    return answer, None
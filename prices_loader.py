@@ -1,28 +1,68 @@
 import json
 import os
+import hashlib
+import threading
 
-def load_procedures():
+PROCEDURES_FILE = os.path.join(os.path.dirname(__file__), 'data', 'procedures.json')
+
+# Единственный кэш прайса процесса: промпт (chatbot_logic), движок цен
+# (price_engine) и кэш ответов сверяются с одной версией — хэшем содержимого
+# procedures.json. Файл перечитывается только при смене mtime или размера.
+_procedures_cache = {
+    'file_key': None,
+    'version': None,
+    'data': None,
+}
+_procedures_lock = threading.Lock()
+
+def load_catalog() -> tuple:
     """
-    Загружает список процедур из data/procedures.json
+    Возвращает (прайс, версия). Версия — хэш содержимого procedures.json
+    ('fallback', если файл не прочитан и используются базовые данные).
+    Если mtime сменился, а содержимое нет, возвращается тот же объект прайса.
     """
     try:
-        file_path = os.path.join(os.path.dirname(__file__), 'data', 'procedures.json')
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        stat = os.stat(PROCEDURES_FILE)
+        file_key = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        file_key = (None, None)
+    
+    if _procedures_cache['version'] is not None and file_key == _procedures_cache['file_key']:
+        return _procedures_cache['data'], _procedures_cache['version']
+    
+    with _procedures_lock:
+        # Другой поток мог уже перечитать файл
+        if _procedures_cache['version'] is not None and file_key == _procedures_cache['file_key']:
+            return _procedures_cache['data'], _procedures_cache['version']
         
-        print(f"✅ Загружено {len(data.get('procedures', []))} процедур")
-        return data
+        try:
+            with open(PROCEDURES_FILE, 'rb') as f:
+                raw = f.read()
+            version = hashlib.sha256(raw).hexdigest()[:12]
+            if version == _procedures_cache['version']:
+                _procedures_cache['file_key'] = file_key
+                return _procedures_cache['data'], version
+            data = json.loads(raw.decode('utf-8'))
+            print(f"✅ Загружено {len(data.get('procedures', []))} процедур")
+        except FileNotFoundError:
+            print("⚠️ Файл procedures.json не найден. Используем базовые данные.")
+            data, version = get_default_procedures(), 'fallback'
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print("❌ Ошибка чтения procedures.json.")
+            data, version = get_default_procedures(), 'fallback'
+        except Exception as e:
+            print(f"❌ Ошибка загрузки процедур: {str(e)}")
+            data, version = get_default_procedures(), 'fallback'
         
-    except FileNotFoundError:
-        print("⚠️ Файл procedures.json не найден. Используем базовые данные.")
-        return get_default_procedures()
-    except json.JSONDecodeError:
-        print("❌ Ошибка чтения procedures.json.")
-        return get_default_procedures()
-    except Exception as e:
-        print(f"❌ Ошибка загрузки процедур: {str(e)}")
-        return get_default_procedures()
+        _procedures_cache.update({'file_key': file_key, 'version': version, 'data': data})
+        return data, version
+
+def load_procedures():
+    """
+    Загружает список процедур из data/procedures.json
+    (из кэша, если файл не менялся)
+    """
+    return load_catalog()[0]
 
 def get_default_procedures():
     """Возвращает базовые данные если файл не найден."""
@@ -0,0 +1,172 @@
+"""
+Индекс процедур прайса для выбора релевантного контекста промпта.
+
+Вместо всего прайса в каждый запрос попадают только процедуры, которые
+относятся к сообщению клиента и к процедуре из контекста диалога.
+Индекс строится из каталога (data/procedures.json): алиасы процедур,
+слова из названия, аппарат и технология, зоны и позиции прайса.
+
+Термины сравниваются со словами сообщения с начала слова, а не как
+подстрока: "поры" не находится в "споры". Короткий термин ("ухо", "губ")
+совпадает только со словом целиком или с окончанием на гласную ("уха",
+"губы"), но не с другим словом ("уход"); длинная основа ("перманент")
+совпадает с любым продолжением ("перманентный").
+
+Настройки:
+- PRICE_CONTEXT_TOKEN_BUDGET — сколько токенов прайса можно отдать в промпт (по умолчанию 1500)
+"""
+
+import os
+import re
+from functools import lru_cache
+
+from text_normalizer import NormalizedMessage, fold_text
+
+PRICE_CONTEXT_TOKEN_BUDGET = int(os.getenv("PRICE_CONTEXT_TOKEN_BUDGET", "1500"))
+
+# Веса совпадений: алиас или название процедуры — сильный сигнал,
+# зона/позиция прайса («подмышки», «лицо») встречается у многих процедур
+ALIAS_WEIGHT = 3
+NAME_WEIGHT = 3
+APPARATUS_WEIGHT = 2
+CATEGORY_WEIGHT = 2
+PRICE_ITEM_WEIGHT = 1
+
+# Порог «сильного» совпадения: если такие процедуры есть, берем только их
+STRONG_MATCH_SCORE = 3
+
+# С такой длины основа совпадает со словом при любом продолжении
+OPEN_STEM_LENGTH = 5
+_ENDING_START = frozenset('аеиоуыэюяь')
+
+_WORD_RE = re.compile(r'[a-zа-яё0-9]+')
+
+# Слова из прайса, которые не помогают отличить одну процедуру от другой
+_STOP_WORDS = {
+    'полностью', 'зона', 'зоны', 'любой', 'любая', 'процедуры', 'процедура', 'дополнительно',
+    'минут', 'минута', 'сеанс', 'курс', 'процедур', 'линий', 'размера', 'зависимости',
+    'количества', 'глубины', 'одноразовые', 'одноразовая', 'рекомендуемый', 'нового',
+    'поколения', 'классический', 'производства', 'типу', 'кожи', 'тела'
+}
+
+def _stem(word: str) -> str:
+    """Грубая основа слова: отбрасываем окончание, оставляя не больше 6 букв."""
+    if len(word) <= 4:
+        return word
+    return word[:max(4, min(len(word) - 2, 6))]
+
+def extract_terms(text: str) -> list:
+    """Основы значимых слов текста."""
+    return [
+        _stem(word) for word in _WORD_RE.findall(str(text).lower())
+        if len(word) >= 3 and word not in _STOP_WORDS
+    ]
+
+def _price_items(procedure: dict) -> list:
+    """Названия позиций прайса процедуры (зоны, препараты, пилинги и т.д.)."""
+    items = []
+    for field in ('prices', 'complexes', 'courses', 'peels', 'advanced_cleaning',
+                  'author_cleaning', 'preparations', 'procedures'):
+        value = procedure.get(field)
+        if isinstance(value, dict):
+            for key, nested in value.items():
+                items.append(key)
+                if isinstance(nested, dict):
+                    items.extend(nested.keys())
+    return items
+
+def build_procedure_index(procedures: list) -> list:
+    """
+    Строит индекс: для каждой процедуры — словарь {термин: вес}.
+    Позиция в списке совпадает с позицией процедуры в каталоге.
+    """
+    index = []
+
+    for procedure in procedures:
+        terms = {}
+
+        def add(term, weight):
+            if term and terms.get(term, 0) < weight:
+                terms[term] = weight
+
+        for item in _price_items(procedure):
+            for term in extract_terms(item):
+                add(term, PRICE_ITEM_WEIGHT)
+
+        for term in extract_terms(procedure.get('category', '')):
+            add(term, CATEGORY_WEIGHT)
+
+        for field in ('apparatus', 'technology'):
+            for term in extract_terms(procedure.get(field) or ''):
+                add(term, APPARATUS_WEIGHT)
+
+        for term in extract_terms(procedure.get('name', '')):
+            add(term, NAME_WEIGHT)
+
+        # Алиасы из каталога уже заданы основами и могут состоять из нескольких слов
+        for alias in procedure.get('aliases', []):
+            add(alias.lower(), ALIAS_WEIGHT)
+
+        index.append(terms)
+
+    return index
+
+@lru_cache(maxsize=4096)
+def _term_words(term: str) -> tuple:
+    return tuple(fold_text(term).split())
+
+def _word_matches(term_word: str, word: str) -> bool:
+    if not word.startswith(term_word):
+        return False
+    rest = word[len(term_word):]
+    return not rest or len(term_word) >= OPEN_STEM_LENGTH or rest[0] in _ENDING_START
+
+def message_tokens(text: str) -> tuple:
+    """Слова текста для term_matches (у NormalizedMessage уже посчитаны)."""
+    if isinstance(text, NormalizedMessage):
+        return text.tokens
+    return tuple(fold_text(str(text)).split())
+
+def term_matches(term: str, tokens: tuple) -> bool:
+    """Термин (одно слово или несколько подряд) совпадает со словами сообщения с начала слова."""
+    words = _term_words(term)
+    if not words:
+        return False
+    for start in range(len(tokens) - len(words) + 1):
+        if all(_word_matches(word, tokens[start + offset]) for offset, word in enumerate(words)):
+            return True
+    return False
+
+def score_procedures(index: list, text: str) -> dict:
+    """Возвращает {позиция процедуры: балл} для процедур, совпавших с текстом."""
+    tokens = message_tokens(text)
+    scores = {}
+
+    for position, terms in enumerate(index):
+        score = 0
+        for term, weight in terms.items():
+            if term_matches(term, tokens):
+                score += weight
+        if score:
+            scores[position] = score
+
+    return scores
+
+def select_relevant_procedures(index: list, message: str, last_procedure: str = None) -> list:
+    """
+    Выбирает процедуры, относящиеся к сообщению и к процедуре из контекста.
+    Возвращает позиции процедур по убыванию релевантности.
+    """
+    scores = score_procedures(index, message)
+
+    if last_procedure:
+        for position, score in score_procedures(index, last_procedure).items():
+            scores[position] = scores.get(position, 0) + score
+
+    if not scores:
+        return []
+
+    strong = {position: score for position, score in scores.items() if score >= STRONG_MATCH_SCORE}
+    selected = strong or scores
+
+    return sorted(selected, key=lambda position: (-selected[position], position))
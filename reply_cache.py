@@ -0,0 +1,128 @@
+"""
+Кэш ответов AI для частых вопросов ("сколько стоит эпиляция подмышек",
+"где вы находитесь" и т.п.).
+
+Ключ — нормализованное сообщение плюс флаги, которые меняют промпт
+(первое сообщение, есть имя/телефон, заявка отправлена, процедура из контекста).
+Кэшируются только ответы без истории диалога (первое сообщение сессии):
+история попадает в промпт, и ответ, написанный по чужому диалогу (имя,
+процедура, прошлые ответы), нельзя отдавать другому посетителю. Кэш
+проверяется до сборки промпта, поэтому попадание не тратит время на прайс
+и контекст.
+Вытеснение LRU, время жизни записи — TTL. При смене версии прайса
+(procedures.json) кэш сбрасывается целиком.
+
+Настройки:
+- REPLY_CACHE_SIZE — максимум записей (по умолчанию 500, 0 — кэш выключен)
+- REPLY_CACHE_TTL — время жизни записи, сек (по умолчанию 3600)
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from text_normalizer import fold_text
+
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", "500"))
+REPLY_CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", "3600"))
+
+class ReplyCache:
+    """LRU-кэш ответов с TTL, привязанный к версии прайса."""
+
+    def __init__(self, max_size: int = REPLY_CACHE_SIZE, ttl: float = REPLY_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.catalog_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(message: str, is_first_in_session: bool, has_name: bool, has_phone: bool,
+                 telegram_sent: bool, last_procedure: str = None, history: str = None) -> tuple:
+        """Собирает ключ кэша из сообщения и флагов сессии. None — ответ не кэшируется."""
+        # Ответ с историей зависит от диалога конкретного посетителя
+        if history:
+            return None
+        return (
+            fold_text(message),
+            bool(is_first_in_session),
+            bool(has_name),
+            bool(has_phone),
+            bool(telegram_sent),
+            last_procedure or ''
+        )
+
+    def _check_version(self, catalog_version: str):
+        """Сбрасывает кэш, если сменилась версия прайса (вызывать под блокировкой)."""
+        if catalog_version != self.catalog_version:
+            if self._entries:
+                self.invalidations += 1
+                print(f"🧹 Кэш ответов сброшен: версия прайса {self.catalog_version} → {catalog_version}")
+            self._entries.clear()
+            self.catalog_version = catalog_version
+
+    def get(self, key: tuple, catalog_version: str):
+        """Возвращает закэшированный ответ или None."""
+        if self.max_size <= 0 or key is None:
+            return None
+
+        with self._lock:
+            self._check_version(catalog_version)
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            reply, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return reply
+
+    def put(self, key: tuple, reply: str, catalog_version: str):
+        """Сохраняет ответ, вытесняя самые давние записи при переполнении."""
+        if self.max_size <= 0 or key is None:
+            return
+
+        with self._lock:
+            self._check_version(catalog_version)
+            self._entries[key] = (reply, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Полностью очищает кэш."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Статистика для мониторинга."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'catalog_version': self.catalog_version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+# Общий кэш ответов для веба и Telegram
+reply_cache = ReplyCache()
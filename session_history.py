@@ -0,0 +1,103 @@
+"""
+Состояние диалога, которое обновляется по одному сообщению.
+
+Раньше на каждом сообщении вся история склеивалась заново и просматривалась
+целиком (упоминалась ли процедура, какая процедура последняя) — на длинном
+диалоге это O(n²). Теперь флаги обновляются только по новому сообщению,
+а текст хранится в ограниченном буфере; полный текст диалога собирается
+только при отправке заявки.
+
+С общим хранилищем (sqlite, redis) обработчик держит копию сессии, пока
+ждет модель, а за это время ту же сессию может сохранить другой воркер
+(следующее сообщение клиента, неполная заявка по сроку). Поэтому ход
+сохраняется не целиком, а слиянием: session_revision запоминает сессию
+при чтении, merge_turn переносит на свежую копию из хранилища только то,
+что изменил этот ход (новые сообщения, реплики, измененные поля), а флаги
+отправки заявки никогда не сбрасываются.
+
+Настройки:
+- SESSION_HISTORY_MAX_MESSAGES — сколько последних сообщений клиента хранить для заявки (по умолчанию 50)
+"""
+
+import os
+
+from text_normalizer import normalize_message
+
+SESSION_HISTORY_MAX_MESSAGES = int(os.getenv("SESSION_HISTORY_MAX_MESSAGES", "50"))
+
+# Флаги, которые однажды выставленные не сбрасываются: заявка ушла — значит ушла
+STICKY_FLAGS = ('telegram_sent', 'incomplete_sent', 'contacts_provided', 'procedure_mentioned')
+
+# Поля, которые ход дописывает, а не перезаписывает (сливаются отдельно)
+APPENDED_FIELDS = frozenset({'text_parts', 'dropped_messages', 'message_count', 'memory', 'history_procedures'})
+
+def append_message(session: dict, text: str):
+    """Добавляет сообщение в буфер истории; самые старые вытесняются."""
+    parts = session['text_parts']
+    parts.append(text)
+    overflow = len(parts) - SESSION_HISTORY_MAX_MESSAGES
+    if overflow > 0:
+        del parts[:overflow]
+        session['dropped_messages'] = session.get('dropped_messages', 0) + overflow
+
+def render_transcript(session: dict, separator: str = "\n") -> str:
+    """Текст диалога для заявки (вызывать только при отправке)."""
+    transcript = separator.join(session.get('text_parts', []))
+    dropped = session.get('dropped_messages', 0)
+    if dropped:
+        return f"(ранние сообщения не показаны: {dropped}){separator}{transcript}"
+    return transcript
+
+def mark_procedures(session: dict, message: str, group: str, field: str):
+    """Добавляет в session[field] процедуры группы, упомянутые в новом сообщении (без повторов)."""
+    mentioned = session.setdefault(field, [])
+    for procedure in normalize_message(message).keywords.labels(group):
+        if procedure not in mentioned:
+            mentioned.append(procedure)
+
+def session_revision(session) -> dict:
+    """Сессия на момент чтения из хранилища: с ней merge_turn сравнивает ход обработчика."""
+    return {
+        'fields': {key: session[key] for key in session.FIELDS - APPENDED_FIELDS},
+        'message_count': session['message_count'],
+        'total_turns': session['memory'].total_turns,
+    }
+
+def merge_turn(stored, session, revision: dict):
+    """
+    Переносит на stored (свежую копию из хранилища) изменения, которые ход
+    сделал в session после чтения revision. Без stored (или если это тот же
+    объект, как в memory) возвращает session как есть.
+    """
+    if stored is None or stored is session:
+        return session
+
+    for key, value in revision['fields'].items():
+        if key in STICKY_FLAGS:
+            stored[key] = stored[key] or session[key]
+        elif session[key] != value and not (key == 'stage' and stored[key] == 'completed'):
+            stored[key] = session[key]
+
+    new_messages = min(session['message_count'] - revision['message_count'], len(session['text_parts']))
+    if new_messages > 0:
+        for text in session['text_parts'][-new_messages:]:
+            append_message(stored, text)
+        stored['message_count'] += new_messages
+
+    turns = session['memory'].turns
+    new_turns = min(session['memory'].total_turns - revision['total_turns'], len(turns))
+    for role, text in list(turns)[len(turns) - new_turns:]:
+        stored['memory'].add(role, text)
+
+    for procedure in session['history_procedures']:
+        if procedure not in stored['history_procedures']:
+            stored['history_procedures'].append(procedure)
+    return stored
+
+def mark_incomplete_sent(stored):
+    """update() после неполной заявки: флаги ставятся на свежей копии (удаленную сессию не создаем)."""
+    if stored is None:
+        return None
+    stored['telegram_sent'] = True
+    stored['incomplete_sent'] = True
+    return stored
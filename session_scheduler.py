@@ -0,0 +1,175 @@
+"""
+Планировщик сроков сессий: неполные заявки и удаление старых сессий.
+
+Вместо полного обхода всех сессий на каждом сообщении (и раз в 5 минут
+в Telegram) каждая сессия ставит свои сроки в кучу (heapq):
+- incomplete_lead — через SESSION_INCOMPLETE_LEAD_SECONDS после начала сессии,
+  если есть имя и телефон, а заявка не отправлена, уходит неполная заявка
+- expire — через SESSION_MAX_AGE_SECONDS сессия удаляется
+
+Фоновая задача спит до ближайшего срока и выполняет событие ровно вовремя;
+постановка и извлечение — O(log n). Обработчик события сам перечитывает
+сессию и проверяет, актуально ли оно (заявку могли уже отправить).
+При старте сроки восстанавливаются по сессиям из хранилища.
+
+С общим хранилищем (sqlite, redis) у каждого воркера свой планировщик и
+одни и те же сроки; неполную заявку отправляет только тот воркер, который
+первым захватил событие через store.claim (INSERT OR IGNORE / SET NX).
+
+Настройки:
+- SESSION_INCOMPLETE_LEAD_SECONDS — когда отправлять неполную заявку, сек (по умолчанию 600)
+- SESSION_MAX_AGE_SECONDS — когда удалять сессию, сек (7200)
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from datetime import datetime, timedelta
+
+SESSION_INCOMPLETE_LEAD_SECONDS = float(os.getenv("SESSION_INCOMPLETE_LEAD_SECONDS", "600"))
+SESSION_MAX_AGE_SECONDS = float(os.getenv("SESSION_MAX_AGE_SECONDS", "7200"))
+
+INCOMPLETE_LEAD = 'incomplete_lead'
+EXPIRE = 'expire'
+EVENT_KINDS = (INCOMPLETE_LEAD, EXPIRE)
+
+# Сколько последних задержек срабатывания хранить для перцентилей
+LAG_SAMPLES = 1000
+
+def _percentile(sorted_values: list, percent: float):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+class SessionScheduler:
+    """Куча сроков (момент, порядковый номер, вид, пространство имен, ключ)."""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        # Что уже стоит в очереди, чтобы не ставить событие повторно
+        self._scheduled = set()
+        self._queued = {kind: 0 for kind in EVENT_KINDS}
+        self._handlers = {}
+        self._wakeup = None
+        self._task = None
+        self._running_events = set()
+        self._lags_ms = deque(maxlen=LAG_SAMPLES)
+        self.fired = {kind: 0 for kind in EVENT_KINDS}
+        self.errors = 0
+        self.max_lag_ms = 0.0
+
+    def register(self, namespace: str, store, on_incomplete_lead, on_expire):
+        """
+        Подключает пространство имен сессий: хранилище и async-обработчики событий
+        (каждый получает ключ сессии).
+        """
+        self._handlers[namespace] = {
+            'store': store,
+            INCOMPLETE_LEAD: on_incomplete_lead,
+            EXPIRE: on_expire,
+        }
+
+    def _push(self, kind: str, namespace: str, key: str, due_at: datetime):
+        marker = (kind, namespace, key)
+        if marker in self._scheduled:
+            return
+        # Просроченный срок (контакты пришли позже, перезапуск) выполняется сразу;
+        # задержка срабатывания считается от момента постановки, а не от старого срока
+        delay = max(0.0, (due_at - datetime.now()).total_seconds())
+        heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), kind, namespace, key))
+        self._scheduled.add(marker)
+        self._queued[kind] += 1
+        # Будим цикл только если новый срок стал ближайшим
+        if self._wakeup is not None and self._heap[0][2:] == (kind, namespace, key):
+            self._wakeup.set()
+
+    def track(self, namespace: str, key: str, session: dict):
+        """Ставит сроки сессии после очередного сообщения (повторные вызовы ничего не меняют)."""
+        created_at = session['created_at']
+        self._push(EXPIRE, namespace, key, created_at + timedelta(seconds=SESSION_MAX_AGE_SECONDS))
+        if session.get('name') and session.get('phone') and not session.get('telegram_sent'):
+            self._push(INCOMPLETE_LEAD, namespace, key, created_at + timedelta(seconds=SESSION_INCOMPLETE_LEAD_SECONDS))
+
+    def restore(self) -> int:
+        """Ставит сроки для всех сессий из хранилищ (при старте процесса). Возвращает число сессий."""
+        restored = 0
+        for namespace, handlers in self._handlers.items():
+            for key, session in handlers['store'].items():
+                self.track(namespace, key, session)
+                restored += 1
+        return restored
+
+    def start(self):
+        """Запускает фоновую задачу (вызывать из работающего event loop)."""
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        restored = self.restore()
+        self._task = asyncio.create_task(self._run())
+        print(f"⏲️ Планировщик сессий запущен: {restored} сессий, {len(self._heap)} сроков в очереди")
+
+    async def _run(self):
+        while True:
+            try:
+                if not self._heap:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                due, _, kind, namespace, key = heapq.heappop(self._heap)
+                self._scheduled.discard((kind, namespace, key))
+                self._queued[kind] -= 1
+                lag_ms = (time.monotonic() - due) * 1000
+                self._lags_ms.append(lag_ms)
+                self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+                self.fired[kind] += 1
+
+                # Отправка в Telegram может быть медленной — не задерживаем остальные сроки
+                event = asyncio.create_task(self._handlers[namespace][kind](key))
+                self._running_events.add(event)
+                event.add_done_callback(self._event_done)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.errors += 1
+                print(f"❌ Ошибка планировщика сессий: {e}")
+
+    def _event_done(self, event: asyncio.Task):
+        self._running_events.discard(event)
+        if not event.cancelled() and event.exception() is not None:
+            self.errors += 1
+            print(f"❌ Ошибка обработки срока сессии: {event.exception()}")
+
+    def stats(self) -> dict:
+        """Глубина очереди и задержка срабатывания для мониторинга."""
+        lags = sorted(self._lags_ms)
+        next_due = round(max(0.0, self._heap[0][0] - time.monotonic()), 1) if self._heap else None
+        return {
+            'queue_depth': len(self._heap),
+            'queued_by_kind': dict(self._queued),
+            'next_due_in_seconds': next_due,
+            'fired': dict(self.fired),
+            'errors': self.errors,
+            'lag_ms': {
+                'p50': round(_percentile(lags, 50), 1) if lags else None,
+                'p99': round(_percentile(lags, 99), 1) if lags else None,
+                'max': round(self.max_lag_ms, 1),
+            },
+        }
+
+# Общий планировщик процесса (веб и Telegram)
+session_scheduler = SessionScheduler()
@@ -0,0 +1,905 @@
+"""
+Хранилище сессий диалогов (веб и Telegram).
+
+Сессии лежат не в словаре процесса, а в хранилище, выбранном переменной
+SESSION_STORE, поэтому сервис можно запускать в несколько воркеров uvicorn:
+- memory — словарь в памяти процесса без журнала (по умолчанию, один воркер)
+- journal — словарь в памяти процесса плюс журнал на диске: после
+  перезапуска сессии и сроки неполных заявок восстанавливаются (один воркер).
+  Деплой журнал переживает, только если SESSION_JOURNAL_DIR лежит на
+  постоянном диске (на Render без подключенного диска файлы теряются)
+- sqlite — файл SQLite в режиме WAL, общий для процессов на одной машине
+- redis — любой сервер с протоколом Redis (RESP); для локальной проверки
+  есть заглушка fake_redis_server.py
+
+Обработчик берет сессию через get(), меняет ее и сохраняет через
+save_turn(): ход сливается со свежей копией внутри update() — атомарного
+чтения-изменения-записи (блокировка в процессе, BEGIN IMMEDIATE в sqlite,
+WATCH/MULTI/EXEC в redis), поэтому сохранение, сделанное другим воркером,
+пока обработчик ждал модель, не затирается. Разовые события (неполная заявка) захватываются через claim(): у каждого
+воркера свой планировщик, и без захвата заявка ушла бы из каждого.
+Для sqlite и redis сессия хранится в JSON (даты и память диалога
+сериализуются отдельно), для memory и journal — как есть.
+
+Журнал (journal): каждое сохранение и удаление дописывается в файл
+journal-<поколение>.log одной строкой с контрольной суммой; fsync делает
+фоновый поток раз в SESSION_JOURNAL_FSYNC_MS сразу для всех накопленных
+записей. Когда в журнале набирается SESSION_JOURNAL_SNAPSHOT_RECORDS записей
+(или прошло SESSION_JOURNAL_SNAPSHOT_SECONDS), тот же фоновый поток пишет
+все живые сессии в снимок snapshot.jsonl (со временем их последнего
+сохранения) и начинает новый журнал, а старые удаляет.
+При старте читается снимок и журналы после него, поэтому время
+восстановления ограничено размером снимка плюс SESSION_JOURNAL_SNAPSHOT_RECORDS
+записей; оно печатается в лог и отдается в stats().
+
+Настройки:
+- SESSION_STORE — memory, journal, sqlite или redis (по умолчанию memory)
+- SESSION_STORE_PATH — файл базы SQLite (по умолчанию data/sessions.db)
+- SESSION_STORE_REDIS_URL — адрес Redis (redis://127.0.0.1:6379/0)
+- SESSION_TTL_SECONDS — через сколько секунд без обновлений сессия удаляется
+  из sqlite/redis/journal, даже если ее не удалила очистка (по умолчанию 7200)
+- SESSION_JOURNAL_DIR — папка журнала и снимка (по умолчанию data/journal)
+- SESSION_JOURNAL_FSYNC_MS — как часто сбрасывать журнал на диск, мс (200)
+- SESSION_JOURNAL_SNAPSHOT_RECORDS — после скольких записей делать снимок (2000)
+- SESSION_JOURNAL_SNAPSHOT_SECONDS — не реже чем раз во сколько секунд (300)
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import zlib
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+
+from conversation_memory import ConversationMemory
+from chat_session import ChatSession, CHANNEL_TELEGRAM, CHANNEL_WEB
+from session_history import merge_turn
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").strip().lower()
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "data/sessions.db")
+SESSION_STORE_REDIS_URL = os.getenv("SESSION_STORE_REDIS_URL", "redis://127.0.0.1:6379/0")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "7200"))
+SESSION_JOURNAL_DIR = os.getenv("SESSION_JOURNAL_DIR", "data/journal")
+SESSION_JOURNAL_FSYNC_MS = float(os.getenv("SESSION_JOURNAL_FSYNC_MS", "200"))
+SESSION_JOURNAL_SNAPSHOT_RECORDS = int(os.getenv("SESSION_JOURNAL_SNAPSHOT_RECORDS", "2000"))
+SESSION_JOURNAL_SNAPSHOT_SECONDS = float(os.getenv("SESSION_JOURNAL_SNAPSHOT_SECONDS", "300"))
+
+# Сколько раз пытаться сериализовать сессию для снимка, пока ее меняет обработчик
+SNAPSHOT_ENCODE_ATTEMPTS = 3
+
+REDIS_KEY_PREFIX = "gladis:session"
+# Захваты событий лежат отдельно, чтобы SCAN по сессиям их не видел
+REDIS_CLAIM_PREFIX = "gladis:claim"
+# Сколько раз повторять WATCH/MULTI/EXEC, если сессию одновременно меняет другой воркер
+REDIS_WATCH_ATTEMPTS = 10
+
+def _json_default(value):
+    """Сериализует поля сессии, которых нет в JSON."""
+    if isinstance(value, ChatSession):
+        return {'__session__': value.to_dict()}
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, ConversationMemory):
+        return {'__memory__': value.to_dict()}
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    raise TypeError(f"поле сессии типа {type(value).__name__} не сериализуется")
+
+def _json_object_hook(data: dict):
+    if '__session__' in data:
+        return ChatSession.from_dict(data['__session__'])
+    if '__datetime__' in data:
+        return datetime.fromisoformat(data['__datetime__'])
+    if '__memory__' in data:
+        return ConversationMemory.from_dict(data['__memory__'])
+    return data
+
+def encode_session(session: ChatSession) -> str:
+    """Сессия → JSON."""
+    return json.dumps(session, ensure_ascii=False, default=_json_default)
+
+def decode_session(raw) -> ChatSession:
+    """JSON → сессия (сессии старого формата — словари — переводятся в ChatSession)."""
+    if isinstance(raw, bytes):
+        raw = raw.decode('utf-8')
+    session = json.loads(raw, object_hook=_json_object_hook)
+    if isinstance(session, dict):
+        channel = CHANNEL_TELEGRAM if 'telegram_chat_id' in session else CHANNEL_WEB
+        session = ChatSession.from_dict({**session, 'channel': channel})
+    return session
+
+class SessionStore:
+    """Интерфейс хранилища: сессии одного пространства имен (web, telegram)."""
+
+    backend = 'base'
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+
+    def get(self, key: str):
+        """Сессия по ключу или None."""
+        raise NotImplementedError
+
+    def save(self, key: str, session: dict):
+        """Сохраняет сессию (создает или перезаписывает)."""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def update(self, key: str, apply):
+        """
+        Атомарно перечитывает сессию и сохраняет apply(сессия или None).
+        Если apply вернул None, ничего не сохраняется. Возвращает результат apply.
+        apply может вызываться повторно (redis при конфликте): менять можно
+        только переданную ему копию.
+        """
+        raise NotImplementedError
+
+    def save_turn(self, key: str, session, revision: dict):
+        """
+        Сохраняет ход обработчика слиянием со свежей копией из хранилища
+        (см. session_history.merge_turn). Возвращает сохраненную сессию.
+        """
+        return self.update(key, lambda stored: merge_turn(stored, session, revision))
+
+    def lead_sent(self, key: str) -> bool:
+        """Ушла ли уже заявка по сессии — по хранилищу, а не по копии обработчика."""
+        stored = self.get(key)
+        return bool(stored and stored.get('telegram_sent', False))
+
+    def claim(self, key: str, event: str) -> bool:
+        """
+        Захватывает разовое событие сессии (например, отправку неполной заявки).
+        True только у первого вызвавшего, в том числе среди нескольких воркеров.
+        """
+        raise NotImplementedError
+
+    def items(self) -> list:
+        """Все живые сессии: список (ключ, сессия)."""
+        raise NotImplementedError
+
+    def sample(self, limit: int) -> list:
+        """Не больше limit живых сессий (для метрик: остальные не читаются и не декодируются)."""
+        return self.items()[:limit]
+
+    def __len__(self) -> int:
+        return len(self.items())
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def stats(self) -> dict:
+        return {'backend': self.backend, 'namespace': self.namespace, 'sessions': len(self)}
+
+class MemorySessionStore(SessionStore):
+    """Словарь в памяти процесса: сессии хранятся как живые объекты."""
+
+    backend = 'memory'
+
+    def __init__(self, namespace: str):
+        super().__init__(namespace)
+        self._sessions = {}
+        # Захваченные события: ключ сессии → множество событий
+        self._claims = {}
+        self._claims_lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+    def get(self, key: str):
+        return self._sessions.get(key)
+
+    def save(self, key: str, session: dict):
+        self._sessions[key] = session
+
+    def delete(self, key: str):
+        self._sessions.pop(key, None)
+        with self._claims_lock:
+            self._claims.pop(key, None)
+
+    def update(self, key: str, apply):
+        with self._update_lock:
+            session = apply(self.get(key))
+            if session is not None:
+                self.save(key, session)
+            return session
+
+    def claim(self, key: str, event: str) -> bool:
+        with self._claims_lock:
+            events = self._claims.setdefault(key, set())
+            if event in events:
+                return False
+            events.add(event)
+            return True
+
+    def items(self) -> list:
+        return list(self._sessions.items())
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._sessions
+
+class SessionJournal:
+    """
+    Журнал сохранений сессий всех пространств имен процесса.
+
+    Строка журнала: crc32 в hex, пробел, JSON {op, ns, key, at, session}.
+    Записи идемпотентны (сессия целиком или удаление), поэтому повторное
+    чтение журнала поверх снимка безопасно.
+    """
+
+    SNAPSHOT_FILE = 'snapshot.jsonl'
+
+    def __init__(self, directory: str = SESSION_JOURNAL_DIR,
+                 fsync_ms: float = SESSION_JOURNAL_FSYNC_MS,
+                 snapshot_records: int = SESSION_JOURNAL_SNAPSHOT_RECORDS,
+                 snapshot_seconds: float = SESSION_JOURNAL_SNAPSHOT_SECONDS,
+                 ttl_seconds: int = SESSION_TTL_SECONDS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fsync_interval = fsync_ms / 1000
+        self.snapshot_records = snapshot_records
+        self.snapshot_seconds = snapshot_seconds
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._stopping = False
+        # Живые сессии по пространствам имен (этими словарями пользуются хранилища)
+        self.namespaces = {}
+        # Время последнего сохранения сессии: (пространство имен, ключ) → time.time()
+        self.saved_at = {}
+
+        self.replay = self._replay()
+        self.generation = self.replay['generation'] + 1
+        self._file = open(self._journal_path(self.generation), 'ab')
+        self._pending = 0
+        self._retired = []
+        self.records_since_snapshot = 0
+        self.last_snapshot_at = time.monotonic()
+
+        self.appended = 0
+        self.fsyncs = 0
+        self.fsynced_records = 0
+        self.max_fsync_ms = 0.0
+        self.snapshots = 0
+        self.last_snapshot = None
+        self.errors = 0
+
+        self._thread = threading.Thread(target=self._run, name='session-journal', daemon=True)
+        self._thread.start()
+        print(f"🗄️ Журнал сессий: {directory}, восстановлено {self.replay['sessions']} сессий "
+              f"из {self.replay['records']} записей за {self.replay['seconds'] * 1000:.0f} мс")
+
+    def _journal_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"journal-{generation:06d}.log")
+
+    def _journal_files(self) -> list:
+        """Файлы журнала: список (поколение, путь) по возрастанию."""
+        files = []
+        for name in os.listdir(self.directory):
+            if name.startswith('journal-') and name.endswith('.log'):
+                try:
+                    files.append((int(name[8:-4]), os.path.join(self.directory, name)))
+                except ValueError:
+                    continue
+        return sorted(files)
+
+    @staticmethod
+    def _encode_record(op: str, namespace: str, key: str, session=None, at: float = None) -> bytes:
+        record = {'op': op, 'ns': namespace, 'key': key, 'at': at or time.time()}
+        if session is not None:
+            record['session'] = session
+        payload = json.dumps(record, ensure_ascii=False, default=_json_default).encode('utf-8')
+        return f"{zlib.crc32(payload):08x} ".encode() + payload + b"\n"
+
+    @staticmethod
+    def _decode_record(line: bytes):
+        """Запись из строки или None, если строка повреждена (например, оборвана при сбое)."""
+        if len(line) < 10 or not line.endswith(b"\n") or line[8:9] != b" ":
+            return None
+        payload = line[9:-1]
+        try:
+            if int(line[:8], 16) != zlib.crc32(payload):
+                return None
+            return json.loads(payload.decode('utf-8'), object_hook=_json_object_hook)
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    def _apply(self, record: dict, expired_before: float):
+        sessions = self.namespaces.setdefault(record['ns'], {})
+        if record['op'] == 'save' and record['at'] >= expired_before:
+            sessions[record['key']] = record['session']
+            self.saved_at[(record['ns'], record['key'])] = record['at']
+        else:
+            sessions.pop(record['key'], None)
+            self.saved_at.pop((record['ns'], record['key']), None)
+
+    def _replay(self) -> dict:
+        """Читает снимок и журналы после него в self.namespaces."""
+        started = time.monotonic()
+        expired_before = time.time() - self.ttl_seconds
+        report = {'generation': 0, 'snapshot_records': 0, 'journal_records': 0,
+                  'journal_files': 0, 'corrupt_records': 0}
+
+        snapshot_path = os.path.join(self.directory, self.SNAPSHOT_FILE)
+        snapshot_generation = 0
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'rb') as f:
+                header = self._decode_record(f.readline())
+                if header is not None and header.get('op') == 'snapshot':
+                    snapshot_generation = header['generation']
+                    for line in f:
+                        record = self._decode_record(line)
+                        if record is None:
+                            report['corrupt_records'] += 1
+                            continue
+                        self._apply(record, expired_before)
+                        report['snapshot_records'] += 1
+                else:
+                    report['corrupt_records'] += 1
+        report['generation'] = snapshot_generation
+
+        for generation, path in self._journal_files():
+            report['generation'] = max(report['generation'], generation)
+            if generation < snapshot_generation:
+                continue
+            report['journal_files'] += 1
+            with open(path, 'rb') as f:
+                for line in f:
+                    record = self._decode_record(line)
+                    if record is None:
+                        # Оборванная при сбое строка бывает только последней
+                        report['corrupt_records'] += 1
+                        break
+                    self._apply(record, expired_before)
+                    report['journal_records'] += 1
+
+        report['records'] = report['snapshot_records'] + report['journal_records']
+        report['sessions'] = sum(len(sessions) for sessions in self.namespaces.values())
+        report['seconds'] = round(time.monotonic() - started, 3)
+        if report['corrupt_records']:
+            print(f"⚠️ Журнал сессий: пропущено поврежденных записей: {report['corrupt_records']}")
+        return report
+
+    def attach(self, namespace: str) -> dict:
+        """Словарь живых сессий пространства имен (с восстановленными сессиями)."""
+        with self._lock:
+            return self.namespaces.setdefault(namespace, {})
+
+    def items(self, namespace: str) -> list:
+        """Копия списка сессий пространства имен (словарь меняют другие потоки)."""
+        with self._lock:
+            return list(self.namespaces.get(namespace, {}).items())
+
+    def save(self, namespace: str, key: str, session):
+        """Сохраняет сессию и дописывает запись; на диск ее сбросит фоновый поток вместе с соседними."""
+        at = time.time()
+        line = self._encode_record('save', namespace, key, session, at)
+        with self._lock:
+            self.namespaces.setdefault(namespace, {})[key] = session
+            self.saved_at[(namespace, key)] = at
+            self._write(line)
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            if self.namespaces.get(namespace, {}).pop(key, None) is None:
+                return
+            self.saved_at.pop((namespace, key), None)
+            self._write(self._encode_record('delete', namespace, key))
+
+    def _write(self, line: bytes):
+        """Дописывает строку в текущий журнал (вызывать под блокировкой)."""
+        if self._closed:
+            return
+        self._file.write(line)
+        # Сразу отдаем ОС: падение процесса запись не потеряет, fsync — пачкой
+        self._file.flush()
+        self._pending += 1
+        self.appended += 1
+        self.records_since_snapshot += 1
+        if self.records_since_snapshot >= self.snapshot_records:
+            self._wakeup.set()
+
+    def _snapshot_due(self) -> bool:
+        if self.records_since_snapshot >= self.snapshot_records:
+            return True
+        return (self.records_since_snapshot > 0
+                and time.monotonic() - self.last_snapshot_at >= self.snapshot_seconds)
+
+    def compact(self):
+        """
+        Пишет снимок всех живых сессий и начинает новое поколение журнала.
+        Вызывается фоновым потоком журнала (и при остановке), а не обработчиком
+        запроса. Под блокировкой только копируется список сессий и переключается
+        файл журнала; кодирование и запись снимка идут без блокировки.
+        Сохранения, сделанные за это время, попадают в новый журнал, который
+        при старте читается поверх снимка.
+        """
+        started = time.monotonic()
+        with self._lock:
+            self.generation += 1
+            generation = self.generation
+            entries = [
+                (namespace, key, session, self.saved_at.get((namespace, key)))
+                for namespace, sessions in self.namespaces.items()
+                for key, session in sessions.items()
+            ]
+            self._retired.append(self._file)
+            self._file = open(self._journal_path(generation), 'ab')
+            self.records_since_snapshot = 0
+            self.last_snapshot_at = time.monotonic()
+        copied = time.monotonic()
+
+        header = {'op': 'snapshot', 'generation': generation, 'at': time.time()}
+        payload = json.dumps(header).encode('utf-8')
+        lines = [f"{zlib.crc32(payload):08x} ".encode() + payload + b"\n"]
+        for namespace, key, session, saved_at in entries:
+            # Время записи — время последнего сохранения: по нему считается TTL при восстановлении
+            for _ in range(SNAPSHOT_ENCODE_ATTEMPTS):
+                try:
+                    lines.append(self._encode_record('save', namespace, key, session, saved_at))
+                    break
+                except RuntimeError:
+                    # Сессию как раз меняет обработчик: пробуем еще раз
+                    continue
+            else:
+                # Без этой сессии снимок неполон: старые снимок и журналы остаются,
+                # при старте они читаются вместе с новым журналом
+                self.errors += 1
+                print(f"⚠️ Снимок журнала сессий отложен: сессия {namespace}/{key} не сериализуется")
+                return
+        encoded = time.monotonic()
+
+        path = os.path.join(self.directory, self.SNAPSHOT_FILE)
+        with open(path + '.tmp', 'wb') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        if hasattr(os, 'O_DIRECTORY'):
+            dir_fd = os.open(self.directory, os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        # Снимок на диске — журналы до него больше не нужны
+        for old_generation, old_path in self._journal_files():
+            if old_generation < generation:
+                os.remove(old_path)
+        self.snapshots += 1
+        self.last_snapshot = {
+            'generation': generation,
+            'sessions': len(lines) - 1,
+            'copy_ms': round((copied - started) * 1000, 1),
+            'encode_ms': round((encoded - copied) * 1000, 1),
+            'write_ms': round((time.monotonic() - encoded) * 1000, 1),
+        }
+
+    def _fsync_pending(self):
+        with self._lock:
+            retired, self._retired = self._retired, []
+            pending, self._pending = self._pending, 0
+            fd = os.dup(self._file.fileno()) if pending else None
+        started = time.monotonic()
+        for f in retired:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        if fd is not None:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self.fsyncs += 1
+            self.fsynced_records += pending
+            self.max_fsync_ms = max(self.max_fsync_ms, (time.monotonic() - started) * 1000)
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.fsync_interval)
+            self._wakeup.clear()
+            try:
+                self._fsync_pending()
+                if self._snapshot_due():
+                    self.compact()
+            except Exception as e:
+                self.errors += 1
+                print(f"❌ Ошибка журнала сессий: {e}")
+
+    def close(self):
+        """Делает снимок и сбрасывает все на диск (при остановке приложения)."""
+        if self._closed or self._stopping:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.compact()
+        self._fsync_pending()
+        with self._lock:
+            self._closed = True
+            self._file.close()
+
+    def stats(self) -> dict:
+        return {
+            'generation': self.generation,
+            'records_since_snapshot': self.records_since_snapshot,
+            'appended': self.appended,
+            'fsyncs': self.fsyncs,
+            'records_per_fsync': round(self.fsynced_records / self.fsyncs, 1) if self.fsyncs else None,
+            'max_fsync_ms': round(self.max_fsync_ms, 1),
+            'snapshots': self.snapshots,
+            'last_snapshot': self.last_snapshot,
+            'replay': self.replay,
+            'errors': self.errors,
+        }
+
+class JournalSessionStore(MemorySessionStore):
+    """Сессии в памяти процесса, каждое изменение дописывается в журнал."""
+
+    backend = 'journal'
+
+    def __init__(self, namespace: str, journal: SessionJournal):
+        super().__init__(namespace)
+        self.journal = journal
+        self._sessions = journal.attach(namespace)
+
+    def save(self, key: str, session: ChatSession):
+        self.journal.save(self.namespace, key, session)
+
+    def delete(self, key: str):
+        self.journal.delete(self.namespace, key)
+        with self._claims_lock:
+            self._claims.pop(key, None)
+
+    def items(self) -> list:
+        return self.journal.items(self.namespace)
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'journal': self.journal.stats()}
+
+class SQLiteDatabase:
+    """Общее соединение SQLite (WAL) для всех пространств имен процесса."""
+
+    def __init__(self, path: str, ttl_seconds: int = SESSION_TTL_SECONDS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        # WAL: читатели не блокируют писателя, несколько процессов работают с одним файлом
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_claims ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, event TEXT NOT NULL, claimed_at REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key, event))"
+        )
+        print(f"🗄️ Хранилище сессий SQLite: {path} (WAL)")
+
+    def execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE: блокировка записи берется сразу, другие процессы ждут (busy_timeout)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def claim(self, namespace: str, key: str, event: str) -> bool:
+        """Вставка строки захвата: получится только у одного процесса."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO session_claims (namespace, key, event, claimed_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, event, time.time())
+            )
+            return cursor.rowcount == 1
+
+    def expired_before(self) -> float:
+        return time.time() - self.ttl_seconds
+
+class SQLiteSessionStore(SessionStore):
+    """Сессии в таблице SQLite, общей для процессов на одной машине."""
+
+    backend = 'sqlite'
+
+    def __init__(self, namespace: str, database: SQLiteDatabase):
+        super().__init__(namespace)
+        self.db = database
+
+    def get(self, key: str):
+        rows = self.db.execute(
+            "SELECT data FROM sessions WHERE namespace = ? AND key = ? AND updated_at >= ?",
+            (self.namespace, key, self.db.expired_before())
+        )
+        return decode_session(rows[0][0]) if rows else None
+
+    def save(self, key: str, session: dict):
+        self.db.execute(
+            "INSERT OR REPLACE INTO sessions (namespace, key, data, updated_at) VALUES (?, ?, ?, ?)",
+            (self.namespace, key, encode_session(session), time.time())
+        )
+
+    def delete(self, key: str):
+        self.db.execute("DELETE FROM sessions WHERE namespace = ? AND key = ?", (self.namespace, key))
+        self.db.execute("DELETE FROM session_claims WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def update(self, key: str, apply):
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT data FROM sessions WHERE namespace = ? AND key = ? AND updated_at >= ?",
+                (self.namespace, key, self.db.expired_before())
+            ).fetchall()
+            session = apply(decode_session(rows[0][0]) if rows else None)
+            if session is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions (namespace, key, data, updated_at) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, encode_session(session), time.time())
+                )
+            return session
+
+    def claim(self, key: str, event: str) -> bool:
+        return self.db.claim(self.namespace, key, event)
+
+    def items(self) -> list:
+        # Заодно убираем сессии и захваты, которые никто не обновлял дольше TTL
+        self.db.execute("DELETE FROM sessions WHERE namespace = ? AND updated_at < ?",
+                        (self.namespace, self.db.expired_before()))
+        self.db.execute("DELETE FROM session_claims WHERE namespace = ? AND claimed_at < ?",
+                        (self.namespace, self.db.expired_before()))
+        rows = self.db.execute("SELECT key, data FROM sessions WHERE namespace = ?", (self.namespace,))
+        return [(key, decode_session(data)) for key, data in rows]
+
+    def sample(self, limit: int) -> list:
+        rows = self.db.execute(
+            "SELECT key, data FROM sessions WHERE namespace = ? AND updated_at >= ? LIMIT ?",
+            (self.namespace, self.db.expired_before(), limit)
+        )
+        return [(key, decode_session(data)) for key, data in rows]
+
+    def __len__(self) -> int:
+        rows = self.db.execute("SELECT COUNT(*) FROM sessions WHERE namespace = ? AND updated_at >= ?",
+                               (self.namespace, self.db.expired_before()))
+        return rows[0][0]
+
+class RedisError(Exception):
+    """Сервер Redis вернул ошибку."""
+
+class RedisConnection:
+    """Минимальный клиент протокола Redis (RESP2) поверх сокета."""
+
+    def __init__(self, url: str = SESSION_STORE_REDIS_URL, timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int((parsed.path or '/0').lstrip('/') or 0)
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile('rb')
+        if self.password:
+            self._call('AUTH', self.password)
+        if self.db:
+            self._call('SELECT', self.db)
+
+    def _close(self):
+        try:
+            if self._sock is not None:
+                self._sock.close()
+        finally:
+            self._sock = None
+            self._reader = None
+
+    @staticmethod
+    def _encode(args: tuple) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis закрыл соединение")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(payload)
+            if count < 0:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise RedisError(f"неизвестный ответ Redis: {line!r}")
+
+    def _call(self, *args):
+        self._sock.sendall(self._encode(args))
+        return self._read_reply()
+
+    def call(self, *args):
+        """Выполняет команду; при обрыве соединения переподключается один раз."""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._call(*args)
+                except (ConnectionError, OSError) as e:
+                    self._close()
+                    if attempt == 1:
+                        raise ConnectionError(f"Redis {self.host}:{self.port} недоступен: {e}")
+
+    def watch(self, key: str, build, attempts: int = REDIS_WATCH_ATTEMPTS):
+        """
+        Оптимистичная транзакция над одним ключом: WATCH, GET, команды из
+        build(текущее значение) в MULTI/EXEC. Если ключ изменил кто-то еще
+        между GET и EXEC, EXEC возвращает nil и все повторяется заново.
+        """
+        with self._lock:
+            reconnected = False
+            for _ in range(attempts):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._call('WATCH', key)
+                    commands = build(self._call('GET', key))
+                    if not commands:
+                        self._call('UNWATCH')
+                        return
+                    self._call('MULTI')
+                    for command in commands:
+                        self._call(*command)
+                    if self._call('EXEC') is not None:
+                        return
+                except (ConnectionError, OSError) as e:
+                    self._close()
+                    if reconnected:
+                        raise ConnectionError(f"Redis {self.host}:{self.port} недоступен: {e}")
+                    reconnected = True
+                except RedisError:
+                    # Соединение могло остаться внутри MULTI: начинаем с чистого
+                    self._close()
+                    raise
+            raise RedisError(f"ключ {key} меняется слишком часто: транзакция не прошла за {attempts} попыток")
+
+class RedisSessionStore(SessionStore):
+    """Сессии в Redis: ключ на сессию, время жизни через EX."""
+
+    backend = 'redis'
+
+    def __init__(self, namespace: str, connection: RedisConnection, ttl_seconds: int = SESSION_TTL_SECONDS):
+        super().__init__(namespace)
+        self.redis = connection
+        self.ttl_seconds = ttl_seconds
+        self.prefix = f"{REDIS_KEY_PREFIX}:{namespace}:"
+
+    def get(self, key: str):
+        raw = self.redis.call('GET', self.prefix + key)
+        return decode_session(raw) if raw is not None else None
+
+    def save(self, key: str, session: dict):
+        self.redis.call('SET', self.prefix + key, encode_session(session), 'EX', self.ttl_seconds)
+
+    def delete(self, key: str):
+        self.redis.call('DEL', self.prefix + key)
+
+    def update(self, key: str, apply):
+        full_key = self.prefix + key
+        session = None
+
+        def build(raw):
+            nonlocal session
+            session = apply(decode_session(raw) if raw is not None else None)
+            if session is None:
+                return []
+            return [('SET', full_key, encode_session(session), 'EX', self.ttl_seconds)]
+
+        self.redis.watch(full_key, build)
+        return session
+
+    def claim(self, key: str, event: str) -> bool:
+        # SET NX: ключ создаст только один процесс, живет столько же, сколько сессия
+        claim_key = f"{REDIS_CLAIM_PREFIX}:{self.namespace}:{key}:{event}"
+        return self.redis.call('SET', claim_key, '1', 'NX', 'EX', self.ttl_seconds) is not None
+
+    def _keys(self, limit: int = None) -> list:
+        keys = []
+        cursor = b'0'
+        while True:
+            cursor, batch = self.redis.call('SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 500)
+            keys.extend(batch)
+            if limit is not None and len(keys) >= limit:
+                return keys[:limit]
+            if cursor in (b'0', '0', 0):
+                return keys
+
+    def sample(self, limit: int) -> list:
+        return self.items(self._keys(limit))
+
+    def items(self, keys: list = None) -> list:
+        keys = self._keys() if keys is None else keys
+        if not keys:
+            return []
+        values = self.redis.call('MGET', *keys)
+        return [
+            (key.decode('utf-8')[len(self.prefix):], decode_session(raw))
+            for key, raw in zip(keys, values) if raw is not None
+        ]
+
+    def __len__(self) -> int:
+        return len(self._keys())
+
+# Соединения общие для всех пространств имен процесса
+_stores = {}
+_shared = {}
+_stores_lock = threading.Lock()
+
+def get_session_store(namespace: str) -> SessionStore:
+    """Хранилище сессий пространства имен по SESSION_STORE (создается один раз)."""
+    with _stores_lock:
+        store = _stores.get(namespace)
+        if store is not None:
+            return store
+
+        if SESSION_STORE == 'journal':
+            if 'journal' not in _shared:
+                _shared['journal'] = SessionJournal(SESSION_JOURNAL_DIR)
+            store = JournalSessionStore(namespace, _shared['journal'])
+        elif SESSION_STORE == 'sqlite':
+            if 'sqlite' not in _shared:
+                _shared['sqlite'] = SQLiteDatabase(SESSION_STORE_PATH)
+            store = SQLiteSessionStore(namespace, _shared['sqlite'])
+        elif SESSION_STORE == 'redis':
+            if 'redis' not in _shared:
+                _shared['redis'] = RedisConnection(SESSION_STORE_REDIS_URL)
+                print(f"🗄️ Хранилище сессий Redis: {_shared['redis'].host}:{_shared['redis'].port}")
+            store = RedisSessionStore(namespace, _shared['redis'])
+        else:
+            if SESSION_STORE != 'memory':
+                print(f"⚠️ Неизвестный SESSION_STORE={SESSION_STORE}, сессии хранятся в памяти")
+            store = MemorySessionStore(namespace)
+
+        _stores[namespace] = store
+        return store
+
+def close_session_stores():
+    """Сбрасывает на диск то, что еще не сброшено (при остановке приложения)."""
+    with _stores_lock:
+        if 'journal' in _shared:
+            _shared['journal'].close()
@@ -2,6 +2,23 @@
     if (window.__GLADIS_CHAT_LOADED) return;
     window.__GLADIS_CHAT_LOADED = true;
     
+    // Токен сессии выдает сервер; храним его, чтобы диалог продолжался между страницами
+    const SESSION_STORAGE_KEY = 'gladis_chat_session_id';
+    let sessionId = null;
+    try {
+        sessionId = window.localStorage.getItem(SESSION_STORAGE_KEY);
+    } catch (e) {
+        // localStorage недоступен (приватный режим, запрет cookies) - токен живет до перезагрузки
+    }
+    
+    function saveSessionId(newSessionId) {
+        if (!newSessionId || newSessionId === sessionId) return;
+        sessionId = newSessionId;
+        try {
+            window.localStorage.setItem(SESSION_STORAGE_KEY, newSessionId);
+        } catch (e) {}
+    }
+    
     // Ждем полной загрузки страницы, включая все скрипты
     function initWhenReady() {
         // Даем время сайту загрузить свои скрипты (даже если они с ошибками)
@@ -268,28 +285,97 @@
             
             try {
                 const API_URL = window.GLADIS_BOT_URL || "https://gladis-bot.onrender.com/chat";
+                const STREAM_URL = window.GLADIS_BOT_STREAM_URL || API_URL + "/stream";
                 
-                const res = await fetch(API_URL, {
-                    method: "POST",
-                    headers: { "Content-Type": "application/json" },
-                    body: JSON.stringify({ message })
-                });
+                const replyId = 'reply-' + Date.now();
+                let streamedText = '';
                 
-                const data = await res.json();
+                // Создаем пузырь ответа вместо индикатора загрузки
+                // (ищем по id: innerHTML += пересоздает элементы чата)
+                function ensureReplyBubble() {
+                    const existing = document.getElementById(replyId);
+                    if (existing) return existing;
+                    
+                    const loadingEl = document.getElementById(loadingId);
+                    if (loadingEl) loadingEl.remove();
+                    
+                    chatArea.innerHTML += `
+                        <div style="margin-bottom: 10px;">
+                            <div style="font-weight: bold; color: #27ae60; margin-bottom: 5px;">GLADIS Бот</div>
+                            <div id="${replyId}" style="background: #e8f5e9; padding: 10px 15px; border-radius: 15px 15px 15px 5px; max-width: 80%;"></div>
+                        </div>
+                    `;
+                    return document.getElementById(replyId);
+                }
                 
-                // Убираем индикатор
-                const loadingEl = document.getElementById(loadingId);
-                if (loadingEl) loadingEl.remove();
+                function renderReply(text) {
+                    ensureReplyBubble().innerHTML = escapeHtml(text).replace(/\n/g, '<br>');
+                    chatArea.scrollTop = chatArea.scrollHeight;
+                }
                 
-                // Показываем ответ
-                chatArea.innerHTML += `
-                    <div style="margin-bottom: 10px;">
-                        <div style="font-weight: bold; color: #27ae60; margin-bottom: 5px;">GLADIS Бот</div>
-                        <div style="background: #e8f5e9; padding: 10px 15px; border-radius: 15px 15px 15px 5px; max-width: 80%;">
-                            ${escapeHtml(data.reply).replace(/\n/g, '<br>')}
-                        </div>
-                    </div>
-                `;
+                // Разбирает одно событие server-sent events
+                function handleEvent(rawEvent) {
+                    let eventName = 'message';
+                    let dataLines = [];
+                    rawEvent.split('\n').forEach((line) => {
+                        if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                    });
+                    if (!dataLines.length) return false;
+                    
+                    const payload = JSON.parse(dataLines.join('\n'));
+                    if (eventName === 'token') {
+                        streamedText += payload.text;
+                        renderReply(streamedText);
+                    } else if (eventName === 'done') {
+                        saveSessionId(payload.session_id);
+                        renderReply(payload.reply);
+                        return true;
+                    }
+                    return false;
+                }
+                
+                let finished = false;
+                const streamRes = window.ReadableStream && window.TextDecoder ? await fetch(STREAM_URL, {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json", "Accept": "text/event-stream" },
+                    body: JSON.stringify({ message, session_id: sessionId })
+                }).catch(() => null) : null;
+                
+                if (streamRes && streamRes.ok && streamRes.body) {
+                    // Показываем токены по мере генерации
+                    const reader = streamRes.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
+                    
+                    while (!finished) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+                        buffer += decoder.decode(value, { stream: true });
+                        
+                        let boundary;
+                        while (!finished && (boundary = buffer.indexOf('\n\n')) !== -1) {
+                            const rawEvent = buffer.slice(0, boundary);
+                            buffer = buffer.slice(boundary + 2);
+                            finished = handleEvent(rawEvent);
+                        }
+                    }
+                    
+                    if (!finished && !streamedText) {
+                        throw new Error('Empty stream');
+                    }
+                } else {
+                    // Стриминг недоступен - обычный запрос
+                    const res = await fetch(API_URL, {
+                        method: "POST",
+                        headers: { "Content-Type": "application/json" },
+                        body: JSON.stringify({ message, session_id: sessionId })
+                    });
+                    
+                    const data = await res.json();
+                    saveSessionId(data.session_id);
+                    renderReply(data.reply);
+                }
                 
             } catch (error) {
                 console.error('Chat error:', error);
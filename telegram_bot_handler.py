@@ -10,288 +10,158 @@ import asyncio
 import requests
 import re
 from typing import Dict, Any
-from datetime import datetime, timedelta
 
-# Хранилище сессий для Telegram пользователей
-telegram_sessions = {}
+from llm_client import LLM_REPLY_TIMEOUT, LLM_EXTRACT_TIMEOUT, is_llm_configured
+from keywords import PROCEDURE_WORDS, NOT_NAME_WORDS, PROCEDURE_KEYWORDS
+from text_normalizer import normalize_message
+from local_classifier import LOCAL_CLASSIFIER_THRESHOLD
+from name_recognizer import is_known_name
+from chat_session import new_telegram_session
+from session_store import get_session_store
+from session_scheduler import session_scheduler, INCOMPLETE_LEAD
+from session_history import append_message, render_transcript, mark_procedures, session_revision, mark_incomplete_sent
+
+# Хранилище сессий для Telegram пользователей (session_store.py)
+telegram_sessions = get_session_store('telegram')
 
 def get_bot_token():
     """Возвращает токен бота"""
     return os.getenv("TELEGRAM_BOT_TOKEN", "")
 
-async def cleanup_old_telegram_sessions():
-    """Очистка старых Telegram сессий (аналог cleanup_old_sessions из main.py)"""
-    try:
-        now = datetime.now()
-        to_delete = []
-        
-        for session_id, session_data in list(telegram_sessions.items()):
-            session_age = now - session_data['created_at']
-            
-            # ТАЙМАУТ 10 минут: отправляем неполную заявку если есть контакты
-            if (session_age > timedelta(minutes=10) and 
-                not session_data.get('telegram_sent', False) and 
-                session_data.get('phone') and 
-                session_data.get('name')):
-                
-                print(f"⏰ ТАЙМАУТ 10 минут (Telegram): отправляем неполную заявку")
-                
-                full_text = "\n".join(session_data.get('text_parts', []))
-                source = "Telegram (личка @gladisSochi)" if session_data.get('is_business') else "Telegram (личка боту)"
-                
-                # Отправляем неполную заявку
-                from telegram_utils import send_incomplete_to_telegram
-                
-                await asyncio.to_thread(
-                    send_incomplete_to_telegram,
-                    f"📱 ИСТОЧНИК: {source}\n\n{full_text}",
-                    session_data.get('name'),
-                    session_data.get('phone'),
-                    session_data.get('last_procedure')
-                )
-                session_data['telegram_sent'] = True
-                session_data['incomplete_sent'] = True
-            
-            # Удаляем сессии старше 2 часов
-            if session_age > timedelta(hours=2):
-                to_delete.append(session_id)
-        
-        for session_id in to_delete:
-            del telegram_sessions[session_id]
-            
-        if to_delete:
-            print(f"🧹 Очищено {len(to_delete)} старых Telegram сессий")
-            
-    except Exception as e:
-        print(f"❌ Ошибка при очистке Telegram сессий: {e}")
+async def send_incomplete_telegram_lead(session_key: str):
+    """Срок неполной заявки (планировщик сессий): контакты есть, а заявка так и не ушла."""
+    session_data = telegram_sessions.get(session_key)
+    if (not session_data or session_data.get('telegram_sent', False) or
+            not (session_data.get('phone') and session_data.get('name'))):
+        return
+    # Сроки ставит планировщик каждого воркера: отправляет тот, кто первым захватил событие
+    if not telegram_sessions.claim(session_key, INCOMPLETE_LEAD):
+        return
+    
+    print(f"⏰ ТАЙМАУТ 10 минут (Telegram): отправляем неполную заявку")
+    
+    full_text = render_transcript(session_data)
+    source = "Telegram (личка @gladisSochi)" if session_data.get('is_business') else "Telegram (личка боту)"
+    
+    # Отправляем неполную заявку
+    from telegram_utils import send_incomplete_to_telegram
+    
+    await asyncio.to_thread(
+        send_incomplete_to_telegram,
+        f"📱 ИСТОЧНИК: {source}\n\n{full_text}",
+        session_data.get('name'),
+        session_data.get('phone'),
+        session_data.get('last_procedure')
+    )
+    # Флаги ставим на свежей копии: обработчик сообщения мог сохранить сессию, пока шла отправка
+    telegram_sessions.update(session_key, mark_incomplete_sent)
 
-async def periodic_cleanup():
-    """Запускает очистку сессий каждые 5 минут"""
-    while True:
-        try:
-            await asyncio.sleep(300)  # 5 минут
-            await cleanup_old_telegram_sessions()
-        except asyncio.CancelledError:
-            break
-        except Exception as e:
-            print(f"❌ Ошибка в periodic_cleanup: {e}")
+async def expire_telegram_session(session_key: str):
+    """Срок жизни Telegram сессии истек (планировщик сессий)."""
+    telegram_sessions.delete(session_key)
+    print(f"🧹 Telegram сессия {session_key} удалена (старше 2 часов)")
+
+session_scheduler.register('telegram', telegram_sessions, send_incomplete_telegram_lead, expire_telegram_session)
 
 async def extract_contacts_from_message_ai(message: str, session: Dict[str, Any], api_key: str):
     """Извлекает контакты и определяет процедуру с использованием AI"""
+    message = normalize_message(message)
     try:
-        message_lower = message.lower()
-        
-        # ===== ПОИСК ТЕЛЕФОНА (регулярками) =====
-        phone_patterns = [
-            r'\b8[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}\b',
-            r'\b\+7[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}\b',
-            r'\b7[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}\b',
-        ]
+        # ===== ПОИСК ТЕЛЕФОНА (phone_parser) =====
+        phone, phone_position = message.phone
         
-        phone_matches = []
-        for pattern in phone_patterns:
-            matches = re.findall(pattern, message)
-            if matches:
-                phone_matches.extend(matches)
-                break
-        
-        if phone_matches and not session['phone']:
-            raw_phone = phone_matches[0]
-            clean_phone = re.sub(r'\D', '', raw_phone)
-            
-            if len(clean_phone) == 10:
-                clean_phone = '7' + clean_phone
-            elif len(clean_phone) == 11 and clean_phone.startswith('8'):
-                clean_phone = '7' + clean_phone[1:]
-            
-            if 10 <= len(clean_phone) <= 11:
-                session['phone'] = clean_phone
-                print(f"📞 Найден телефон: {raw_phone} → {session['phone']}")
+        if phone and not session['phone']:
+            session['phone'] = phone
+            print(f"📞 Найден телефон: {session['phone']}")
         
         # ===== ПОИСК ИМЕНИ (сначала регулярками, потом AI) =====
         temp_name = None
         
         russian_names = re.findall(r'\b[А-ЯЁ][а-яё]{1,20}\b', message)
         
-        common_russian_names = [
-            'анна', 'мария', 'елена', 'ольга', 'наталья', 'ирина', 'светлана',
-            'александра', 'татьяна', 'юлия', 'евгения', 'дарья', 'екатерина',
-            'виктория', 'иван', 'алексей', 'сергей', 'андрей', 'дмитрий', 'михаил',
-            'владимир', 'павел', 'максим', 'николай', 'евгений', 'артем', 'антон',
-            'вадим', 'рома', 'кирилл', 'игорь', 'вадим'
-        ]
-        
         for name in russian_names:
             name_lower = name.lower()
             
-            procedure_words = ['ботокс', 'эпиляция', 'лазер', 'коллаген', 
-                             'чистка', 'пилинг', 'смас', 'морфиус', 'александрит',
-                             'перманент', 'биоревитализация', 'инъекция', 'мезотерапия']
-            
-            is_procedure = any(proc in name_lower for proc in procedure_words)
-            is_common_name = name_lower in common_russian_names
-            is_near_phone = phone_matches and (abs(message.find(name) - message.find(phone_matches[0])) < 30)
+            is_procedure = any(proc in name_lower for proc in PROCEDURE_WORDS)
+            is_common_name = is_known_name(name_lower)
+            is_near_phone = phone is not None and abs(message.find(name) - phone_position) < 30
             
             if (is_common_name and not is_procedure) or (is_near_phone and not is_procedure):
                 temp_name = name
                 print(f"👤 Найдено возможное имя в сообщении: {temp_name}")
                 break
         
-        if temp_name and temp_name.lower() not in ['привет', 'здравствуйте', 'добрый', 'пока', 'спасибо']:
+        if temp_name and temp_name.lower() not in NOT_NAME_WORDS:
             session['name'] = temp_name
             print(f"✅ Обновлено имя в сессии: {session['name']}")
         
-        # ===== AI ДЛЯ ИМЕНИ (если не нашли регулярками) =====
-        if (not session['name'] or session['name'].lower() in ['привет', 'здравствуйте', 'добрый']) and api_key and len(message.strip()) > 3:
-            try:
-                print(f"🔍 Использую AI для поиска имени в: '{message[:30]}...'")
-                from chatbot_logic import extract_name_with_ai
-                
-                found_name = await asyncio.to_thread(
-                    extract_name_with_ai,
-                    api_key,
-                    message
-                )
-                
-                if found_name and found_name.lower() not in ['привет', 'здравствуйте', 'добрый']:
-                    session['name'] = found_name
-                    print(f"✅ AI определил/исправил имя: {session['name']}")
-            except Exception as e:
-                print(f"⚠️ Ошибка AI при извлечении имени: {e}")
-        
-        # ===== AI ДЛЯ ОПРЕДЕЛЕНИЯ ПРОЦЕДУРЫ =====
-        if api_key and len(message.strip()) > 3:
-            try:
-                print(f"🔍 Использую AI для определения процедуры в: '{message[:30]}...'")
-                
-                # Создаем промпт для определения процедуры
-                procedure_prompt = f"""Определи, о какой косметологической процедуре идет речь в сообщении клиента.
-                
-Сообщение: "{message}"
-
-Выбери ОДНУ наиболее подходящую категорию из списка:
-- лазерная эпиляция (удаление волос лазером, эпиляция)
-- чистка лица (чистка, пилинг, акне, поры)
-- ботулотоксин (ботокс, морщины, уколы от морщин)
-- лифтинг (подтяжка, смас, морфиус, ультера)
-- биоревитализация (увлажнение, гиалуроновая кислота)
-- капельницы (инфузии, витамины, детокс)
-- фотоомоложение (пигментные пятна, веснушки, люмекка)
-- мезотерапия (инъекции, уколы для кожи)
-- перманентный макияж (татуаж, брови, губы)
-- удаление тату (удаление татуировок, татуажа)
-- прокол ушей (пирсинг, сережки)
-- другое (если не подходит ни одна категория)
-
-Верни ТОЛЬКО название категории из списка выше, ничего больше."""
-
-                # Используем тот же AI, что и для имени
-                from chatbot_logic import extract_name_with_ai
-                
-                detected_procedure = await asyncio.to_thread(
-                    extract_name_with_ai,
-                    api_key,
-                    procedure_prompt
-                )
-                
-                # Проверяем, что полученный результат - допустимая процедура
-                valid_procedures = [
-                    'лазерная эпиляция', 'чистка лица', 'ботулотоксин', 
-                    'лифтинг', 'биоревитализация', 'капельницы', 
-                    'фотоомоложение', 'мезотерапия', 'перманентный макияж',
-                    'удаление тату', 'прокол ушей'
-                ]
-                
-                # Расширенный список ключевых слов для процедур
-                procedure_keywords_map = {
-                    'капельницы': ['капельниц', 'иммуносуппорт', 'детокс', 'витамин', 'инфузи', 'лаеннек'],
-                    'лазерная эпиляция': ['эпиляция', 'лазер', 'удаление волос', 'бикини', 'подмышки', 'ноги'],
-                    'чистка лица': ['чистка', 'пилинг', 'акне', 'поры'],
-                    'ботулотоксин': ['ботокс', 'ботулин', 'морщины'],
-                    'лифтинг': ['лифтинг', 'подтяжка', 'смас', 'морфиус', 'ультера'],
-                    'биоревитализация': ['биоревитализация', 'гиалуроновая', 'профхайло'],
-                    'фотоомоложение': ['фотоомоложение', 'люмекка', 'пигмент', 'пятна'],
-                    'мезотерапия': ['мезотерапия', 'инъекции', 'уколы'],
-                    'перманентный макияж': ['перманент', 'татуаж', 'брови', 'губы'],
-                    'удаление тату': ['удаление тату', 'татуировка'],
-                    'прокол ушей': ['прокол', 'уши', 'пирсинг']
-                }
-                
-                # Сначала проверяем результат AI
-                if detected_procedure and detected_procedure.lower() in [p.lower() for p in valid_procedures]:
-                    # Находим правильное название с учетом регистра
-                    for valid_proc in valid_procedures:
-                        if valid_proc.lower() == detected_procedure.lower():
-                            session['last_procedure'] = valid_proc
-                            print(f"✅ AI определил процедуру: {session['last_procedure']}")
-                            break
-                elif detected_procedure and detected_procedure.lower() != 'другое':
-                    # Если AI вернул что-то другое, но похожее на процедуру
-                    print(f"🤔 AI вернул: {detected_procedure}, ищем совпадения...")
+        # ===== AI: ИМЯ, ПРОЦЕДУРА И НАМЕРЕНИЕ ОДНИМ ВЫЗОВОМ =====
+        if is_llm_configured(api_key) and len(message.strip()) > 3:
+            # Намерение определяется заново для каждого сообщения
+            session['ai_intent'] = False
+            
+            # Сначала словарь имен и классификатор процедур: если оба уверены, AI не нужен
+            from chatbot_logic import detect_procedure_locally
+            
+            needs_name = not session['name'] or session['name'].lower() in ['привет', 'здравствуйте', 'добрый']
+            local_name, name_confidence = message.name if needs_name else (None, 1.0)
+            local_procedure, procedure_confidence = detect_procedure_locally(message)
+            
+            if name_confidence >= LOCAL_CLASSIFIER_THRESHOLD and procedure_confidence >= LOCAL_CLASSIFIER_THRESHOLD:
+                print(f"🧠 Локальный классификатор уверен (имя {name_confidence:.2f}, процедура {procedure_confidence:.2f}), AI не нужен")
+                if local_name:
+                    session['name'] = local_name
+                    print(f"✅ Имя найдено по словарю: {session['name']}")
+                if local_procedure:
+                    session['last_procedure'] = local_procedure
+                    print(f"✅ Локальный классификатор определил процедуру: {session['last_procedure']}")
+            else:
+                try:
+                    print(f"🔍 Использую AI для анализа сообщения: '{message[:30]}...'")
+                    from chatbot_logic import extract_client_info_with_ai_async
                     
-                    # Ищем частичное совпадение
-                    for valid_proc in valid_procedures:
-                        if any(word in detected_procedure.lower() for word in valid_proc.lower().split()):
-                            session['last_procedure'] = valid_proc
-                            print(f"✅ Найдено частичное совпадение: {session['last_procedure']}")
-                            break
-                
-                # Если AI не определил процедуру, проверяем по ключевым словам
-                if not session.get('last_procedure'):
-                    message_lower = message.lower()
-                    for proc_name, keywords in procedure_keywords_map.items():
-                        if any(keyword in message_lower for keyword in keywords):
-                            session['last_procedure'] = proc_name
-                            print(f"📋 Процедура определена по ключевым словам: {proc_name}")
-                            break
-                            
-            except Exception as e:
-                print(f"⚠️ Ошибка AI при определении процедуры: {e}")
-                
-                # Fallback: используем ключевые слова если AI не сработал
-                procedure_keywords = {
-                    'лазерная эпиляция': ['эпиляция', 'лазер', 'удаление волос', 'бикини', 'подмышки', 'ноги', 'александрит'],
-                    'чистка лица': ['чистка', 'пилинг', 'акне', 'поры'],
-                    'ботулотоксин': ['ботокс', 'ботулин', 'морщины'],
-                    'лифтинг': ['лифтинг', 'подтяжка', 'смас', 'морфиус'],
-                    'биоревитализация': ['биоревитализация', 'гиалуроновая'],
-                    'капельницы': ['капельниц', 'детокс', 'витамин'],
-                    'фотоомоложение': ['пигмент', 'пятн', 'веснушк', 'люмекка'],
-                    'мезотерапия': ['мезотерапия', 'инъекци', 'укол'],
-                    'перманентный макияж': ['перманент', 'татуаж', 'брови', 'губы'],
-                    'удаление тату': ['тату', 'татуировк'],
-                    'прокол ушей': ['прокол', 'ухо', 'уши']
-                }
-                
-                message_lower = message.lower()
-                for procedure_type, keywords in procedure_keywords.items():
-                    if any(keyword in message_lower for keyword in keywords):
-                        session['last_procedure'] = procedure_type
-                        print(f"📋 Fallback: определена процедура по ключевым словам: {procedure_type}")
-                        break
-        
-        # ===== ОПРЕДЕЛЕНИЕ ПРОЦЕДУРЫ ПО КЛЮЧЕВЫМ СЛОВАМ (если AI не использовался) =====
-        elif not api_key and not session.get('last_procedure'):
-            procedure_keywords = {
-                'лазерная эпиляция': ['эпиляция', 'лазер', 'удаление волос', 'бикини', 'подмышки', 'ноги', 'александрит'],
-                'чистка лица': ['чистка', 'пилинг', 'акне', 'поры'],
-                'ботулотоксин': ['ботокс', 'ботулин', 'морщины'],
-                'лифтинг': ['лифтинг', 'подтяжка', 'смас', 'морфиус'],
-                'биоревитализация': ['биоревитализация', 'гиалуроновая'],
-                'капельницы': ['капельниц', 'детокс', 'витамин'],
-                'фотоомоложение': ['пигмент', 'пятн', 'веснушк', 'люмекка'],
-                'мезотерапия': ['мезотерапия', 'инъекци', 'укол'],
-                'перманентный макияж': ['перманент', 'татуаж', 'брови', 'губы'],
-                'удаление тату': ['тату', 'татуировк'],
-                'прокол ушей': ['прокол', 'ухо', 'уши']
-            }
+                    info = await asyncio.wait_for(
+                        extract_client_info_with_ai_async(api_key, message),
+                        timeout=LLM_EXTRACT_TIMEOUT
+                    )
+                    
+                    # Имя берем из AI, только если не нашли регулярками
+                    found_name = info.get('name')
+                    if needs_name and found_name and found_name.lower() not in ['привет', 'здравствуйте', 'добрый']:
+                        session['name'] = found_name
+                        print(f"✅ AI определил/исправил имя: {session['name']}")
+                    
+                    # Процедура уже проверена по списку допустимых
+                    if info.get('procedure'):
+                        session['last_procedure'] = info['procedure']
+                        print(f"✅ AI определил процедуру: {session['last_procedure']}")
+                    
+                    session['ai_intent'] = info.get('intent', False)
+                    if session['ai_intent']:
+                        print(f"✅ AI определил намерение записаться")
+                    
+                except asyncio.TimeoutError:
+                    print(f"⚠️ Таймаут AI при анализе сообщения ({LLM_EXTRACT_TIMEOUT:.0f} сек)")
+                except Exception as e:
+                    print(f"⚠️ Ошибка AI при анализе сообщения: {e}")
             
-            message_lower = message.lower()
-            for procedure_type, keywords in procedure_keywords.items():
-                if any(keyword in message_lower for keyword in keywords):
-                    session['last_procedure'] = procedure_type
-                    print(f"📋 Определена процедура по ключевым словам: {procedure_type}")
-                    break
+            # Если AI не определил процедуру, проверяем по ключевым словам
+            if not session.get('last_procedure'):
+                proc_name = message.keywords.first('procedure')
+                if proc_name:
+                    session['last_procedure'] = proc_name
+                    print(f"📋 Процедура определена по ключевым словам: {proc_name}")
+                else:
+                    if local_procedure and procedure_confidence >= LOCAL_CLASSIFIER_THRESHOLD:
+                        session['last_procedure'] = local_procedure
+                        print(f"🧠 Процедура определена локальным классификатором: {local_procedure} ({procedure_confidence:.2f})")
+
+        # ===== ОПРЕДЕЛЕНИЕ ПРОЦЕДУРЫ ПО КЛЮЧЕВЫМ СЛОВАМ (если AI не использовался) =====
+        elif not is_llm_configured(api_key) and not session.get('last_procedure'):
+            procedure_type = message.keywords.first('procedure')
+            if procedure_type:
+                session['last_procedure'] = procedure_type
+                print(f"📋 Определена процедура по ключевым словам: {procedure_type}")
                 
     except Exception as e:
         print(f"❌ Ошибка в extract_contacts_from_message_ai: {e}")
@@ -343,6 +213,9 @@ async def handle_telegram_update(update: Dict[str, Any]):
         if text.startswith('/'):
             return
         
+        # Сообщение нормализуется один раз и дальше передается всем обработчикам
+        text = normalize_message(text)
+        
         print(f"\n📱 ВХОДЯЩЕЕ СООБЩЕНИЕ В TELEGRAM")
         print(f"   Тип: {'Бизнес (личка @gladisSochi)' if is_business else 'Личка боту'}")
         print(f"   От: {username} (ID: {user_id})")
@@ -350,25 +223,18 @@ async def handle_telegram_update(update: Dict[str, Any]):
         
         # Получаем или создаем сессию
         session_key = f"tg_{user_id}"
-        if session_key not in telegram_sessions:
-            telegram_sessions[session_key] = {
-                'created_at': datetime.now(),
-                'name': None,
-                'phone': None,
-                'text_parts': [],
-                'message_count': 0,
-                'last_procedure': None,
-                'telegram_chat_id': chat_id,
-                'telegram_user_id': user_id,
-                'is_business': is_business,
-                'business_connection_id': None,
-                'telegram_sent': False,
-                'incomplete_sent': False
-            }
+        session = telegram_sessions.get(session_key)
+        if session is None:
+            session = new_telegram_session(chat_id, user_id, is_business)
+        revision = session_revision(session)
         
-        session = telegram_sessions[session_key]
-        session['text_parts'].append(text)
+        # История до текущего сообщения — для промпта ответа
+        history = session['memory'].render()
+        session['memory'].add_client(str(text))
+        append_message(session, str(text))
         session['message_count'] += 1
+        # Процедуры в истории отмечаем по новому сообщению, а не по всей истории
+        mark_procedures(session, text, 'procedure', 'history_procedures')
 
         # Сохраняем business_connection_id если это бизнес-сообщение
         if is_business:
@@ -379,9 +245,9 @@ async def handle_telegram_update(update: Dict[str, Any]):
         await extract_contacts_from_message_ai(text, session, api_key)
         
         # Генерируем ответ через AI
-        from chatbot_logic import generate_bot_reply
+        from chatbot_logic import generate_bot_reply_async, get_ai_error_fallback
         
-        if not api_key:
+        if not is_llm_configured(api_key):
             reply = "Здравствуйте! Клиника GLADIS. Чем могу помочь?"
         else:
             is_first = session['message_count'] == 1
@@ -390,17 +256,26 @@ async def handle_telegram_update(update: Dict[str, Any]):
             telegram_sent = False
             last_procedure = session.get('last_procedure')
             
-            # Генерируем ответ (в отдельном потоке)
-            reply = await asyncio.to_thread(
-                generate_bot_reply,
-                api_key,
-                text,
-                is_first,
-                has_name,
-                has_phone,
-                telegram_sent,
-                last_procedure
-            )
+            # Генерируем ответ (по таймауту запрос к модели отменяется)
+            try:
+                reply = await asyncio.wait_for(
+                    generate_bot_reply_async(
+                        api_key,
+                        text,
+                        is_first,
+                        has_name,
+                        has_phone,
+                        telegram_sent,
+                        last_procedure,
+                        history
+                    ),
+                    timeout=LLM_REPLY_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                print(f"⚠️ Таймаут AI ({LLM_REPLY_TIMEOUT:.0f} сек), используем fallback")
+                reply = get_ai_error_fallback(text, telegram_sent, last_procedure)
+        
+        session['memory'].add_bot(reply)
         
         # Отправляем ответ
         business_id = session.get('business_connection_id') if is_business else None
@@ -408,43 +283,29 @@ async def handle_telegram_update(update: Dict[str, Any]):
         
         # Проверяем, нужно ли отправить заявку
         if session['name'] and session['phone'] and not session.get('telegram_sent', False):
-            message_lower = text.lower()
-            
             # Расширенный список слов, указывающих на намерение записаться
-            explicit_intent = any(word in message_lower for word in [
-                'запис', 'хочу', 'нужно', 'можно', 'готов', 'давайте', 
-                'интересует', 'завтра', 'сегодня', 'после', 'да', 'ок',
-                'хорошо', 'согласен', 'давай', 'запишите'
-            ])
-            
-            # Проверяем всю историю сообщений на наличие процедуры
-            full_history = " ".join(session.get('text_parts', [])).lower()
+            explicit_intent = text.keywords.has('telegram_booking_intent') or session.get('ai_intent', False)
             
-            # Словарь процедур для проверки
-            procedure_check = {
-                'капельницы': ['капельниц', 'иммуносуппорт', 'детокс', 'витамин'],
-                'лазерная эпиляция': ['эпиляция', 'лазер', 'бикини', 'подмышки', 'ноги'],
-                'чистка лица': ['чистка', 'пилинг', 'акне', 'поры'],
-                'ботулотоксин': ['ботокс', 'ботулин', 'морщины'],
-                'перманентный макияж': ['перманент', 'татуаж', 'брови', 'губы']
-            }
-            
-            # Определяем, есть ли процедура в истории
+            # Определяем, есть ли процедура в истории (отмечена по мере поступления сообщений)
             procedure_in_history = False
             detected_procedure = session.get('last_procedure')
             
             if not detected_procedure:
-                for proc_name, keywords in procedure_check.items():
-                    if any(keyword in full_history for keyword in keywords):
-                        detected_procedure = proc_name
-                        procedure_in_history = True
-                        print(f"📋 Процедура найдена в истории: {proc_name}")
-                        break
+                mentioned = session.get('history_procedures', [])
+                proc_name = next((name for name in PROCEDURE_KEYWORDS if name in mentioned), None)
+                if proc_name:
+                    detected_procedure = proc_name
+                    procedure_in_history = True
+                    print(f"📋 Процедура найдена в истории: {proc_name}")
             
             procedure_mentioned = session.get('last_procedure') is not None or procedure_in_history
             
             # Отправляем заявку если есть контакты И (намерение записаться ИЛИ процедура упоминалась)
-            if explicit_intent and procedure_mentioned:
+            if explicit_intent and procedure_mentioned and telegram_sessions.lead_sent(session_key):
+                # Пока ждали модель, заявку отправил другой воркер (или неполную — планировщик)
+                print(f"ℹ️  Заявка по сессии уже отправлена")
+                session['telegram_sent'] = True
+            elif explicit_intent and procedure_mentioned:
                 print(f"🚨 ОТПРАВЛЯЕМ ЗАЯВКУ!")
                 print(f"   Намерение: {explicit_intent}")
                 print(f"   Процедура: {detected_procedure or 'Не определена'}")
@@ -453,24 +314,16 @@ async def handle_telegram_update(update: Dict[str, Any]):
                 
                 from telegram_utils import send_complete_application_to_telegram
                 
-                # Полная история диалога
-                full_conversation = "\n".join(session['text_parts'])
+                # Полная история диалога (собираем только сейчас, при отправке)
+                full_conversation = render_transcript(session)
                 source = "Telegram (личка @gladisSochi)" if is_business else "Telegram (личка боту)"
                 
-                session_with_source = session.copy()
-                session_with_source['source'] = source
-                
-                # Сохраняем процедуру если нашли в истории
-                if detected_procedure:
-                    session_with_source['procedure_type'] = detected_procedure
-                
-                # Добавляем всю историю для контекста
-                session_with_source['full_conversation'] = full_conversation
-                
+                # Процедуру из истории передаем отдельно, не копируя сессию
                 await asyncio.to_thread(
                     send_complete_application_to_telegram,
-                    session_with_source,
-                    f"📱 ИСТОЧНИК: {source}\n\n{full_conversation}"
+                    session,
+                    f"📱 ИСТОЧНИК: {source}\n\n{full_conversation}",
+                    detected_procedure
                 )
                 session['telegram_sent'] = True
                 print(f"✅ Заявка из Telegram отправлена в группу")
@@ -483,6 +336,9 @@ async def handle_telegram_update(update: Dict[str, Any]):
                 print(f"✅ Подтверждение отправлено клиенту")
                 # ===== КОНЕЦ НОВОГО КОДА =====
         
+        session = telegram_sessions.save_turn(session_key, session, revision)
+        session_scheduler.track('telegram', session_key, session)
+        
         print(f"📊 СОСТОЯНИЕ TELEGRAM СЕССИИ:")
         print(f"   👤 Имя: {'✅ ' + session['name'] if session['name'] else '❌ Нет'}")
         print(f"   📞 Телефон: {'✅ ' + str(session['phone']) if session['phone'] else '❌ Нет'}")
@@ -548,10 +404,6 @@ async def telegram_polling():
     print("   - личные сообщения @" + os.getenv("TELEGRAM_BOT_TOKEN", "").split(':')[0])
     print("   - бизнес-сообщения @gladisSochi (если бот подключен)")
     
-    # Запускаем периодическую очистку сессий
-    asyncio.create_task(periodic_cleanup())
-    print("🧹 Запущена периодическая очистка сессий (каждые 5 минут)")
-    
     offset = 0
     while True:
         try:
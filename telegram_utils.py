@@ -81,10 +81,11 @@ def send_incomplete_to_telegram(full_text: str, name: str = None, phone: str = N
         print(f"❌ Ошибка при отправке неполной заявки: {str(e)}")
         return False
 
-def send_complete_application_to_telegram(session: Dict[str, Any], full_conversation: str):
+def send_complete_application_to_telegram(session: Dict[str, Any], full_conversation: str, procedure_type: str = None):
     """
     Отправляет полную фабулу диалога в Telegram.
     Включает все детали, собранные ботом.
+    procedure_type — процедура, найденная в истории (если в сессии ее нет).
     """
     try:
         print(f"\n📨 ОТПРАВКА ПОЛНОЙ ФАБУЛЫ В TELEGRAM")
@@ -103,8 +104,9 @@ def send_complete_application_to_telegram(session: Dict[str, Any], full_conversa
         if session.get('procedure_category'):
             telegram_text += f"📋 КАТЕГОРИЯ ПРОЦЕДУРЫ: {session['procedure_category']}\n"
         
-        if session.get('procedure_type'):
-            telegram_text += f"💉 ВЫБРАННАЯ ПРОЦЕДУРА: {session['procedure_type']}\n"
+        procedure_type = procedure_type or session.get('procedure_type')
+        if procedure_type:
+            telegram_text += f"💉 ВЫБРАННАЯ ПРОЦЕДУРА: {procedure_type}\n"
         
         if session.get('zone'):
             telegram_text += f"📍 ЗОНА: {session['zone']}\n"
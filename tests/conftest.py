@@ -0,0 +1,11 @@
+import os
+import sys
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Тесты работают с заглушкой LLM в процессе: без сети и токена Replicate
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("LLM_FAKE_TTFT_MS", "1")
+os.environ.setdefault("LLM_FAKE_TTFT_SIGMA", "0")
+os.environ.setdefault("LLM_FAKE_TOKENS_PER_SECOND", "1000")
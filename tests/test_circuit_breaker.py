@@ -0,0 +1,163 @@
+import asyncio
+
+import pytest
+
+import circuit_breaker
+import llm_client
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from llm_backends import FakeBackend, FakeGenerator
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемые часы выключателя: clock.now двигается вручную."""
+    class Clock:
+        now = 1000.0
+
+        def monotonic(self):
+            return self.now
+
+    fake = Clock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', fake.monotonic)
+    return fake
+
+def _breaker():
+    return CircuitBreaker('test', window_seconds=60, min_calls=4, error_rate=0.5,
+                          slow_call_seconds=5, open_seconds=30)
+
+def _open(breaker):
+    for _ in range(2):
+        breaker.record_success(0.1)
+    for _ in range(2):
+        breaker.record_failure(0.1, "ошибка")
+
+def test_opens_only_after_min_calls_and_error_rate(clock):
+    breaker = _breaker()
+    breaker.record_failure(0.1, "ошибка")
+    breaker.record_failure(0.1, "ошибка")
+    assert breaker.state == CLOSED
+
+    breaker.record_success(0.1)
+    breaker.record_success(0.1)
+    breaker.record_failure(0.1, "ошибка")
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    assert breaker.stats()['rejected'] == 1
+
+def test_slow_success_counts_as_failure(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.record_success(6)
+    assert breaker.state == OPEN
+
+def test_closed_open_half_open_closed(clock):
+    breaker = _breaker()
+    _open(breaker)
+    assert breaker.state == OPEN
+
+    clock.now += 29
+    assert not breaker.allow_request()
+
+    clock.now += 1
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    # Пока пробный вызов в полете, остальные получают отказ
+    assert not breaker.allow_request()
+
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.stats()['calls_in_window'] == 1
+    assert breaker.allow_request()
+
+def test_failed_probe_opens_again(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.now += 30
+    assert breaker.allow_request()
+
+    breaker.record_failure(0.1, "снова ошибка")
+    assert breaker.state == OPEN
+    assert breaker.stats()['times_opened'] == 2
+    assert not breaker.allow_request()
+
+def test_lost_probe_is_replaced_after_open_seconds(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.now += 30
+    assert breaker.allow_request()
+
+    # О пробном вызове так и не сообщили
+    clock.now += 29
+    assert not breaker.allow_request()
+    clock.now += 1
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+
+def test_cancelled_calls_are_not_failures(clock):
+    breaker = _breaker()
+    for _ in range(10):
+        breaker.record_cancelled(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.stats()['calls_in_window'] == 0
+
+def test_slow_cancelled_call_counts_as_failure(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.record_cancelled(6)
+    assert breaker.state == OPEN
+
+def test_cancelled_probe_frees_slot_for_next_probe(clock):
+    breaker = _breaker()
+    _open(breaker)
+    clock.now += 30
+    assert breaker.allow_request()
+
+    breaker.record_cancelled(0.1)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+
+class SlowBackend(FakeBackend):
+    """Заглушка, которая отвечает дольше бюджета вызывающего."""
+
+    def __init__(self, seconds: float):
+        super().__init__(FakeGenerator(ttft_ms=1, ttft_sigma=0, tokens_per_second=0))
+        self.seconds = seconds
+
+    async def run_async(self, model, params, api_key=None):
+        await asyncio.sleep(self.seconds)
+        return "ответ", {}
+
+    async def stream_async(self, model, params, api_key=None):
+        yield "начало "
+        await asyncio.sleep(self.seconds)
+        yield "конец"
+
+@pytest.fixture
+def slow_llm(monkeypatch):
+    breaker = CircuitBreaker('test', min_calls=1, error_rate=0.5, slow_call_seconds=5)
+    monkeypatch.setattr(llm_client, 'get_backend', lambda: SlowBackend(1.0))
+    monkeypatch.setattr(llm_client, 'llm_breaker', breaker)
+    return breaker
+
+def test_caller_budget_does_not_open_breaker(slow_llm):
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(llm_client.run_text_async("промпт бюджета", 10, 0.5, site='test'), 0.05)
+
+    asyncio.run(scenario())
+    assert slow_llm.state == CLOSED
+    assert slow_llm.stats()['calls_in_window'] == 0
+
+def test_cancelled_stream_does_not_open_breaker(slow_llm):
+    async def scenario():
+        async def consume():
+            return [token async for token in llm_client.stream_text_async("промпт стрима", 10, 0.5, site='test')]
+
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(consume(), 0.05)
+
+    asyncio.run(scenario())
+    assert slow_llm.state == CLOSED
+    assert slow_llm.stats()['calls_in_window'] == 0
@@ -0,0 +1,110 @@
+import time
+import asyncio
+
+import pytest
+
+import llm_client
+from llm_backends import FakeBackend, FakeGenerator, LLMError
+
+class ModelLatencyBackend(FakeBackend):
+    """Заглушка, у которой время ответа задано для каждой модели."""
+
+    def __init__(self, latencies: dict, failing: set = ()):
+        super().__init__(FakeGenerator(ttft_ms=1, ttft_sigma=0, tokens_per_second=0))
+        self.latencies = latencies
+        self.failing = set(failing)
+        self.started = []
+        self.finished = []
+        self.cancelled = []
+
+    async def run_async(self, model, params, api_key=None):
+        self.started.append((model, time.perf_counter()))
+        try:
+            await asyncio.sleep(self.latencies[model])
+        except asyncio.CancelledError:
+            self.cancelled.append(model)
+            raise
+        if model in self.failing:
+            raise LLMError(f"модель {model} упала")
+        self.finished.append(model)
+        return f"ответ {model}", {}
+
+@pytest.fixture
+def hedge(monkeypatch):
+    """Настраивает место вызова 'test' и бэкенд с задержками по моделям."""
+    def configure(latencies, delay_ms=50, cancel_loser=True, failing=()):
+        backend = ModelLatencyBackend(latencies, failing)
+        monkeypatch.setattr(llm_client, 'get_backend', lambda: backend)
+        monkeypatch.setitem(llm_client.HEDGE_CONFIG, 'test', {
+            'delay_ms': delay_ms, 'models': ['primary', 'hedge'], 'cancel_loser': cancel_loser,
+        })
+        return backend
+    return configure
+
+def _run(model='primary'):
+    return llm_client._run_hedged_async("промпт", 10, 0.5, 0.9, model, None, 'test')
+
+def test_fast_primary_does_not_start_hedge(hedge):
+    backend = hedge({'primary': 0.01, 'hedge': 0.01})
+    text, model, _ = asyncio.run(_run())
+    assert (text, model) == ("ответ primary", 'primary')
+    assert [model for model, _ in backend.started] == ['primary']
+
+def test_slow_primary_is_hedged_after_delay_and_cancelled(hedge):
+    backend = hedge({'primary': 1.0, 'hedge': 0.01}, delay_ms=50)
+
+    async def scenario():
+        started = time.perf_counter()
+        result = await _run()
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0)
+        return result, elapsed
+
+    (text, model, _), elapsed = asyncio.run(scenario())
+    assert (text, model) == ("ответ hedge", 'hedge')
+    assert elapsed < 0.5
+    (primary, primary_at), (hedge_model, hedge_at) = backend.started
+    assert (primary, hedge_model) == ('primary', 'hedge')
+    assert 0.04 <= hedge_at - primary_at < 0.3
+    assert backend.cancelled == ['primary']
+
+def test_loser_finishes_in_background_without_cancel(hedge):
+    backend = hedge({'primary': 0.15, 'hedge': 0.01}, delay_ms=30, cancel_loser=False)
+
+    async def scenario():
+        result = await _run()
+        in_background = len(llm_client._background_tasks)
+        await asyncio.sleep(0.25)
+        return result, in_background
+
+    (text, model, _), in_background = asyncio.run(scenario())
+    assert model == 'hedge'
+    assert in_background == 1
+    assert backend.cancelled == []
+    assert backend.finished == ['hedge', 'primary']
+    assert not llm_client._background_tasks
+
+def test_failed_primary_starts_hedge_without_waiting(hedge):
+    backend = hedge({'primary': 0.0, 'hedge': 0.01}, delay_ms=5000, failing={'primary'})
+
+    async def scenario():
+        started = time.perf_counter()
+        result = await _run()
+        return result, time.perf_counter() - started
+
+    (text, model, _), elapsed = asyncio.run(scenario())
+    assert model == 'hedge'
+    assert elapsed < 1.0
+
+def test_caller_model_goes_first(hedge):
+    backend = hedge({'custom': 1.0, 'primary': 0.01, 'hedge': 0.01}, delay_ms=30)
+    text, model, _ = asyncio.run(_run('custom'))
+    # Основная модель из настроек заменена моделью вызова, запасная осталась
+    assert [model for model, _ in backend.started] == ['custom', 'hedge']
+    assert model == 'hedge'
+
+def test_caller_model_reaches_backend_through_run_text_async(hedge):
+    backend = hedge({'custom': 0.01, 'primary': 0.01, 'hedge': 0.01})
+    text = asyncio.run(llm_client.run_text_async("промпт", 10, 0.5, model='custom', site='test'))
+    assert text == "ответ custom"
+    assert [model for model, _ in backend.started] == ['custom']
@@ -0,0 +1,21 @@
+import pytest
+
+from keyword_matcher import match_keywords
+from keywords import CATALOG_PROCEDURE_LABELS, PROCEDURE_KEYWORDS
+
+def test_catalog_labels_are_procedure_labels():
+    assert set(CATALOG_PROCEDURE_LABELS.values()) <= set(PROCEDURE_KEYWORDS)
+
+@pytest.mark.parametrize("message, expected", [
+    ("хочу капельницу с витаминами", 'капельницы'),
+    ("сколько стоит эпиляция подмышек", 'лазерная эпиляция'),
+    ("хочу убрать пятна на лице", 'фотоомоложение'),
+    ("интересуют уколы красоты", 'мезотерапия'),
+    ("удаление татуировки на руке", 'удаление тату'),
+    ("проколоть уши ребенку", 'прокол ушей'),
+])
+def test_procedure_group(message, expected):
+    assert match_keywords(message).first('procedure') == expected
+
+def test_no_procedure():
+    assert match_keywords("здравствуйте, как к вам проехать?").first('procedure') is None
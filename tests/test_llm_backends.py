@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from llm_backends import LLMBackend, FakeBackend, FakeGenerator, OpenAICompatibleBackend, FAKE_DEFAULT_OUTPUTS
+
+def test_openai_backend_sends_model_of_the_call():
+    backend = OpenAICompatibleBackend(base_url="http://127.0.0.1:1/v1", model="local-default")
+    assert backend._body("meta/hedge-model", {'prompt': "x"})['model'] == "meta/hedge-model"
+    assert backend._body(None, {'prompt': "x"})['model'] == "local-default"
+
+def test_fake_outputs_file_is_loaded(tmp_path):
+    path = tmp_path / "outputs.json"
+    path.write_text(json.dumps([{'match': 'цена', 'output': 'Стоит 1000 руб.'}]), encoding='utf-8')
+    generator = FakeGenerator(ttft_ms=1, ttft_sigma=0, outputs_file=str(path))
+    assert generator.outputs == [{'match': 'цена', 'output': 'Стоит 1000 руб.'}] + FAKE_DEFAULT_OUTPUTS
+    assert "".join(generator.plan("какая цена?")['tokens']) == 'Стоит 1000 руб.'
+
+@pytest.mark.parametrize("content", [
+    {'match': 'цена', 'output': 'Стоит 1000 руб.'},
+    ["Стоит 1000 руб."],
+    [{'match': 'цена'}],
+])
+def test_fake_outputs_file_of_wrong_shape_fails_clearly(tmp_path, content):
+    path = tmp_path / "outputs.json"
+    path.write_text(json.dumps(content, ensure_ascii=False), encoding='utf-8')
+    with pytest.raises(ValueError, match="LLM_FAKE_OUTPUTS_FILE"):
+        FakeGenerator(outputs_file=str(path))
+
+def test_backend_interface_is_abstract():
+    with pytest.raises(TypeError):
+        LLMBackend()
+
+    class NoStreaming(LLMBackend):
+        def run(self, model, params, api_key=None):
+            return "", {}
+
+        async def run_async(self, model, params, api_key=None):
+            return "", {}
+
+    with pytest.raises(TypeError, match="stream_async"):
+        NoStreaming()
+    FakeBackend()
@@ -0,0 +1,46 @@
+import pytest
+
+from local_classifier import LOCAL_CLASSIFIER_THRESHOLD, build_procedure_classifier, classify_procedure
+from prices_loader import load_procedures
+
+@pytest.fixture(scope="module")
+def classifier():
+    return build_procedure_classifier(load_procedures().get('procedures', []))
+
+@pytest.mark.parametrize("message", [
+    "хочу на эпиляцию",
+    "эпиляцыя подмышек",
+    "сколько стоит эпиляцию ног",
+    "лазерная эпиляция бикини",
+    "удаление волос лазером",
+    "мне нужно убрать волосы",
+    "хочу удалить волосы на ногах",
+    "уберите волосы на руках",
+])
+def test_epilation_phrasings(classifier, message):
+    procedure, confidence = classify_procedure(classifier, message)
+    assert procedure == 'лазерная эпиляция'
+    assert confidence >= LOCAL_CLASSIFIER_THRESHOLD
+
+@pytest.mark.parametrize("message, expected", [
+    ("хочу записаться на капельницу", 'капельницы'),
+    ("ботокс лба", 'ботулотоксин'),
+    ("чистку лица хочу", 'чистка лица'),
+    ("хочу мезотерапию", 'мезотерапия'),
+    ("выпадают волосы, что посоветуете", 'мезотерапия'),
+    ("удалить татуировку", 'удаление тату'),
+    ("брови татуаж", 'перманентный макияж'),
+])
+def test_other_procedures(classifier, message, expected):
+    procedure, confidence = classify_procedure(classifier, message)
+    assert procedure == expected
+    assert confidence >= LOCAL_CLASSIFIER_THRESHOLD
+
+@pytest.mark.parametrize("message", [
+    "мне нужно",
+    "хочу записаться",
+    "здравствуйте",
+])
+def test_no_procedure(classifier, message):
+    procedure, _ = classify_procedure(classifier, message)
+    assert procedure is None
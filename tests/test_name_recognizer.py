@@ -0,0 +1,36 @@
+import pytest
+
+from local_classifier import LOCAL_CLASSIFIER_THRESHOLD
+from name_recognizer import recognize_name, case_forms
+
+@pytest.mark.parametrize("message, expected", [
+    ("Меня зовут Анна", "Анна"),
+    ("меня зовут тёма", "Тёма"),
+    ("Это Сергей, хочу на эпиляцию", "Сергей"),
+    ("здравствуйте, я ольга", "Ольга"),
+    ("анна 89181234567", "Анна"),
+    ("Добрый день, хочу записаться. Ольга", "Ольга"),
+])
+def test_confident_name(message, expected):
+    name, confidence = recognize_name(message)
+    assert name == expected
+    assert confidence >= LOCAL_CLASSIFIER_THRESHOLD
+
+@pytest.mark.parametrize("message", [
+    "вопрос на тему пилинга",
+    "по теме эпиляции",
+    "на какую тему консультация",
+    "хочу записать жене сертификат",
+    "запишите к Ирине Петровне",
+    "хочу к Марине на чистку",
+])
+def test_common_words_and_staff_names_are_not_confident(message):
+    name, confidence = recognize_name(message)
+    assert name is None or confidence < LOCAL_CLASSIFIER_THRESHOLD
+
+def test_no_name():
+    assert recognize_name("сколько стоит чистка лица?") == (None, 0.95)
+
+def test_case_forms():
+    assert 'машей' in case_forms('Маша')
+    assert 'павла' in case_forms('Павел')
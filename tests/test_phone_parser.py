@@ -0,0 +1,41 @@
+import pytest
+
+from phone_parser import find_phones, extract_phone, normalize_phone
+
+@pytest.mark.parametrize("text, expected", [
+    ("+7 (918) 123-45-67", "+79181234567"),
+    ("8.918.123.45.67", "+79181234567"),
+    ("Анна 89181234567", "+79181234567"),
+    ("Ольга, 9181234567", "+79181234567"),
+    ("Мой номер\n8918\n1234567", "+79181234567"),
+    ("в 15 8 918 123 45 67", "+79181234567"),
+    ("89181234567 в 12:00", "+79181234567"),
+])
+def test_finds_russian_phone(text, expected):
+    assert extract_phone(text)[0] == expected
+
+@pytest.mark.parametrize("text", [
+    "запишите на 30.04.2025 12:00",
+    "на 30.04.2025 14:00",
+    "можно 01/05/25 в 10:30?",
+])
+def test_dates_and_times_are_not_phones(text):
+    assert find_phones(text) == []
+
+@pytest.mark.parametrize("text", [
+    "+1 415 555 1234",
+    "+49 30 1234 5678",
+    "+8 918 123 45 67",
+])
+def test_foreign_numbers_are_rejected(text):
+    assert find_phones(text) == []
+    assert normalize_phone(text) is None
+
+def test_bare_ten_digits_need_mobile_code():
+    assert find_phones("4951234567") == []
+    assert normalize_phone("4951234567") is None
+    assert normalize_phone("9181234567") == "+79181234567"
+
+def test_several_phones_with_positions():
+    text = "+79181234567 и 89187654321"
+    assert find_phones(text) == [("+79181234567", 0, 12), ("+79187654321", 15, 26)]
@@ -0,0 +1,69 @@
+import pytest
+
+from price_engine import find_price_answer
+
+@pytest.mark.parametrize("message", ["сколько стоит ботокс", "цена на ботокс лба"])
+def test_botox_lists_whole_price(message):
+    answer, _ = find_price_answer(message)
+    assert answer is None or ("релатокс" in answer and "ботулакс" in answer)
+
+@pytest.mark.parametrize("message", ["какая цена у вас на пилинг", "сколько стоит пилинг"])
+def test_category_word_alone_is_not_a_partial_list(message):
+    answer, reason = find_price_answer(message)
+    assert answer is None
+    assert reason == "нужно уточнить зону или препарат"
+
+def test_tattoo_removal_lists_whole_price():
+    answer, _ = find_price_answer("стоимость удаления тату")
+    assert answer is not None
+    assert "шильдой" in answer and "по телу" in answer
+
+def test_zone_prefers_items_of_the_named_group():
+    answer, _ = find_price_answer("мезотерапия лица цена")
+    assert answer is not None
+    assert "DE ACNE" in answer
+    assert "Dr. Lipo" not in answer
+
+def test_zone_answer():
+    answer, _ = find_price_answer("сколько стоит эпиляция подмышек")
+    assert "подмышечные впадины" in answer
+
+def test_not_a_price_question():
+    assert find_price_answer("как к вам проехать?") == (None, "не вопрос о цене")
+
+def test_alias_that_is_another_procedures_item_goes_to_ai():
+    # "губ" — алиас контурной пластики, а "губы" — позиция перманентного макияжа
+    answer, reason = find_price_answer("какая цена на губы")
+    assert answer is None
+    assert reason == "подходит несколько процедур"
+
+def test_unknown_zone_does_not_list_other_zones():
+    answer, reason = find_price_answer("сколько стоит ботокс лба")
+    assert answer is None or "гипергидроз" not in answer
+    assert reason == "зона не найдена в прайсе"
+
+def test_prompt_and_price_engine_share_catalog_version(tmp_path, monkeypatch):
+    import shutil
+    import chatbot_logic
+    import price_engine
+    import prices_loader
+
+    catalog = tmp_path / 'procedures.json'
+    shutil.copy(prices_loader.PROCEDURES_FILE, catalog)
+    monkeypatch.setattr(prices_loader, 'PROCEDURES_FILE', str(catalog))
+
+    data, version = prices_loader.load_catalog()
+    assert chatbot_logic.get_catalog_version() == version
+    price_engine.find_price_answer("сколько стоит эпиляция подмышек")
+    assert price_engine._get_engine()['version'] == version
+
+    # Файл переписан тем же содержимым: версия и объект прайса те же
+    catalog.write_bytes(catalog.read_bytes() + b"\n")
+    catalog.write_bytes(catalog.read_bytes()[:-1])
+    assert prices_loader.load_catalog() == (data, version)
+    assert prices_loader.load_catalog()[0] is data
+
+    catalog.write_text('{"procedures": []}', encoding='utf-8')
+    new_version = chatbot_logic.get_catalog_version()
+    assert new_version != version
+    assert prices_loader.load_catalog()[1] == new_version
@@ -0,0 +1,44 @@
+import pytest
+
+from procedure_index import build_procedure_index, score_procedures, term_matches, message_tokens
+from prices_loader import load_procedures
+
+@pytest.fixture(scope="module")
+def catalog():
+    procedures = load_procedures().get('procedures', [])
+    return procedures, build_procedure_index(procedures)
+
+def _matched_ids(catalog, message):
+    procedures, index = catalog
+    return {procedures[position]['id'] for position in score_procedures(index, message)}
+
+@pytest.mark.parametrize("message, wrong_procedure", [
+    ("нужен уход за кожей лица", 'ear_piercing'),
+    ("какой уход после процедуры", 'ear_piercing'),
+    ("споры грибка на коже", 'face_cleaning'),
+])
+def test_alias_is_not_matched_inside_another_word(catalog, message, wrong_procedure):
+    assert wrong_procedure not in _matched_ids(catalog, message)
+
+@pytest.mark.parametrize("message, procedure", [
+    ("проколоть ухо", 'ear_piercing'),
+    ("прокол уха ребенку", 'ear_piercing'),
+    ("расширенные поры на носу", 'face_cleaning'),
+    ("перманентный макияж бровей", 'permanent_makeup'),
+    ("рф-лифтинг лица", 'rf_lifting_classic'),
+])
+def test_alias_matches_word_forms(catalog, message, procedure):
+    assert procedure in _matched_ids(catalog, message)
+
+@pytest.mark.parametrize("term, text, expected", [
+    ("ухо", "болит ухо", True),
+    ("ухо", "уход за кожей", False),
+    ("поры", "споры", False),
+    ("губ", "увеличение губ", True),
+    ("губ", "губы", True),
+    ("перманент", "перманентный", True),
+    ("удаление волос", "лазерное удаление волос", True),
+    ("удаление волос", "удаление тату, волосы", False),
+])
+def test_term_matches_from_word_start(term, text, expected):
+    assert term_matches(term, message_tokens(text)) is expected
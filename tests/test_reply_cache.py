@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+import chatbot_logic
+import llm_client
+from reply_cache import ReplyCache, reply_cache
+
+MESSAGE = "подскажите, где вы находитесь и как к вам проехать"
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """Модель, которая отвечает по-разному на каждый вызов."""
+    calls = []
+
+    async def run_text_async(prompt, **kwargs):
+        calls.append(prompt)
+        return f"Ответ номер {len(calls)}: Сочи, ул. Воровского, 22."
+
+    monkeypatch.setattr(llm_client, 'run_text_async', run_text_async)
+    reply_cache.clear()
+    yield calls
+    reply_cache.clear()
+
+def _reply(history=None):
+    return asyncio.run(chatbot_logic.generate_bot_reply_async('key', MESSAGE, history=history))
+
+def test_first_message_is_cached(fake_model):
+    first = _reply()
+    second = _reply()
+    assert first == second
+    assert len(fake_model) == 1
+
+def test_sessions_with_different_history_do_not_share_entry(fake_model):
+    reply_a = _reply(history="Клиент: меня зовут Анна, интересует эпиляция\nБот: Анна, записываю вас")
+    reply_b = _reply(history="Клиент: хочу ботокс\nБот: Подскажите зону")
+    assert reply_a != reply_b
+    assert len(fake_model) == 2
+
+def test_reply_with_history_is_not_served_to_first_message(fake_model):
+    _reply(history="Клиент: меня зовут Анна\nБот: Приятно познакомиться")
+    _reply()
+    assert len(fake_model) == 2
+
+def test_key_with_history_is_not_cacheable():
+    cache = ReplyCache(max_size=10)
+    key = cache.make_key(MESSAGE, False, False, False, False, None, history="Клиент: привет")
+    assert key is None
+    cache.put(key, "ответ", "v1")
+    assert cache.get(key, "v1") is None
+    assert cache.stats()['size'] == 0
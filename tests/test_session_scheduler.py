@@ -0,0 +1,102 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import session_scheduler
+from session_scheduler import EXPIRE, INCOMPLETE_LEAD, SessionScheduler
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """Планировщик с короткими сроками; события пишутся в scheduler.events."""
+    monkeypatch.setattr(session_scheduler, 'SESSION_INCOMPLETE_LEAD_SECONDS', 0.05)
+    monkeypatch.setattr(session_scheduler, 'SESSION_MAX_AGE_SECONDS', 0.1)
+
+    def create(sessions: dict = None):
+        scheduler = SessionScheduler()
+        scheduler.events = []
+
+        async def on_incomplete_lead(key):
+            scheduler.events.append((INCOMPLETE_LEAD, key))
+
+        async def on_expire(key):
+            scheduler.events.append((EXPIRE, key))
+
+        scheduler.register('web', sessions or {}, on_incomplete_lead, on_expire)
+        return scheduler
+    return create
+
+def _session(age_seconds: float = 0.0, contacts: bool = True) -> dict:
+    session = {'created_at': datetime.now() - timedelta(seconds=age_seconds)}
+    if contacts:
+        session.update(name="Анна", phone="+79161234567")
+    return session
+
+async def _run(scheduler, scenario, seconds: float):
+    """Запускает планировщик, выполняет сценарий и ждет, пока сработают сроки."""
+    scheduler.start()
+    try:
+        await scenario()
+        await asyncio.sleep(seconds)
+    finally:
+        scheduler._task.cancel()
+        await asyncio.gather(scheduler._task, return_exceptions=True)
+
+def test_events_fire_in_deadline_order(scheduler):
+    sched = scheduler()
+
+    async def scenario():
+        sched.track('web', 'late', _session())
+        sched.track('web', 'early', _session(age_seconds=0.03))
+        sched.track('web', 'no_contacts', _session(age_seconds=0.02, contacts=False))
+
+    asyncio.run(_run(sched, scenario, 0.25))
+    assert sched.events == [
+        (INCOMPLETE_LEAD, 'early'),
+        (INCOMPLETE_LEAD, 'late'),
+        (EXPIRE, 'early'),
+        (EXPIRE, 'no_contacts'),
+        (EXPIRE, 'late'),
+    ]
+    assert sched.stats()['queue_depth'] == 0
+    assert sched.stats()['fired'] == {INCOMPLETE_LEAD: 2, EXPIRE: 3}
+
+def test_restore_fires_overdue_deadlines_at_once(scheduler):
+    sessions = {
+        'old': _session(age_seconds=3600),
+        'sent': {**_session(age_seconds=3600), 'telegram_sent': True},
+    }
+    sched = scheduler(sessions)
+
+    async def scenario():
+        pass
+
+    asyncio.run(_run(sched, scenario, 0.02))
+    assert sorted(sched.events) == [(EXPIRE, 'old'), (EXPIRE, 'sent'), (INCOMPLETE_LEAD, 'old')]
+    # Срок просрочен давно, но задержка считается от постановки в очередь
+    assert sched.stats()['lag_ms']['max'] < 1000
+
+def test_repeated_track_does_not_duplicate_events(scheduler):
+    sched = scheduler()
+    session = _session()
+
+    async def scenario():
+        for _ in range(5):
+            sched.track('web', 'key', session)
+        assert sched.stats()['queued_by_kind'] == {INCOMPLETE_LEAD: 1, EXPIRE: 1}
+
+    asyncio.run(_run(sched, scenario, 0.2))
+    assert sched.events == [(INCOMPLETE_LEAD, 'key'), (EXPIRE, 'key')]
+
+def test_track_after_expire_schedules_again(scheduler):
+    sched = scheduler()
+
+    async def scenario():
+        sched.track('web', 'key', _session(contacts=False))
+        await asyncio.sleep(0.15)
+        assert sched.events == [(EXPIRE, 'key')]
+        # Сессию с тем же ключом создали заново
+        sched.track('web', 'key', _session(contacts=False))
+
+    asyncio.run(_run(sched, scenario, 0.15))
+    assert sched.events == [(EXPIRE, 'key'), (EXPIRE, 'key')]
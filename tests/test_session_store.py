@@ -0,0 +1,329 @@
+import time
+import asyncio
+import threading
+
+import pytest
+
+import fake_redis_server
+from chat_session import new_web_session
+from session_history import append_message, session_revision, mark_incomplete_sent
+from session_store import (
+    MemorySessionStore, SessionJournal, JournalSessionStore,
+    SQLiteDatabase, SQLiteSessionStore, RedisConnection, RedisSessionStore,
+)
+
+BACKENDS = ['memory', 'journal', 'sqlite', 'redis']
+
+@pytest.fixture(scope="module")
+def redis_url():
+    """Заглушка Redis в отдельном потоке на свободном порту."""
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    async def start():
+        state['server'] = await asyncio.start_server(fake_redis_server._handle_client, '127.0.0.1', 0)
+        state['port'] = state['server'].sockets[0].getsockname()[1]
+        started.set()
+
+    thread = threading.Thread(target=lambda: (loop.run_until_complete(start()), loop.run_forever()), daemon=True)
+    thread.start()
+    started.wait(5)
+    yield f"redis://127.0.0.1:{state['port']}/0"
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+@pytest.fixture
+def open_store(request, tmp_path, redis_url):
+    """
+    Фабрика хранилищ выбранного бэкенда. Для sqlite и redis каждый вызов —
+    отдельное соединение, как у другого воркера; memory и journal живут в одном процессе.
+    """
+    backend = request.param
+    shared = {}
+    journals = []
+
+    def open_store(namespace='web'):
+        if backend == 'memory':
+            shared.setdefault('store', MemorySessionStore(namespace))
+            return shared['store']
+        if backend == 'journal':
+            if 'store' not in shared:
+                journal = SessionJournal(str(tmp_path / 'journal'), fsync_ms=10)
+                journals.append(journal)
+                shared['store'] = JournalSessionStore(namespace, journal)
+            return shared['store']
+        if backend == 'sqlite':
+            return SQLiteSessionStore(namespace, SQLiteDatabase(str(tmp_path / 'sessions.db')))
+        return RedisSessionStore(namespace, RedisConnection(redis_url))
+
+    if backend == 'redis':
+        RedisConnection(redis_url).call('FLUSHDB')
+    yield open_store
+    for journal in journals:
+        journal.close()
+
+def _add_message(session, text: str):
+    session['memory'].add_client(text)
+    append_message(session, text)
+    session['message_count'] += 1
+
+@pytest.mark.parametrize("open_store", BACKENDS, indirect=True)
+def test_save_get_delete(open_store):
+    store = open_store()
+    session = new_web_session('127.0.0.1')
+    session['name'] = 'Анна'
+    _add_message(session, 'хочу на эпиляцию')
+    store.save('abc', session)
+
+    loaded = store.get('abc')
+    assert loaded['name'] == 'Анна'
+    assert loaded['text_parts'] == ['хочу на эпиляцию']
+    assert loaded['memory'].render() == session['memory'].render()
+    assert 'abc' in store and len(store) == 1
+    assert [key for key, _ in store.items()] == ['abc']
+
+    store.delete('abc')
+    assert store.get('abc') is None
+    assert len(store) == 0
+
+@pytest.mark.parametrize("open_store", BACKENDS, indirect=True)
+def test_claim_is_granted_once_across_workers(open_store):
+    first, second = open_store(), open_store()
+    first.save('abc', new_web_session())
+    assert first.claim('abc', 'incomplete_lead') is True
+    assert second.claim('abc', 'incomplete_lead') is False
+    assert first.claim('abc', 'incomplete_lead') is False
+    # Другие события и другие сессии захватываются независимо
+    assert second.claim('abc', 'other_event') is True
+    assert second.claim('xyz', 'incomplete_lead') is True
+
+@pytest.mark.parametrize("open_store", BACKENDS, indirect=True)
+def test_turn_keeps_lead_flags_written_meanwhile(open_store):
+    handler, scheduler = open_store(), open_store()
+    session = new_web_session()
+    session['name'], session['phone'] = 'Анна', '+79001234567'
+    handler.save('abc', session)
+
+    # Обработчик взял копию и ждет модель, а неполная заявка ушла по сроку
+    session = handler.get('abc')
+    revision = session_revision(session)
+    _add_message(session, 'а сколько стоит?')
+    assert scheduler.claim('abc', 'incomplete_lead')
+    scheduler.update('abc', mark_incomplete_sent)
+
+    saved = handler.save_turn('abc', session, revision)
+    assert saved['telegram_sent'] and saved['incomplete_sent']
+    assert handler.lead_sent('abc')
+    stored = scheduler.get('abc')
+    assert stored['telegram_sent'] and stored['incomplete_sent']
+    assert stored['text_parts'] == ['а сколько стоит?']
+
+@pytest.mark.parametrize("open_store", BACKENDS, indirect=True)
+def test_concurrent_turns_of_one_session_are_merged(open_store):
+    first, second = open_store(), open_store()
+    first.save('abc', new_web_session())
+
+    session_a = first.get('abc')
+    revision_a = session_revision(session_a)
+    session_b = second.get('abc')
+    revision_b = session_revision(session_b)
+
+    _add_message(session_a, 'меня зовут Анна')
+    session_a['name'] = 'Анна'
+    _add_message(session_b, 'мой телефон 89001234567')
+    session_b['phone'] = '+79001234567'
+
+    first.save_turn('abc', session_a, revision_a)
+    second.save_turn('abc', session_b, revision_b)
+
+    stored = first.get('abc')
+    assert stored['name'] == 'Анна'
+    assert stored['phone'] == '+79001234567'
+    assert stored['message_count'] == 2
+    assert sorted(stored['text_parts']) == sorted(['меня зовут Анна', 'мой телефон 89001234567'])
+    assert stored['memory'].total_turns == 2
+
+@pytest.mark.parametrize("open_store", BACKENDS, indirect=True)
+def test_update_without_session_saves_nothing(open_store):
+    store = open_store()
+    assert store.update('missing', mark_incomplete_sent) is None
+    assert store.get('missing') is None
+
+def test_sqlite_items_drops_expired_sessions_and_claims(tmp_path):
+    database = SQLiteDatabase(str(tmp_path / 'sessions.db'), ttl_seconds=60)
+    store = SQLiteSessionStore('web', database)
+    store.save('old', new_web_session())
+    store.save('fresh', new_web_session())
+    assert store.claim('old', 'incomplete_lead')
+
+    stale = database.expired_before() - 1
+    database.execute("UPDATE sessions SET updated_at = ? WHERE key = 'old'", (stale,))
+    database.execute("UPDATE session_claims SET claimed_at = ? WHERE key = 'old'", (stale,))
+
+    # Просроченная сессия не видна даже до очистки
+    assert store.get('old') is None
+    assert len(store) == 1
+    assert [key for key, _ in store.items()] == ['fresh']
+    assert database.execute("SELECT COUNT(*) FROM sessions WHERE key = 'old'")[0][0] == 0
+    # Захват просроченной сессии удален вместе с ней
+    assert store.claim('old', 'incomplete_lead')
+
+def test_redis_update_retries_after_concurrent_write(redis_url):
+    connection = RedisConnection(redis_url)
+    connection.call('FLUSHDB')
+    store = RedisSessionStore('web', connection)
+    other = RedisSessionStore('web', RedisConnection(redis_url))
+    store.save('abc', new_web_session())
+
+    calls = []
+
+    def apply(stored):
+        calls.append(stored['message_count'])
+        if len(calls) == 1:
+            # Между WATCH и EXEC сессию сохраняет другой воркер
+            changed = other.get('abc')
+            changed['message_count'] = 5
+            other.save('abc', changed)
+        stored['name'] = 'Анна'
+        return stored
+
+    saved = store.update('abc', apply)
+    assert calls == [0, 5]
+    assert saved['name'] == 'Анна'
+    stored = other.get('abc')
+    assert stored['name'] == 'Анна' and stored['message_count'] == 5
+
+def test_redis_claims_are_not_counted_as_sessions(redis_url):
+    connection = RedisConnection(redis_url)
+    connection.call('FLUSHDB')
+    store = RedisSessionStore('web', connection, ttl_seconds=30)
+    assert store.claim('abc', 'incomplete_lead')
+    keys = connection.call('SCAN', 0, 'MATCH', '*', 'COUNT', 100)[1]
+    # Захват лежит вне префикса сессий и не считается сессией
+    assert len(keys) == 1 and len(store) == 0
+
+def _open_journal(directory, **options):
+    # Без фоновых снимков: поколения переключает только сам тест
+    return SessionJournal(str(directory), fsync_ms=10, snapshot_records=10 ** 6, snapshot_seconds=10 ** 6, **options)
+
+def _crash(journal):
+    """Останавливает журнал без снимка при остановке — как при падении процесса."""
+    journal._stopping = True
+    journal._wakeup.set()
+    journal._thread.join(5)
+    journal._fsync_pending()
+    journal._file.close()
+
+def _session(name: str):
+    session = new_web_session()
+    session['name'] = name
+    return session
+
+def _current_journal(directory):
+    return sorted(path for path in directory.iterdir() if path.name.startswith('journal-'))[-1]
+
+def test_journal_replay_skips_torn_last_line(tmp_path):
+    journal = _open_journal(tmp_path)
+    journal.save('web', 'a', _session('Анна'))
+    journal.save('web', 'b', _session('Вера'))
+    _crash(journal)
+    with open(_current_journal(tmp_path), 'ab') as f:
+        f.write(b'0badc0de {"op": "save", "ns": "web", "key": "c"')
+
+    restored = _open_journal(tmp_path)
+    try:
+        assert sorted(restored.namespaces['web']) == ['a', 'b']
+        assert restored.replay['journal_records'] == 2
+        assert restored.replay['corrupt_records'] == 1
+    finally:
+        _crash(restored)
+
+def test_journal_replay_rejects_crc_mismatch(tmp_path):
+    journal = _open_journal(tmp_path)
+    journal.save('web', 'a', _session('Анна'))
+    journal.save('web', 'b', _session('Вера'))
+    _crash(journal)
+    path = _current_journal(tmp_path)
+    data = path.read_bytes()
+    # Последняя запись повреждена внутри JSON: контрольная сумма не сходится
+    assert data.count('Вера'.encode()) == 1
+    path.write_bytes(data.replace('Вера'.encode(), 'Вира'.encode()))
+
+    restored = _open_journal(tmp_path)
+    try:
+        assert sorted(restored.namespaces['web']) == ['a']
+        assert restored.replay['corrupt_records'] == 1
+    finally:
+        _crash(restored)
+
+def test_journal_replay_after_compaction(tmp_path):
+    journal = _open_journal(tmp_path)
+    journal.save('web', 'a', _session('Анна'))
+    journal.save('web', 'b', _session('Вера'))
+    journal.compact()
+    journal.save('web', 'c', _session('Ольга'))
+    journal.delete('web', 'a')
+    _crash(journal)
+    # Журналы до снимка удалены, остался только текущий
+    assert [path.name for path in tmp_path.iterdir() if path.name.startswith('journal-')] == [_current_journal(tmp_path).name]
+
+    restored = _open_journal(tmp_path)
+    try:
+        sessions = restored.namespaces['web']
+        assert sorted(sessions) == ['b', 'c']
+        assert sessions['c']['name'] == 'Ольга'
+        assert restored.replay['snapshot_records'] == 2
+        assert restored.replay['journal_records'] == 2
+        assert restored.generation > journal.generation
+    finally:
+        _crash(restored)
+
+def test_journal_replay_drops_sessions_older_than_ttl(tmp_path):
+    journal = _open_journal(tmp_path, ttl_seconds=60)
+    journal.save('web', 'snapshot_old', _session('Анна'))
+    journal.save('web', 'snapshot_fresh', _session('Вера'))
+    journal.saved_at[('web', 'snapshot_old')] = time.time() - 120
+    journal.compact()
+    journal.save('web', 'journal_fresh', _session('Ольга'))
+    with journal._lock:
+        journal._write(journal._encode_record('save', 'web', 'journal_old', _session('Нина'), time.time() - 120))
+    _crash(journal)
+
+    restored = _open_journal(tmp_path, ttl_seconds=60)
+    try:
+        assert sorted(restored.namespaces['web']) == ['journal_fresh', 'snapshot_fresh']
+    finally:
+        _crash(restored)
+
+def test_journal_compaction_keeps_old_generation_when_session_fails_to_encode(tmp_path, monkeypatch):
+    journal = _open_journal(tmp_path)
+    journal.save('web', 'a', _session('Анна'))
+    journal.save('web', 'busy', _session('Вера'))
+    journals_before = sorted(path.name for path in tmp_path.iterdir())
+
+    encode_record = SessionJournal._encode_record
+    attempts = []
+
+    def flaky_encode(op, namespace, key, session=None, at=None):
+        if key == 'busy':
+            attempts.append(key)
+            raise RuntimeError("deque mutated during iteration")
+        return encode_record(op, namespace, key, session, at)
+
+    monkeypatch.setattr(journal, '_encode_record', flaky_encode)
+    journal.compact()
+    monkeypatch.undo()
+
+    assert len(attempts) == 3
+    assert journal.errors == 1
+    assert not (tmp_path / SessionJournal.SNAPSHOT_FILE).exists()
+    assert set(journals_before) <= {path.name for path in tmp_path.iterdir()}
+
+    journal.save('web', 'c', _session('Ольга'))
+    _crash(journal)
+    restored = _open_journal(tmp_path)
+    try:
+        assert sorted(restored.namespaces['web']) == ['a', 'busy', 'c']
+    finally:
+        _crash(restored)
@@ -0,0 +1,162 @@
+import asyncio
+import threading
+
+import pytest
+
+import llm_client
+from circuit_breaker import CircuitBreaker
+from llm_backends import FakeBackend, FakeGenerator, LLMError
+
+class GatedBackend(FakeBackend):
+    """Заглушка, которая отвечает, когда тест откроет ворота (или падает с ошибкой)."""
+
+    def __init__(self, error: Exception = None):
+        super().__init__(FakeGenerator(ttft_ms=1, ttft_sigma=0, tokens_per_second=0))
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+        self.release_sync = threading.Event()
+        self.release = None
+
+    async def run_async(self, model, params, api_key=None):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return f"ответ {self.calls}", {}
+
+    def run(self, model, params, api_key=None):
+        self.calls += 1
+        self.release_sync.wait(5)
+        if self.error:
+            raise self.error
+        return f"ответ {self.calls}", {}
+
+@pytest.fixture
+def backend(monkeypatch):
+    def configure(error=None):
+        backend = GatedBackend(error)
+        monkeypatch.setattr(llm_client, 'get_backend', lambda: backend)
+        # Свой выключатель: ошибки тестов не должны размыкать общий
+        monkeypatch.setattr(llm_client, 'llm_breaker', CircuitBreaker('test', min_calls=1000))
+        return backend
+    return configure
+
+def _call():
+    return llm_client.run_text_async("одинаковый промпт", 10, 0.5)
+
+async def _start(count: int) -> list:
+    tasks = [asyncio.ensure_future(_call()) for _ in range(count)]
+    await asyncio.sleep(0.01)
+    return tasks
+
+def test_leader_cancellation_keeps_generation_for_waiters(backend):
+    fake = backend()
+
+    async def scenario():
+        fake.release = asyncio.Event()
+        leader, waiter = await _start(2)
+        leader.cancel()
+        await asyncio.sleep(0.01)
+        fake.release.set()
+        return await waiter, leader.cancelled()
+
+    result, leader_cancelled = asyncio.run(scenario())
+    assert result == "ответ 1"
+    assert leader_cancelled
+    assert fake.calls == 1 and fake.cancelled == 0
+    assert not llm_client._inflight_async
+
+def test_last_waiter_cancellation_cancels_shared_generation(backend):
+    fake = backend()
+
+    async def scenario():
+        fake.release = asyncio.Event()
+        first, second = await _start(2)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert fake.cancelled == 0
+        second.cancel()
+        await asyncio.sleep(0.01)
+        # Новый такой же запрос начинает свою генерацию, а не ждет отмененную
+        fake.release.set()
+        return await _call()
+
+    assert asyncio.run(scenario()) == "ответ 2"
+    assert fake.cancelled == 1
+    assert fake.calls == 2
+
+def test_error_reaches_every_waiter(backend):
+    fake = backend(LLMError("провайдер упал"))
+
+    async def scenario():
+        fake.release = asyncio.Event()
+        tasks = await _start(3)
+        fake.release.set()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert fake.calls == 1
+    assert all(isinstance(result, LLMError) and str(result) == "провайдер упал" for result in results)
+    assert not llm_client._inflight_async
+
+def test_event_loops_do_not_share_flights(backend):
+    fake = backend()
+    results = []
+    started = threading.Barrier(2)
+
+    class ThreadEvent:
+        """Ворота, которые открываются из другого потока."""
+        async def wait(self):
+            while not fake.release_sync.is_set():
+                await asyncio.sleep(0.005)
+
+    fake.release = ThreadEvent()
+
+    def worker():
+        async def scenario():
+            started.wait(5)
+            return await _call()
+        results.append(asyncio.run(scenario()))
+
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while fake.calls < 2 and all(thread.is_alive() for thread in threads):
+        threading.Event().wait(0.005)
+    fake.release_sync.set()
+    for thread in threads:
+        thread.join(5)
+
+    # У каждого цикла событий своя генерация: задачу чужого цикла ждать нельзя
+    assert fake.calls == 2
+    assert sorted(results) == ["ответ 2", "ответ 2"]
+
+def test_sync_callers_share_one_generation_and_its_error(backend):
+    fake = backend(LLMError("провайдер упал"))
+    errors = []
+
+    def worker():
+        try:
+            llm_client.run_text("одинаковый промпт", 10, 0.5)
+        except LLMError as e:
+            errors.append(e)
+
+    coalesced = llm_client.get_single_flight_stats()['coalesced']
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    # Отпускаем генерацию, когда оба остальных потока присоединились к ней
+    while llm_client.get_single_flight_stats()['coalesced'] < coalesced + 2:
+        threading.Event().wait(0.005)
+    fake.release_sync.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert fake.calls == 1
+    assert len(errors) == 3 and len({id(error) for error in errors}) == 1
+    assert not llm_client._inflight_sync
@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+
+import chatbot_logic
+import llm_client
+from llm_backends import FakeBackend
+from reply_cache import reply_cache
+
+MESSAGE = "расскажите подробнее, как проходит процедура и сколько длится восстановление"
+
+class ScriptedBackend(FakeBackend):
+    """Заглушка с заданной задержкой первого токена; запоминает, закрыт ли поток."""
+
+    def __init__(self, ttft: float, tokens: list):
+        super().__init__()
+        self.ttft = ttft
+        self.tokens = tokens
+        self.closed = False
+        self.completed = False
+
+    async def stream_async(self, model, params, api_key=None):
+        try:
+            await asyncio.sleep(self.ttft)
+            for token in self.tokens:
+                yield token
+                await asyncio.sleep(0)
+            self.completed = True
+        finally:
+            self.closed = True
+
+@pytest.fixture
+def backend(monkeypatch):
+    def install(ttft, tokens=("Процедура ", "длится ", "около часа.")):
+        scripted = ScriptedBackend(ttft, list(tokens))
+        monkeypatch.setattr(llm_client, 'get_backend', lambda: scripted)
+        return scripted
+    reply_cache.clear()
+    yield install
+    reply_cache.clear()
+
+async def _collect(stream, limit=None):
+    events = []
+    async for event in stream:
+        events.append(event)
+        if limit and len(events) >= limit:
+            break
+    return events
+
+def test_stream_yields_tokens_then_reply(backend):
+    scripted = backend(0)
+    events = asyncio.run(_collect(chatbot_logic.stream_bot_reply('key', MESSAGE, token_timeout=1)))
+    assert [text for event, text in events if event == 'token'] == scripted.tokens
+    assert events[-1] == ('done', "Процедура длится около часа.")
+    assert scripted.completed and scripted.closed
+
+def test_stalled_first_token_falls_back_and_cancels(backend):
+    scripted = backend(30)
+    started = time.monotonic()
+    events = asyncio.run(_collect(chatbot_logic.stream_bot_reply('key', MESSAGE, token_timeout=0.05)))
+    assert time.monotonic() - started < 2
+    assert events == [('done', chatbot_logic.get_ai_error_fallback(MESSAGE))]
+    assert scripted.closed and not scripted.completed
+
+def test_closing_stream_early_closes_generation(backend):
+    scripted = backend(0)
+
+    async def read_one_token():
+        stream = chatbot_logic.stream_bot_reply('key', MESSAGE, token_timeout=1)
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+
+    assert asyncio.run(read_one_token()) == ('token', "Процедура ")
+    assert scripted.closed and not scripted.completed
+
+class _Client:
+    host = "127.0.0.1"
+
+class _Request:
+    """Минимальный запрос для вызова эндпоинта напрямую."""
+
+    client = _Client()
+
+    def __init__(self, payload: dict):
+        self._payload = payload
+
+    async def json(self):
+        return self._payload
+
+def test_dropped_stream_keeps_the_turn(backend, monkeypatch):
+    import main
+
+    scripted = backend(0)
+    session_id = "dropped-stream-session"
+    monkeypatch.setattr(main, 'resolve_session_id', lambda raw: session_id)
+
+    async def drop_after_first_token():
+        response = await main.chat_stream_endpoint(_Request({"message": MESSAGE}))
+        stream = response.body_iterator
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first
+
+    first = asyncio.run(drop_after_first_token())
+    assert first.startswith("event: token")
+    assert scripted.closed and not scripted.completed
+
+    rendered = main.user_sessions.get(session_id)['memory'].render()
+    assert MESSAGE[:30] in rendered
+    assert "Процедура" in rendered
@@ -0,0 +1,104 @@
+"""
+Нормализация сообщения клиента — один раз на запрос.
+
+Раньше каждый обработчик (chat_endpoint, extract_contacts_from_message,
+is_simple_greeting, handle_pigmentation_question и т.д.) заново приводил
+сообщение к нижнему регистру и просматривал его целиком, а ё и пунктуация
+нигде не учитывались («Ещё», «привет!!!»). Теперь обработчик запроса один
+раз вызывает normalize_message и передает результат дальше по цепочке.
+
+NormalizedMessage — это строка (ее можно вставлять в промпт, логировать,
+класть в ключ кэша), у которой уже посчитаны:
+- text_lower — текст в нижнем регистре (его же возвращает lower())
+- folded — нижний регистр, ё→е, без пунктуации и лишних пробелов
+- tokens и stems — слова и их основы (без падежных окончаний)
+- keywords — все группы ключевых слов (keyword_matcher, один проход)
+- phones и phone — найденные телефоны с позициями (phone_parser)
+- name — имя клиента по словарю (name_recognizer)
+Тяжелые поля считаются при первом обращении и запоминаются в объекте.
+
+В хранилище сессий кладется обычная строка (str(message)), а не объект.
+"""
+
+import re
+from functools import cached_property
+
+from keyword_matcher import match_keywords
+from phone_parser import find_phones
+from name_recognizer import recognize_name
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+_SPACES_RE = re.compile(r'\s+')
+
+# Окончания для простого стемминга: сначала длинные
+_ENDINGS = sorted({
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ого', 'его', 'ому', 'ему',
+    'ыми', 'ими', 'ией', 'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее',
+    'ые', 'ие', 'ом', 'ем', 'ам', 'ям', 'ую', 'юю', 'ов', 'ев', 'ью',
+    'ия', 'ию', 'ии', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+}, key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+def fold_text(text: str) -> str:
+    """Нижний регистр, ё→е, пунктуация заменена пробелами, пробелы схлопнуты."""
+    if isinstance(text, NormalizedMessage):
+        return text.folded
+    folded = text.lower().replace('ё', 'е')
+    folded = _PUNCTUATION_RE.sub(' ', folded)
+    return _SPACES_RE.sub(' ', folded).strip()
+
+def stem_word(word: str) -> str:
+    """Основа слова: отрезает самое длинное падежное окончание, если основа не короче MIN_STEM_LENGTH."""
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+class NormalizedMessage(str):
+    """Сообщение клиента с результатами нормализации и детекторов."""
+
+    def __new__(cls, text: str):
+        message = super().__new__(cls, text)
+        message.text_lower = str.lower(message)
+        message.folded = fold_text(message.text_lower)
+        return message
+
+    def lower(self) -> str:
+        return self.text_lower
+
+    @cached_property
+    def tokens(self) -> tuple:
+        return tuple(self.folded.split())
+
+    @cached_property
+    def stems(self) -> tuple:
+        return tuple(stem_word(token) for token in self.tokens)
+
+    @cached_property
+    def keywords(self):
+        """Найденные группы ключевых слов (KeywordMatches)."""
+        return match_keywords(self)
+
+    @cached_property
+    def phones(self) -> list:
+        """Телефоны: список (номер в E.164, начало, конец) по исходному тексту."""
+        return find_phones(str(self))
+
+    @property
+    def phone(self) -> tuple:
+        """Первый телефон: (номер в E.164, позиция) или (None, -1), как phone_parser.extract_phone."""
+        if not self.phones:
+            return None, -1
+        phone, start, _ = self.phones[0]
+        return phone, start
+
+    @cached_property
+    def name(self) -> tuple:
+        """(имя или None, уверенность) — name_recognizer.recognize_name."""
+        return recognize_name(str(self))
+
+def normalize_message(message: str) -> NormalizedMessage:
+    """Нормализованное сообщение; уже нормализованное возвращается как есть."""
+    if isinstance(message, NormalizedMessage):
+        return message
+    return NormalizedMessage(message or "")